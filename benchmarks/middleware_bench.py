@@ -0,0 +1,187 @@
+# benchmarks/middleware_bench.py
+# ミドルウェアの比較（以前の @app.middleware("http") 3段 と RequestMiddleware）
+#
+# サーバーやネットワークを挟まず、ASGIアプリを直接呼び出して1秒あたりの処理件数とレイテンシ（p50/p99）を測る
+# DBはSQLiteのメモリDBのセッションを使う（ミドルウェア自体の負荷だけを比べるため）
+#
+# 使い方（リポジトリのルートで実行）:
+#   python -m benchmarks.middleware_bench
+#   python -m benchmarks.middleware_bench --requests 20000
+
+import time
+import asyncio
+import statistics
+import logging
+import argparse
+from fastapi import FastAPI, Request, Response, Depends
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from lineapi.database import RequestSession, get_db
+from middleware import RequestMiddleware
+
+BenchSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=create_engine("sqlite://"))
+
+# (名前, パス) ※ /api/missing は404の置き換えを通る
+CASES = [
+    ("asset", "/asset"),
+    ("api", "/api/ping"),
+    ("api+db", "/api/db"),
+    ("api 404", "/api/missing"),
+    ("stream", "/stream"),
+]
+
+
+class BenchRequestSession(RequestSession):
+    def __init__(self):
+        super().__init__(BenchSessionLocal)
+
+
+def add_routes(app):
+    @app.get("/asset")
+    async def asset():
+        return Response(b"x" * 1024, media_type="application/javascript")
+
+    @app.get("/api/ping")
+    async def ping():
+        return {"status": "ok"}
+
+    @app.get("/api/db")
+    async def with_db(db=Depends(get_db)):
+        return {"active": db.is_active}
+
+    @app.get("/api/missing")
+    async def missing():
+        return JSONResponse(status_code=404, content={"detail": "Not found"})
+
+    @app.get("/stream")
+    async def stream():
+        async def chunks():
+            for _ in range(8):
+                yield b"x" * 1024
+        return StreamingResponse(chunks(), media_type="application/octet-stream")
+
+def build_legacy_app():
+    # 変更前の main.py と同じ構成
+    app = FastAPI()
+
+    @app.middleware("http")
+    async def db_session_middleware(request: Request, call_next):
+        response = Response("Internal server error", status_code=500)
+        try:
+            request.state.db = BenchSessionLocal()
+            response = await call_next(request)
+        finally:
+            request.state.db.close()
+        return response
+
+    @app.middleware("http")
+    async def log_requests(request: Request, call_next):
+        logging.getLogger(__name__).info(f"Received request: {request.method} {request.url.path}")
+        response = await call_next(request)
+        logging.getLogger(__name__).info(f"Response status: {response.status_code}")
+        return response
+
+    @app.middleware("http")
+    async def api_middleware(request: Request, call_next):
+        if request.url.path.startswith("/api/"):
+            response = await call_next(request)
+            if response.status_code == 404:
+                return JSONResponse(status_code=404, content={"detail": "API endpoint not found"})
+            return response
+        return await call_next(request)
+
+    add_routes(app)
+    return app
+
+def build_asgi_app():
+    app = FastAPI()
+    app.add_middleware(RequestMiddleware, session_class=BenchRequestSession)
+    add_routes(app)
+    return app
+
+async def call(app, path):
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode("ascii"),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("bench", 80),
+    }
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # 切断されるまで待つ（BaseHTTPMiddlewareは切断の監視でreceiveを呼び続ける）
+        await asyncio.Event().wait()
+
+    status = None
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+async def measure(app, path, requests, concurrency):
+    # 最初の数回は計測しない（ルートの初期化などを除くため）
+    for _ in range(50):
+        await call(app, path)
+
+    remaining = requests
+    latencies = []
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            call_started = time.perf_counter()
+            await call(app, path)
+            latencies.append(time.perf_counter() - call_started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    percentiles = statistics.quantiles(latencies, n=100)
+    # (req/s, p50ミリ秒, p99ミリ秒)
+    return requests / elapsed, percentiles[49] * 1000, percentiles[98] * 1000
+
+async def run(requests, concurrency):
+    apps = [("before", build_legacy_app()), ("after", build_asgi_app())]
+    print(
+        f"{'case':<10}{'before req/s':>14}{'after req/s':>14}{'ratio':>8}"
+        f"{'before p50/p99 ms':>20}{'after p50/p99 ms':>20}"
+    )
+    for name, path in CASES:
+        results = {}
+        for label, app in apps:
+            results[label] = await measure(app, path, requests, concurrency)
+        before, after = results["before"], results["after"]
+        print(
+            f"{name:<10}{before[0]:>14.0f}{after[0]:>14.0f}{after[0] / before[0]:>7.2f}x"
+            f"{before[1]:>12.2f}/{before[2]:<7.2f}{after[1]:>12.2f}/{after[2]:<7.2f}"
+        )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ミドルウェアのスループット比較")
+    parser.add_argument("--requests", type=int, default=5000, help="ケースごとのリクエスト数")
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args(argv)
+    # ログ出力の時間を測らないようにする
+    logging.disable(logging.WARNING)
+    asyncio.run(run(args.requests, args.concurrency))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+# img/backfill.py
+# 保存済み画像の変換画像（サイズ・形式）をまとめて事前生成する
+#
+# 使い方:
+#   python -m img.backfill --size 320x320 --size 640x0 --format webp
+#   python -m img.backfill --size 320x320 --dry-run
+#   python -m img.backfill --size 320x320 --workers 4 --rate 50
+#
+# 中断しても --checkpoint のファイルから続きを再開できる（最初からやり直す場合は --reset）
+#
+# 変換画像は容量上限付きのLRU（IMG_CACHE_MAX_BYTES）に書き込むため、上限を超える量を生成しても
+# 先に生成したものから追い出される。開始前に先頭の数件を変換して合計サイズを見積もり、
+# 上限を超える場合は --force を付けない限り生成しない（--dry-run は見積もりだけを表示する）
+
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from img.config import STORAGE_PATH, DERIVATIVE_CACHE_DIR, DERIVATIVE_CACHE_MAX_BYTES, is_valid_image
+from img.cache import DerivativeCache, derivative_params, derivative_path, write_derivative
+from img.imaging import TRANSFORM_FITS, TRANSFORM_FORMATS, transform_file
+
+DEFAULT_CHECKPOINT = "storage/cache/backfill.checkpoint.json"
+CHECKPOINT_EVERY = 100
+REPORT_EVERY = 100
+# 見積もりのために実際に変換する件数
+ESTIMATE_SAMPLE_SIZE = 20
+# 見積もりがキャッシュ上限のこの割合を超えたら、通常の配信で追い出されやすいことを警告する
+CACHE_WARNING_RATIO = 0.5
+
+def parse_size(value):
+    # "320x240"、片方を0にすると縦横比を維持（例: "640x0"）
+    try:
+        width, height = (int(v) for v in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid size: {value}")
+    if width < 0 or height < 0 or not (width or height):
+        raise argparse.ArgumentTypeError(f"Invalid size: {value}")
+    return width or None, height or None
+
+def _path_key(path, root):
+    return tuple(os.path.relpath(path, root).split(os.sep))
+
+def iter_images(root, after=None):
+    """
+    rootの下の画像を名前順（深さ優先）に1件ずつ返す。全件をメモリに載せない
+    afterを指定した場合はそのパスより後ろのものだけを返す
+    """
+    after_key = _path_key(after, root) if after else None
+
+    def walk(directory):
+        try:
+            entries = sorted(os.scandir(directory), key=lambda e: e.name)
+        except OSError:
+            return
+        for entry in entries:
+            key = _path_key(entry.path, root)
+            if entry.is_dir(follow_symlinks=False):
+                # チェックポイントより前のディレクトリは中に入らずに飛ばす
+                if after_key and key < after_key and after_key[:len(key)] != key:
+                    continue
+                yield from walk(entry.path)
+            elif entry.is_file() and not entry.name.startswith(".") and is_valid_image(entry.name):
+                if after_key and key <= after_key:
+                    continue
+                yield entry.path
+
+    yield from walk(root)
+
+def rate_limited(iterable, rate):
+    # 1秒あたりrate件を超えないように供給する
+    if not rate:
+        yield from iterable
+        return
+    interval = 1.0 / rate
+    next_at = time.monotonic()
+    for item in iterable:
+        now = time.monotonic()
+        if now < next_at:
+            time.sleep(next_at - now)
+        next_at = max(now, next_at) + interval
+        yield item
+
+def backfill_one(job):
+    """
+    ワーカープロセスで1画像分の変換画像を生成する
+    戻り値: (パス, 生成数, 書き込んだバイト, 生成済みで飛ばした数, 飛ばした変換画像のバイト, エラー)
+    """
+    path, specs, cache_dir = job
+    generated = written_bytes = skipped = skipped_bytes = 0
+    try:
+        stat_result = os.stat(path)
+        abs_path = os.path.abspath(path)
+        for width, height, fit, output_format in specs:
+            key = DerivativeCache.make_key(abs_path, stat_result, derivative_params(width, height, fit, output_format))
+            existing = derivative_path(cache_dir, key)
+            if os.path.exists(existing):
+                skipped += 1
+                skipped_bytes += os.path.getsize(existing)
+                continue
+            data = transform_file(abs_path, width, height, fit, output_format)
+            write_derivative(cache_dir, key, data)
+            generated += 1
+            written_bytes += len(data)
+        return path, generated, written_bytes, skipped, skipped_bytes, None
+    except Exception as e:
+        return path, generated, written_bytes, skipped, skipped_bytes, str(e)
+
+def estimate_output(root, specs, after=None, sample_size=ESTIMATE_SAMPLE_SIZE):
+    """
+    対象の画像を数え、先頭sample_size件を実際に変換した平均から変換画像の合計バイト数を見積もる
+    戻り値: (画像数, 元画像の合計バイト, 見積もりバイト)
+    """
+    count = source_bytes = sampled = sampled_bytes = 0
+    for path in iter_images(root, after):
+        count += 1
+        source_bytes += os.path.getsize(path)
+        if sampled < sample_size:
+            try:
+                abs_path = os.path.abspath(path)
+                sampled_bytes += sum(len(transform_file(abs_path, *spec)) for spec in specs)
+                sampled += 1
+            except Exception as e:
+                print(f"Error estimating {path}: {str(e)}")
+    estimated = sampled_bytes * count // sampled if sampled else 0
+    return count, source_bytes, estimated
+
+def load_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_checkpoint(path, state):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+def run_backfill(root, specs, workers, checkpoint_path, dry_run=False, rate=None, reset=False, force=False,
+                 cache_max_bytes=DERIVATIVE_CACHE_MAX_BYTES):
+    state = {} if reset else load_checkpoint(checkpoint_path)
+    # 条件が変わった場合は最初からやり直す
+    if state.get("specs") != [list(spec) for spec in specs]:
+        state = {}
+    state.setdefault("specs", [list(spec) for spec in specs])
+    for counter in ("images", "generated", "written_bytes", "skipped", "skipped_bytes", "errors"):
+        state.setdefault(counter, 0)
+
+    if state.get("last_path"):
+        print(f"Resuming after {state['last_path']}")
+
+    count, source_bytes, estimated = estimate_output(root, specs, state.get("last_path"))
+    print(
+        f"{'[dry-run] ' if dry_run else ''}{count} images ({source_bytes} bytes) with {len(specs)} specs, "
+        f"estimated output {estimated} bytes (cache limit {cache_max_bytes} bytes)"
+    )
+    if estimated > cache_max_bytes:
+        print(
+            "Estimated output exceeds IMG_CACHE_MAX_BYTES, the server would evict most of it. "
+            "Raise IMG_CACHE_MAX_BYTES, reduce --size/--format, or pass --force"
+        )
+        if not force:
+            return state
+    elif estimated > cache_max_bytes * CACHE_WARNING_RATIO:
+        print("Estimated output is more than half of IMG_CACHE_MAX_BYTES, regular traffic may evict it")
+    if dry_run:
+        return state
+
+    images = rate_limited(iter_images(root, state.get("last_path")), rate)
+    started = time.monotonic()
+    processed = 0
+
+    def report():
+        elapsed = max(time.monotonic() - started, 1e-6)
+        print(
+            f"images={state['images']} generated={state['generated']} skipped={state['skipped']} "
+            f"errors={state['errors']} rate={processed / elapsed:.1f} images/sec "
+            f"written={state['written_bytes']} bytes skipped={state['skipped_bytes']} bytes"
+        )
+
+    jobs = ((path, specs, DERIVATIVE_CACHE_DIR) for path in images)
+    with multiprocessing.get_context("spawn").Pool(workers) as pool:
+        try:
+            # imapは投入順に結果を返すため、最後に完了したパスをそのままチェックポイントにできる
+            for path, generated, written_bytes, skipped, skipped_bytes, error in pool.imap(backfill_one, jobs, chunksize=4):
+                processed += 1
+                state["images"] += 1
+                state["generated"] += generated
+                state["written_bytes"] += written_bytes
+                state["skipped"] += skipped
+                state["skipped_bytes"] += skipped_bytes
+                state["last_path"] = path
+                if error:
+                    state["errors"] += 1
+                    print(f"Error processing {path}: {error}")
+                if processed % CHECKPOINT_EVERY == 0:
+                    save_checkpoint(checkpoint_path, state)
+                if processed % REPORT_EVERY == 0:
+                    report()
+        finally:
+            save_checkpoint(checkpoint_path, state)
+
+    report()
+    print("Backfill completed")
+    return state
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="保存済み画像の変換画像を事前生成する")
+    parser.add_argument("--size", type=parse_size, action="append", required=True, help="WxH（例: 320x320, 640x0）")
+    parser.add_argument("--format", action="append", choices=sorted(TRANSFORM_FORMATS), help="出力形式（複数指定可、既定はjpeg）")
+    parser.add_argument("--fit", default="cover", choices=sorted(TRANSFORM_FITS))
+    parser.add_argument("--root", default=STORAGE_PATH, help="対象ディレクトリ")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--rate", type=float, default=None, help="1秒あたりの最大処理件数")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT)
+    parser.add_argument("--dry-run", action="store_true", help="対象件数と生成量の見積もりを表示するだけで変換しない")
+    parser.add_argument("--force", action="store_true", help="見積もりがキャッシュの上限を超えても生成する")
+    parser.add_argument("--reset", action="store_true", help="チェックポイントを無視して最初から処理する")
+    args = parser.parse_args(argv)
+
+    formats = [TRANSFORM_FORMATS[f] for f in (args.format or ["jpeg"])]
+    specs = [(width, height, args.fit, fmt) for width, height in args.size for fmt in formats]
+    run_backfill(args.root, specs, args.workers, args.checkpoint, args.dry_run, args.rate, args.reset, args.force)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+# img/cache.py
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+def derivative_params(width, height, fit, output_format):
+    # get_image とバックフィルで同じキーになるよう、パラメータの組み立てはここに集約する
+    return {"w": width, "h": height, "fit": fit, "fmt": output_format}
+
+def derivative_path(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], key)
+
+def write_derivative(cache_dir, key, data):
+    # 一時ファイルに書いてから置き換える（他プロセスから書かれても読み込み途中のファイルは見えない）
+    path = derivative_path(cache_dir, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+class DerivativeCache:
+    """
+    変換済み画像（リサイズ・フォーマット変換）のキャッシュ
+    ディスク上の容量上限付きLRUと、小さなインメモリのホット層の2段構成
+    """
+
+    def __init__(self, cache_dir, max_bytes, hot_max_bytes, hot_max_item_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hot_max_bytes = hot_max_bytes
+        self.hot_max_item_bytes = hot_max_item_bytes
+
+        self._lock = threading.Lock()
+        self._index = OrderedDict()  # key -> サイズ（古い順）
+        self._total_bytes = 0
+        self._hot = OrderedDict()  # key -> bytes（古い順）
+        self._hot_bytes = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def make_key(source_path, stat_result, params):
+        # 元ファイルが更新されたら別キーになるよう mtime とサイズを含める
+        raw = "|".join([
+            os.path.abspath(source_path),
+            str(stat_result.st_mtime_ns),
+            str(stat_result.st_size),
+            *(f"{k}={params[k]}" for k in sorted(params)),
+        ])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path_for(self, key):
+        return derivative_path(self.cache_dir, key)
+
+    def _load_index(self):
+        # 起動時に既存のキャッシュファイルをアクセス時刻順に読み込む
+        entries = []
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if filename.endswith(".tmp"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(dirpath, filename))
+                except OSError:
+                    continue
+                entries.append((st.st_atime, filename, st.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._total_bytes += size
+        self._evict()
+
+    def get(self, key):
+        with self._lock:
+            data = self._hot.get(key)
+            if data is not None:
+                self._hot.move_to_end(key)
+                self._index.move_to_end(key)
+                return data
+            indexed = key in self._index
+            if indexed:
+                self._index.move_to_end(key)
+
+        # インデックスにない場合も、バックフィル等の別プロセスが書いたファイルがあれば使う
+        try:
+            with open(self._path_for(key), "rb") as f:
+                data = f.read()
+        except OSError:
+            # 外部から削除された場合はインデックスからも外す
+            if indexed:
+                with self._lock:
+                    size = self._index.pop(key, None)
+                    if size is not None:
+                        self._total_bytes -= size
+            return None
+
+        with self._lock:
+            if key not in self._index:
+                self._index[key] = len(data)
+                self._total_bytes += len(data)
+            self._put_hot(key, data)
+            self._evict()
+        return data
+
+    def put(self, key, data):
+        write_derivative(self.cache_dir, key, data)
+
+        with self._lock:
+            old_size = self._index.pop(key, None)
+            if old_size is not None:
+                self._total_bytes -= old_size
+            self._index[key] = len(data)
+            self._total_bytes += len(data)
+            self._put_hot(key, data)
+            self._evict()
+
+    def _put_hot(self, key, data):
+        if len(data) > self.hot_max_item_bytes:
+            return
+        old = self._hot.pop(key, None)
+        if old is not None:
+            self._hot_bytes -= len(old)
+        self._hot[key] = data
+        self._hot_bytes += len(data)
+        while self._hot_bytes > self.hot_max_bytes and self._hot:
+            _, evicted = self._hot.popitem(last=False)
+            self._hot_bytes -= len(evicted)
+
+    def _evict(self):
+        # ロック取得済みの状態で呼ぶこと
+        while self._total_bytes > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._total_bytes -= size
+            hot = self._hot.pop(key, None)
+            if hot is not None:
+                self._hot_bytes -= len(hot)
+            try:
+                os.remove(self._path_for(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hot_entries": len(self._hot),
+                "hot_bytes": self._hot_bytes,
+            }
@@ -0,0 +1,23 @@
+# img/config.py
+# 画像サービスとコマンドラインツールで共通の設定
+
+import os
+
+STORAGE_PATH = "storage/users/"
+BLOB_PATH = os.getenv("IMG_BLOB_PATH", "storage/blobs/")
+ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
+
+# 変換画像キャッシュ
+DERIVATIVE_CACHE_DIR = os.getenv("IMG_CACHE_DIR", "storage/cache/derivatives/")
+DERIVATIVE_CACHE_MAX_BYTES = int(os.getenv("IMG_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+DERIVATIVE_CACHE_HOT_MAX_BYTES = int(os.getenv("IMG_CACHE_HOT_MAX_BYTES", 32 * 1024 * 1024))
+DERIVATIVE_CACHE_HOT_MAX_ITEM_BYTES = int(os.getenv("IMG_CACHE_HOT_MAX_ITEM_BYTES", 256 * 1024))
+
+def is_valid_image(file_path):
+    return os.path.splitext(file_path)[1].lower() in ALLOWED_EXTENSIONS
+
+# 参照されていない画像の隔離先（GC）
+QUARANTINE_PATH = os.getenv("IMG_QUARANTINE_PATH", "storage/quarantine/")
+
+# 再開可能な分割アップロードの受信途中ファイル
+RESUMABLE_PATH = os.getenv("IMG_RESUMABLE_PATH", "storage/uploads/")
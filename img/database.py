@@ -1,7 +1,7 @@
 # img/database.py
 
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -9,7 +9,7 @@ from sqlalchemy.orm import sessionmaker
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 # データベースファイルのパスを設定
-DB_PATH = os.path.join(BASE_DIR, "db", "app.db")
+DB_PATH = os.getenv("IMG_DB_PATH", os.path.join(BASE_DIR, "db", "app.db"))
 
 # SQLAlchemyのデータベースURL
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_PATH}"
@@ -28,4 +28,21 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def init_db():
+    import img.models
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+
+def add_missing_columns():
+    # create_allは既存テーブルに列を追加しないため、後から追加した列（NULL許容）をここで追加する
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
@@ -0,0 +1,290 @@
+# img/gc.py
+# 参照されなくなった画像（削除済みブログ・差し替え前のプロフィール画像など）の回収
+#
+# マーク: lineapiのDB（posts.photo_url, basic_cast_info.profile_image_url, users.picture_url）から
+#         参照中のパスを集める
+# スイープ: 参照されておらず猶予期間を過ぎたファイルを隔離ディレクトリへ移す（すぐには削除しない）
+# シャード（invitation_idのハッシュ1段目）単位で処理するので、数回に分けて実行できる
+#
+# 使い方:
+#   python -m img.gc run --dry-run
+#   python -m img.gc run --shards 16          # 前回の続きから16シャード分
+#   python -m img.gc run --shard 3f
+#   python -m img.gc purge --older-than-days 30
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+from img.config import STORAGE_PATH, QUARANTINE_PATH
+from img.models import ImageFile
+from img import layout
+from img import manifest
+
+SHARDS = [f"{i:02x}" for i in range(256)]
+DEFAULT_GRACE_DAYS = 7
+USER_CHUNK_SIZE = 500
+STATE_FILE = "gc_state.json"
+
+# 参照元のDBがあるカテゴリだけを回収対象にする（id_verification などは対象外）
+SWEEP_CATEGORIES = {"blog", "profile"}
+# 固定ファイル名で参照される画像（フロントエンドがファイル名を直接組み立てている）
+PROTECTED_NAME_PATTERNS = [
+    re.compile(r"^castimage_\d+\.[a-z]+$"),
+    re.compile(r"^iconimage\.[a-z]+$"),
+]
+
+
+class ReferenceSet:
+    """
+    参照中の論理パスの集合。パス文字列の代わりに16バイトのダイジェストを持ってメモリを抑える
+    """
+
+    def __init__(self):
+        self._digests = set()
+
+    @staticmethod
+    def _digest(logical_path):
+        return hashlib.blake2b(os.path.normpath(logical_path).encode("utf-8"), digest_size=16).digest()
+
+    def add(self, logical_path):
+        self._digests.add(self._digest(logical_path))
+
+    def __contains__(self, logical_path):
+        return self._digest(logical_path) in self._digests
+
+    def __len__(self):
+        return len(self._digests)
+
+
+def reference_to_logical(owner_id, value, default_dir=None):
+    """
+    DBに保存された画像の参照（ファイル名のみ・相対パス・URL）を論理パスに変換する
+    """
+    if not value:
+        return None
+    path = value.strip().split("?")[0].split("#")[0]
+    if "://" in path:
+        path = urlparse(path).path
+    parts = [part for part in path.split("/") if part and part != "."]
+    if not parts:
+        return None
+    if owner_id in parts:
+        parts = parts[parts.index(owner_id):]
+    elif len(parts) == 1 and default_dir:
+        parts = [owner_id, default_dir, parts[0]]
+    else:
+        parts = [owner_id] + parts
+    return os.path.normpath(os.path.join(*parts))
+
+def iter_references(main_db, user_ids):
+    """
+    指定ユーザーの参照中の論理パスを順に返す（結果は全件メモリに載せずに流す）
+    """
+    from lineapi.models.blog import Post
+    from lineapi.models.cast import BasicCastInfo
+    from lineapi.models.user import User as LineUser
+
+    for start in range(0, len(user_ids), USER_CHUNK_SIZE):
+        chunk = user_ids[start:start + USER_CHUNK_SIZE]
+
+        posts = (
+            main_db.query(Post.cast_id, Post.photo_url)
+            .filter(Post.cast_id.in_(chunk), Post.photo_url.isnot(None))
+            .filter((Post.is_deleted == False) | (Post.is_deleted.is_(None)))  # noqa: E712
+            .yield_per(1000)
+        )
+        for cast_id, photo_url in posts:
+            yield reference_to_logical(cast_id, photo_url, "blog")
+
+        casts = (
+            main_db.query(BasicCastInfo.cast_id, BasicCastInfo.profile_image_url)
+            .filter(BasicCastInfo.cast_id.in_(chunk), BasicCastInfo.profile_image_url.isnot(None))
+            .yield_per(1000)
+        )
+        for cast_id, profile_image_url in casts:
+            yield reference_to_logical(cast_id, profile_image_url, "profile")
+
+        # LINEのプロフィール画像URLも入るため、ユーザーのパスを含むものだけが対象になる
+        users = (
+            main_db.query(LineUser.invitation_id, LineUser.picture_url)
+            .filter(LineUser.invitation_id.in_(chunk), LineUser.picture_url.isnot(None))
+            .yield_per(1000)
+        )
+        for invitation_id, picture_url in users:
+            if invitation_id in picture_url:
+                yield reference_to_logical(invitation_id, picture_url)
+
+def is_sweepable(logical_path):
+    parts = logical_path.split(os.sep)
+    if len(parts) < 3 or parts[1] not in SWEEP_CATEGORIES:
+        return False
+    # 仮アップロードは img.sweeper が期限で削除する
+    if "temp" in parts[2:-1]:
+        return False
+    return not any(pattern.match(parts[-1]) for pattern in PROTECTED_NAME_PATTERNS)
+
+def quarantine_file(blob_store, db, logical_path, file_path, quarantine_dir):
+    """
+    ファイルを隔離ディレクトリへ移し、blobの参照と一覧から外す
+    ハードリンクで退避してから外すので、blobの参照数が0になっても内容は隔離先に残る
+    """
+    destination = os.path.join(quarantine_dir, logical_path)
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    try:
+        os.link(file_path, destination)
+    except FileExistsError:
+        pass
+    except OSError:
+        shutil.copy2(file_path, destination)
+    blob_store.release(logical_path, file_path)
+    manifest.remove_file(db, logical_path)
+
+def collect_shard(main_db, db, blob_store, shard, grace, quarantine_dir, dry_run=False):
+    users = dict(layout.iter_user_dirs(STORAGE_PATH, shard))
+    stats = {"users": len(users), "scanned": 0, "referenced": 0, "recent": 0, "quarantined": 0, "bytes": 0}
+    if not users:
+        return stats
+
+    # マーク
+    references = ReferenceSet()
+    for logical_path in iter_references(main_db, sorted(users)):
+        if logical_path:
+            references.add(logical_path)
+
+    # スイープ
+    cutoff = datetime.now() - grace
+    for invitation_id, user_dir in users.items():
+        created = {
+            entry.path: entry.created_at
+            for entry in db.query(ImageFile.path, ImageFile.created_at).filter(ImageFile.invitation_id == invitation_id)
+        }
+        for file_path in manifest._walk_user_files(user_dir):
+            stats["scanned"] += 1
+            logical_path = layout.logical_path(file_path)
+            if not is_sweepable(logical_path) or logical_path in references:
+                stats["referenced"] += 1
+                continue
+            # 重複排除で古いblobにリンクされた新しい画像もあるので、一覧の登録日時も見る
+            st = os.stat(file_path)
+            created_at = created.get(logical_path)
+            if datetime.fromtimestamp(st.st_mtime) > cutoff or (created_at and created_at > cutoff):
+                stats["recent"] += 1
+                continue
+
+            stats["quarantined"] += 1
+            stats["bytes"] += st.st_size
+            if dry_run:
+                print(f"[dry-run] would quarantine {logical_path} ({st.st_size} bytes)")
+                continue
+            try:
+                quarantine_file(blob_store, db, logical_path, file_path, quarantine_dir)
+            except OSError as e:
+                print(f"Error quarantining {logical_path}: {str(e)}")
+    return stats
+
+def load_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_state(path, state):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+def run_gc(main_db, db, blob_store, shards=None, shard_count=None, grace_days=DEFAULT_GRACE_DAYS, dry_run=False):
+    """
+    shardsを指定しなければ前回の続きからshard_count個（省略時は全部）のシャードを処理する
+    """
+    state_path = os.path.join(QUARANTINE_PATH, STATE_FILE)
+    state = load_state(state_path)
+    if not shards:
+        start = SHARDS.index(state.get("next_shard", SHARDS[0]))
+        count = min(shard_count or len(SHARDS), len(SHARDS))
+        shards = [SHARDS[(start + i) % len(SHARDS)] for i in range(count)]
+
+    quarantine_dir = os.path.join(QUARANTINE_PATH, datetime.now().strftime("%Y%m%d"))
+    grace = timedelta(days=grace_days)
+    totals = {}
+    for shard in shards:
+        started = time.monotonic()
+        stats = collect_shard(main_db, db, blob_store, shard, grace, quarantine_dir, dry_run)
+        for key, value in stats.items():
+            totals[key] = totals.get(key, 0) + value
+        if stats["quarantined"]:
+            print(
+                f"shard {shard}: users={stats['users']} scanned={stats['scanned']} "
+                f"quarantined={stats['quarantined']} bytes={stats['bytes']} ({time.monotonic() - started:.1f}s)"
+            )
+        if not dry_run:
+            state["next_shard"] = SHARDS[(SHARDS.index(shard) + 1) % len(SHARDS)]
+            state["last_run"] = datetime.now().isoformat()
+            save_state(state_path, state)
+
+    print(
+        f"GC {'planned' if dry_run else 'completed'}: shards={len(shards)} scanned={totals.get('scanned', 0)} "
+        f"recent={totals.get('recent', 0)} quarantined={totals.get('quarantined', 0)} "
+        f"reclaimable={totals.get('bytes', 0)} bytes"
+    )
+    return totals
+
+def purge_quarantine(older_than_days):
+    # 隔離から一定期間たったものを完全に削除する
+    cutoff = (datetime.now() - timedelta(days=older_than_days)).strftime("%Y%m%d")
+    removed = reclaimed = 0
+    if not os.path.isdir(QUARANTINE_PATH):
+        return removed, reclaimed
+    for entry in sorted(os.scandir(QUARANTINE_PATH), key=lambda e: e.name):
+        if not entry.is_dir() or not entry.name.isdigit() or entry.name >= cutoff:
+            continue
+        for dirpath, _, filenames in os.walk(entry.path):
+            for filename in filenames:
+                reclaimed += os.path.getsize(os.path.join(dirpath, filename))
+                removed += 1
+        shutil.rmtree(entry.path)
+    print(f"Purged {removed} files, reclaimed {reclaimed} bytes")
+    return removed, reclaimed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="参照されていない画像の回収")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run = subparsers.add_parser("run", help="参照されていない画像を隔離する")
+    run.add_argument("--shard", action="append", choices=SHARDS, help="対象シャード（複数指定可）")
+    run.add_argument("--shards", type=int, default=None, help="前回の続きから処理するシャード数")
+    run.add_argument("--grace-days", type=int, default=DEFAULT_GRACE_DAYS, help="この日数より新しいファイルは対象外")
+    run.add_argument("--dry-run", action="store_true")
+    purge = subparsers.add_parser("purge", help="隔離済みの画像を削除する")
+    purge.add_argument("--older-than-days", type=int, default=30)
+    args = parser.parse_args(argv)
+
+    if args.command == "purge":
+        purge_quarantine(args.older_than_days)
+        return
+
+    from img.config import BLOB_PATH
+    from img.database import SessionLocal, init_db
+    from img.storage import BlobStore
+    from lineapi.database import SessionLocal as MainSessionLocal
+
+    init_db()
+    db = SessionLocal()
+    main_db = MainSessionLocal()
+    try:
+        run_gc(main_db, db, BlobStore(BLOB_PATH, SessionLocal), args.shard, args.shards, args.grace_days, args.dry_run)
+    finally:
+        main_db.close()
+        db.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,413 @@
+# img/imaging.py
+# Pillowによる画像処理（ワーカープロセスから呼ばれるためFastAPI等には依存しない）
+
+import io
+import os
+import math
+import base64
+import struct
+import hashlib
+from PIL import Image, ImageOps, ImageSequence
+
+try:
+    from PIL import ImageCms
+except ImportError:  # littlecms なしでビルドされたPillow
+    ImageCms = None
+
+# 変換画像（サムネイル等）の設定
+TRANSFORM_FITS = {"cover", "contain", "fill"}
+TRANSFORM_FORMATS = {"jpeg": "JPEG", "jpg": "JPEG", "webp": "WEBP", "png": "PNG"}
+FORMAT_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+FORMAT_EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp", "PNG": ".png"}
+
+# アニメーション画像の設定（アニメーションのまま保存できる形式）
+ANIMATED_EXTENSIONS = {"GIF": ".gif", "WEBP": ".webp"}
+MAX_ANIMATED_FRAMES = int(os.getenv("IMG_MAX_ANIMATED_FRAMES", 100))
+DEFAULT_FRAME_DURATION = 100  # ミリ秒
+POSTER_WIDTH = 640  # 一覧表示用の静止画（先頭フレーム）の幅
+
+# デコード前に拒否する上限（ピクセル数・フレーム数）
+MAX_IMAGE_PIXELS = int(os.getenv("IMG_MAX_PIXELS", 40_000_000))
+MAX_IMAGE_FRAMES = int(os.getenv("IMG_MAX_FRAMES", 300))
+
+# Pillow側の展開爆弾チェックも同じ上限にそろえる（ワーカープロセスでも有効）
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# ファイル先頭のマジックバイトと対応する拡張子
+MAGIC_NUMBERS = [
+    (b"\xff\xd8\xff", {".jpg", ".jpeg"}),
+    (b"\x89PNG\r\n\x1a\n", {".png"}),
+    (b"GIF87a", {".gif"}),
+    (b"GIF89a", {".gif"}),
+]
+
+class ImageRejected(ValueError):
+    """デコード前の検査で受け付けられない画像"""
+
+    def __init__(self, detail, too_large=False):
+        super().__init__(detail)
+        self.detail = detail
+        self.too_large = too_large
+
+def detect_extensions(header):
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return {".webp"}
+    for magic, extensions in MAGIC_NUMBERS:
+        if header.startswith(magic):
+            return extensions
+    return set()
+
+def _skip_sub_blocks(f):
+    while True:
+        size = f.read(1)
+        if not size or size[0] == 0:
+            return
+        f.seek(size[0], 1)
+
+def _count_gif_frames(f, limit):
+    # 画像データはデコードせず、ブロック構造だけをたどってフレーム数を数える
+    f.seek(10)
+    packed = f.read(3)[0:1]
+    if packed and packed[0] & 0x80:
+        f.seek(3 * (2 ** ((packed[0] & 0x07) + 1)), 1)
+    frames = 0
+    while frames <= limit:
+        block = f.read(1)
+        if not block or block == b"\x3b":
+            break
+        if block == b"\x21":  # 拡張ブロック
+            f.seek(1, 1)
+            _skip_sub_blocks(f)
+        elif block == b"\x2c":  # イメージ記述子
+            descriptor = f.read(9)
+            if len(descriptor) < 9:
+                break
+            if descriptor[8] & 0x80:
+                f.seek(3 * (2 ** ((descriptor[8] & 0x07) + 1)), 1)
+            f.seek(1, 1)  # LZW最小コードサイズ
+            _skip_sub_blocks(f)
+            frames += 1
+        else:
+            break
+    return max(frames, 1)
+
+def _count_png_frames(f):
+    # APNGはacTLチャンクにフレーム数が入っている（IDATより前にある）
+    f.seek(8)
+    while True:
+        chunk_header = f.read(8)
+        if len(chunk_header) < 8:
+            return 1
+        length, chunk_type = struct.unpack(">I4s", chunk_header)
+        if chunk_type == b"acTL":
+            return struct.unpack(">I", f.read(4))[0]
+        if chunk_type == b"IDAT":
+            return 1
+        f.seek(length + 4, 1)
+
+def _count_webp_frames(f, limit):
+    # アニメーションWebPはフレームごとにANMFチャンクがある（各チャンクは偶数バイトに詰められる）
+    f.seek(12)
+    frames = 0
+    while frames <= limit:
+        chunk_header = f.read(8)
+        if len(chunk_header) < 8:
+            break
+        chunk_type, length = struct.unpack("<4sI", chunk_header)
+        if chunk_type == b"ANMF":
+            frames += 1
+        elif chunk_type in (b"VP8 ", b"VP8L"):
+            # 静止画のビットストリーム
+            break
+        f.seek(length + (length & 1), 1)
+    return max(frames, 1)
+
+def probe_image(path, allowed_extensions, extension=None):
+    """
+    ヘッダーだけを読んで形式・サイズ・フレーム数を調べ、上限を超えるものは ImageRejected を送出する
+    拡張子ではなくマジックバイトで形式を判定し、extension を渡した場合は中身と一致するかも確認する
+    """
+    with open(path, "rb") as f:
+        header = f.read(16)
+        detected = detect_extensions(header)
+        if not detected & allowed_extensions:
+            raise ImageRejected("Invalid file type")
+        if extension is not None and extension.lower() not in detected:
+            # 例: 中身がPNGなのに .jpg で保存されると、配信時のContent-Typeと一致しなくなる
+            raise ImageRejected("File extension does not match content")
+
+        try:
+            # Image.open はヘッダーのみ読み込み、ピクセルはデコードしない
+            with Image.open(f) as image:
+                image_format = image.format
+                width, height = image.size
+        except Image.DecompressionBombError:
+            raise ImageRejected("Image dimensions too large", too_large=True)
+        except OSError:
+            raise ImageRejected("Invalid image file")
+
+        if width * height > MAX_IMAGE_PIXELS:
+            raise ImageRejected("Image dimensions too large", too_large=True)
+
+        if image_format == "GIF":
+            frames = _count_gif_frames(f, MAX_IMAGE_FRAMES)
+        elif image_format == "PNG":
+            frames = _count_png_frames(f)
+        elif image_format == "WEBP":
+            frames = _count_webp_frames(f, MAX_IMAGE_FRAMES)
+        else:
+            frames = 1
+        if frames > MAX_IMAGE_FRAMES or width * height * frames > MAX_IMAGE_PIXELS * 4:
+            raise ImageRejected("Too many frames", too_large=True)
+
+    return {"format": image_format, "width": width, "height": height, "frames": frames}
+
+def _target_size(image, width, height):
+    # 片方だけ指定された場合は縦横比を維持して補完する
+    if width and height:
+        return width, height
+    if width:
+        return width, max(1, round(image.height * width / image.width))
+    return max(1, round(image.width * height / image.height)), height
+
+# エンコードの設定
+DEFAULT_QUALITY = 85
+MIN_QUALITY = 50
+LOSSY_FORMATS = {"JPEG", "WEBP"}
+EXIF_ORIENTATION = 0x0112
+# 縦横が入れ替わる向き（90度・270度の回転を含むもの）
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+# 保存時に残す情報（PNGパレットの透過色はメタデータではなく画像の一部）
+KEEP_INFO_KEYS = {"transparency"}
+SRGB_PROFILE = ImageCms.createProfile("sRGB") if ImageCms else None
+
+# プレースホルダー（LQIP）の設定
+PLACEHOLDER_SIZE = 20
+PLACEHOLDER_QUALITY = 50
+
+# 縮小率がこの倍数以上あれば、LANCZOSの前に整数倍の縮小を済ませておく
+REDUCING_GAP = 2.0
+REDUCIBLE_MODES = {"L", "LA", "RGB", "RGBA"}
+
+def _required_source_size(width, height, crop_data):
+    """
+    クロップ後にwidth×heightを確保するために必要な元画像全体のサイズ
+    """
+    crop_w = max(crop_data['width'], 1) / 100 if crop_data else 1
+    crop_h = max(crop_data['height'], 1) / 100 if crop_data else 1
+    need_w = math.ceil(width / crop_w) if width else 1
+    need_h = math.ceil(height / crop_h) if height else 1
+    return need_w, need_h
+
+def _reduce_for_target(image, need_w, need_h):
+    # 整数倍の縮小（reduce）はLANCZOSより大幅に速い
+    if image.mode not in REDUCIBLE_MODES:
+        return image
+    factor = int(min(image.width / need_w, image.height / need_h) / REDUCING_GAP)
+    if factor < 2:
+        return image
+    return image.reduce(factor)
+
+def decode_for_target(file, width, height, crop_data):
+    """
+    デコードしてEXIF Orientationを画素に反映した画像を返す
+    JPEGはデコーダーのDCTスケーリング（1/2, 1/4, 1/8）で、必要なサイズを下回らない範囲で縮小してデコードする
+    """
+    image = Image.open(file)
+    orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+
+    if (width or height) and image.format == "JPEG":
+        # 必要なサイズ・クロップ座標は表示上の向きで指定されるが、draftは保存されている向きのサイズで効く
+        # 90度回転する向き（5〜8）では縦横を入れ替えてから指定する
+        need_w, need_h = _required_source_size(width, height, crop_data)
+        if orientation in TRANSPOSED_ORIENTATIONS:
+            need_w, need_h = need_h, need_w
+        image.draft(image.mode, (need_w, need_h))
+
+    # スマホ写真の向き（EXIF Orientation）を画素に反映する。クロップ座標も表示上の向きで指定される
+    if orientation != 1:
+        image = ImageOps.exif_transpose(image)
+    return image
+
+def render_image(file, width, height, crop_data, fit="fill", output_format="JPEG"):
+    """
+    デコード・クロップ・リサイズまでを行い、エンコード前の画像を返す
+    """
+    image = decode_for_target(file, width, height, crop_data)
+    image = _crop_and_resize(image, width, height, crop_data, fit)
+
+    # JPEGはアルファチャンネル・パレットを扱えないためRGBに変換
+    if output_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    return _strip_metadata(image)
+
+def _crop_and_resize(image, width, height, crop_data, fit):
+    if crop_data:
+        left = crop_data['x'] * image.width / 100
+        top = crop_data['y'] * image.height / 100
+        right = left + (crop_data['width'] * image.width / 100)
+        bottom = top + (crop_data['height'] * image.height / 100)
+        image = image.crop((left, top, right, bottom))
+
+    if width or height:
+        size = _target_size(image, width, height)
+        image = _reduce_for_target(image, *size)
+        if fit == "cover":
+            image = ImageOps.fit(image, size, Image.LANCZOS)
+        elif fit == "contain":
+            image = ImageOps.contain(image, size, Image.LANCZOS)
+        else:
+            image = image.resize(size, Image.LANCZOS)
+    return image
+
+def render_animation(file, width, height, crop_data, fit="fill", max_frames=MAX_ANIMATED_FRAMES):
+    """
+    全フレームをクロップ・リサイズして (フレームのリスト, 表示時間のリスト, ループ回数) を返す
+    max_framesを超える場合は等間隔に間引き、間引いたフレームの表示時間は直前のフレームに足す
+    """
+    with Image.open(file) as image:
+        loop = image.info.get("loop", 0)
+        step = max(1, math.ceil(getattr(image, "n_frames", 1) / max_frames))
+        frames, durations = [], []
+        for index, frame in enumerate(ImageSequence.Iterator(image)):
+            duration = frame.info.get("duration") or DEFAULT_FRAME_DURATION
+            if index % step:
+                durations[-1] += duration
+                continue
+            # GIFの各フレームは前のフレームに重ねた状態で読み込まれるので、そのまま1枚の画像として扱える
+            frames.append(_crop_and_resize(frame.convert("RGBA"), width, height, crop_data, fit))
+            durations.append(duration)
+    return frames, durations, loop
+
+def _strip_metadata(image):
+    """
+    ICCプロファイルがあればsRGBに変換したうえで、EXIF・XMP・ICC等のメタデータを取り除く
+    """
+    icc_profile = image.info.get("icc_profile")
+    if icc_profile and ImageCms and image.mode in ("RGB", "RGBA"):
+        try:
+            source_profile = ImageCms.ImageCmsProfile(io.BytesIO(icc_profile))
+            image = ImageCms.profileToProfile(image, source_profile, SRGB_PROFILE, outputMode=image.mode)
+        except (ImageCms.PyCMSError, OSError):
+            pass
+    image.info = {k: v for k, v in image.info.items() if k in KEEP_INFO_KEYS}
+    return image
+
+def encode_image(image, output_format="JPEG", quality=DEFAULT_QUALITY):
+    output = io.BytesIO()
+    if output_format == "JPEG":
+        image.save(output, format="JPEG", quality=quality, progressive=True, optimize=True)
+    elif output_format == "WEBP":
+        image.save(output, format="WEBP", quality=quality, method=4)
+    else:
+        image.save(output, format=output_format, optimize=True)
+    output.seek(0)
+    return output
+
+def encode_animation(animation, output_format="GIF", quality=DEFAULT_QUALITY):
+    frames, durations, loop = animation
+    output = io.BytesIO()
+    if output_format == "WEBP":
+        frames[0].save(
+            output, format="WEBP", save_all=True, append_images=frames[1:],
+            duration=durations, loop=loop, quality=quality, method=4
+        )
+    else:
+        frames[0].save(
+            output, format="GIF", save_all=True, append_images=frames[1:],
+            duration=durations, loop=loop, optimize=True, disposal=2
+        )
+    output.seek(0)
+    return output
+
+def encode_to_budget(image, output_format="JPEG", max_bytes=None, encoder=encode_image):
+    """
+    既定の品質で max_bytes を超える場合は、上限に収まる最も高い品質を二分探索で求める
+    最低品質でも収まらない場合は最低品質で保存する
+    """
+    data = encoder(image, output_format).getvalue()
+    if not max_bytes or len(data) <= max_bytes or output_format not in LOSSY_FORMATS:
+        return data
+
+    low, high = MIN_QUALITY, DEFAULT_QUALITY - 1
+    best = None
+    while low <= high:
+        quality = (low + high) // 2
+        candidate = encoder(image, output_format, quality).getvalue()
+        if len(candidate) <= max_bytes:
+            best = candidate
+            low = quality + 1
+        else:
+            high = quality - 1
+    return best if best is not None else encoder(image, output_format, MIN_QUALITY).getvalue()
+
+def process_image(file, width, height, crop_data, fit="fill", output_format="JPEG"):
+    image = render_image(file, width, height, crop_data, fit, output_format)
+    return encode_image(image, output_format)
+
+def make_placeholder(image):
+    """
+    一覧表示用の小さなプレースホルダー（約20pxのJPEGをdata URIにしたもの）
+    """
+    thumb = image.convert("RGB") if image.mode not in ("RGB", "L") else image.copy()
+    thumb.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.BILINEAR)
+    output = io.BytesIO()
+    thumb.save(output, format="JPEG", quality=PLACEHOLDER_QUALITY)
+    return "data:image/jpeg;base64," + base64.b64encode(output.getvalue()).decode("ascii")
+
+# 以下はプロセスプール用のジョブ（引数・戻り値はpickle可能な値のみ）
+
+def process_image_file(source_path, output_path, width, height, crop_data,
+                       fit="fill", output_format="JPEG", max_bytes=None):
+    """
+    source_pathの画像を加工してoutput_pathに書き出し、保存結果（サイズ・SHA-256・縦横・プレースホルダー）を返す
+    プレースホルダーは同じデコード結果から作る
+    """
+    with open(source_path, "rb") as f:
+        image = render_image(f, width, height, crop_data, fit, output_format)
+        data = encode_to_budget(image, output_format, max_bytes)
+        placeholder = make_placeholder(image)
+    with open(output_path, "wb") as out:
+        out.write(data)
+    return {
+        "size": len(data),
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "width": image.width,
+        "height": image.height,
+        "placeholder": placeholder,
+    }
+
+def process_animation_file(source_path, output_path, width, height, crop_data,
+                           fit="fill", output_format="GIF", max_bytes=None):
+    """
+    アニメーション画像（GIF・APNG・WebP）を全フレームのまま加工してoutput_pathに書き出す（output_formatがWEBPならアニメーションWebP）
+    戻り値は process_image_file と同じ項目に、フレーム数と一覧表示用の静止画（JPEGのバイト列）を加えたもの
+    静止画は get_image の ?width=POSTER_WIDTH&format=jpeg と同じ変換結果なので、そのまま変換キャッシュに入れられる
+    """
+    with open(source_path, "rb") as f:
+        animation = render_animation(f, width, height, crop_data, fit)
+    frames = animation[0]
+    data = encode_to_budget(animation, output_format, max_bytes, encoder=encode_animation)
+    with open(output_path, "wb") as out:
+        out.write(data)
+    return {
+        "size": len(data),
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "width": frames[0].width,
+        "height": frames[0].height,
+        "placeholder": make_placeholder(frames[0]),
+        "frames": len(frames),
+        "poster": transform_file(output_path, POSTER_WIDTH, None, "cover", "JPEG"),
+    }
+
+def describe_image(source_path):
+    # 加工しないアップロード用。JPEGはプレースホルダーに必要な大きさまで縮小デコードする
+    with Image.open(source_path) as image:
+        if image.format == "JPEG":
+            image.draft(image.mode, (PLACEHOLDER_SIZE * 2, PLACEHOLDER_SIZE * 2))
+        return make_placeholder(image)
+
+def transform_file(source_path, width, height, fit, output_format):
+    with open(source_path, "rb") as f:
+        return process_image(f, width, height, None, fit, output_format).getvalue()
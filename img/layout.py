@@ -0,0 +1,208 @@
+# img/layout.py
+# ユーザーディレクトリの配置（論理パス ⇔ 実ファイルパスの変換）
+#
+# 論理パス: "{invitation_id}/{category}/..."（URL・image_files・blob_refs で使うキー）
+# 実ファイル: STORAGE_PATH/{ab}/{cd}/{invitation_id}/{category}/...（invitation_idのハッシュで2段に分散）
+#
+# 旧形式（STORAGE_PATH/{invitation_id}/...）のディレクトリは移行が終わるまでそのまま読み書きできる
+#
+# 使い方（旧形式からの移行、サービスを止めずに実行できる）:
+#   python -m img.layout migrate --dry-run
+#   python -m img.layout migrate --rate 10
+#   python -m img.layout migrate --user 6XaDKrQE
+#   python -m img.layout cleanup   # 全サーバーが新しい配置に切り替わった後、旧パスのリンクを削除
+
+import os
+import re
+import sys
+import time
+import shutil
+import hashlib
+import argparse
+from img.config import STORAGE_PATH
+
+SHARD_NAME_PATTERN = re.compile(r"^[0-9a-f]{2}$")
+
+def shard_prefix(invitation_id):
+    digest = hashlib.sha256(invitation_id.encode("utf-8")).hexdigest()
+    return digest[:2], digest[2:4]
+
+def sharded_user_dir(invitation_id, storage_path=STORAGE_PATH):
+    return os.path.join(storage_path, *shard_prefix(invitation_id), invitation_id)
+
+def legacy_user_dir(invitation_id, storage_path=STORAGE_PATH):
+    return os.path.join(storage_path, invitation_id)
+
+def user_dir(invitation_id, storage_path=STORAGE_PATH):
+    """
+    ユーザーディレクトリの実パス。移行前のユーザーは旧形式のパスを返す
+    新規ユーザーは最初から分散配置にする
+    """
+    sharded = sharded_user_dir(invitation_id, storage_path)
+    if os.path.isdir(sharded):
+        return sharded
+    legacy = legacy_user_dir(invitation_id, storage_path)
+    if os.path.isdir(legacy):
+        return legacy
+    return sharded
+
+def physical_path(logical_path, storage_path=STORAGE_PATH):
+    parts = os.path.normpath(logical_path).split(os.sep)
+    return os.path.join(user_dir(parts[0], storage_path), *parts[1:])
+
+def logical_path(file_path, storage_path=STORAGE_PATH):
+    # 実パス（分散・旧形式どちらでも）から論理パスを求める
+    relative = os.path.relpath(file_path, storage_path)
+    parts = relative.split(os.sep)
+    if len(parts) > 3 and SHARD_NAME_PATTERN.match(parts[0]) and SHARD_NAME_PATTERN.match(parts[1]):
+        if (parts[0], parts[1]) == shard_prefix(parts[2]):
+            return os.path.join(*parts[2:])
+    return relative
+
+def resolve_client_path(file_path, storage_path=STORAGE_PATH):
+    """
+    クライアントが送る "storage/users/{invitation_id}/..." 形式のパスを実パスに変換する
+    STORAGE_PATHの外や、論理パスでないものを指す場合はNoneを返す
+    """
+    relative = os.path.relpath(os.path.abspath(file_path), os.path.abspath(storage_path))
+    if relative == os.curdir or relative.startswith(os.pardir):
+        return None
+    # 分散配置の実パス（{ab}/{cd}/{invitation_id}/...）は受け付けない
+    # 受け付けると "{ab}" が旧形式のユーザーとして解決され、論理パスでのカテゴリ判定をすり抜ける
+    if SHARD_NAME_PATTERN.match(relative.split(os.sep)[0]):
+        return None
+    return physical_path(relative, storage_path)
+
+def client_path(logical, storage_path=STORAGE_PATH):
+    # レスポンスでは従来どおり STORAGE_PATH + 論理パス の形で返す
+    return os.path.join(storage_path, logical)
+
+def create_user_directory(invitation_id, directory_structure, storage_path=STORAGE_PATH):
+    base_path = user_dir(invitation_id, storage_path)
+
+    def create(path, structure):
+        os.makedirs(path, exist_ok=True)
+        for name, children in structure.items():
+            create(os.path.join(path, name), children)
+
+    create(base_path, directory_structure)
+    return base_path
+
+def iter_user_dirs(storage_path=STORAGE_PATH, shard=None):
+    """
+    (invitation_id, 実パス) を返す。移行済みの旧パスに残したリンクは対象外
+    shardを指定した場合はハッシュの1段目がshardのユーザーだけを返す
+    """
+    try:
+        entries = list(os.scandir(storage_path))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if not entry.is_dir(follow_symlinks=False):
+            continue
+        if SHARD_NAME_PATTERN.match(entry.name):
+            if shard and entry.name != shard:
+                continue
+            for second in os.scandir(entry.path):
+                if not (second.is_dir(follow_symlinks=False) and SHARD_NAME_PATTERN.match(second.name)):
+                    continue
+                for user in os.scandir(second.path):
+                    if user.is_dir(follow_symlinks=False) and shard_prefix(user.name) == (entry.name, second.name):
+                        yield user.name, user.path
+        elif not shard or shard_prefix(entry.name)[0] == shard:
+            yield entry.name, entry.path
+
+def _merge_tree(src, dst):
+    # 移行中に旧パスへ書き込まれたファイルを移行先へ移す（同名は新しい方を残す）
+    for dirpath, _, filenames in os.walk(src):
+        target_dir = os.path.join(dst, os.path.relpath(dirpath, src))
+        os.makedirs(target_dir, exist_ok=True)
+        for filename in filenames:
+            source = os.path.join(dirpath, filename)
+            target = os.path.join(target_dir, filename)
+            if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source):
+                os.remove(source)
+            else:
+                os.replace(source, target)
+    shutil.rmtree(src, ignore_errors=True)
+
+def migrate_user(invitation_id, storage_path=STORAGE_PATH, dry_run=False):
+    """
+    1ユーザー分を旧形式から分散配置へ移す。移したらTrueを返す
+    同一ファイルシステム内のrenameなので、ハードリンク（blob）はそのまま保たれる
+    旧パスには移行先へのシンボリックリンクを残し、古いプロセスや外部のパス参照も動くようにする
+    """
+    legacy = legacy_user_dir(invitation_id, storage_path)
+    sharded = sharded_user_dir(invitation_id, storage_path)
+    if os.path.islink(legacy) or not os.path.isdir(legacy):
+        return False
+    if dry_run:
+        return True
+
+    os.makedirs(os.path.dirname(sharded), exist_ok=True)
+    if os.path.isdir(sharded):
+        _merge_tree(legacy, sharded)
+    else:
+        os.rename(legacy, sharded)
+        # rename直後に旧パスへ書き込まれてディレクトリが再作成された場合は移行先へ寄せる
+        if os.path.isdir(legacy) and not os.path.islink(legacy):
+            _merge_tree(legacy, sharded)
+
+    try:
+        os.symlink(os.path.relpath(sharded, os.path.dirname(os.path.abspath(legacy))), legacy)
+    except FileExistsError:
+        if not os.path.islink(legacy):
+            _merge_tree(legacy, sharded)
+            os.symlink(os.path.relpath(sharded, os.path.dirname(os.path.abspath(legacy))), legacy)
+    return True
+
+def migrate(storage_path=STORAGE_PATH, invitation_id=None, dry_run=False, rate=None):
+    if invitation_id:
+        user_ids = [invitation_id]
+    else:
+        user_ids = sorted(
+            name for name, path in iter_user_dirs(storage_path)
+            if path == legacy_user_dir(name, storage_path)
+        )
+
+    migrated = 0
+    for user_id in user_ids:
+        started = time.monotonic()
+        try:
+            if migrate_user(user_id, storage_path, dry_run):
+                migrated += 1
+                print(f"{'[dry-run] ' if dry_run else ''}{user_id} -> {sharded_user_dir(user_id, storage_path)}")
+        except OSError as e:
+            print(f"Error migrating {user_id}: {str(e)}")
+        # 1ユーザーずつ間隔を空けてディスクI/Oを抑える
+        if rate and not dry_run:
+            time.sleep(max(0.0, 1.0 / rate - (time.monotonic() - started)))
+    print(f"Migration {'planned' if dry_run else 'completed'}: users={migrated}")
+    return migrated
+
+def cleanup_links(storage_path=STORAGE_PATH):
+    removed = 0
+    for entry in os.scandir(storage_path):
+        if entry.is_symlink() and os.path.isdir(sharded_user_dir(entry.name, storage_path)):
+            os.remove(entry.path)
+            removed += 1
+    print(f"Removed {removed} legacy links")
+    return removed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ユーザーディレクトリの分散配置への移行")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help="旧形式のディレクトリを分散配置へ移す")
+    migrate_parser.add_argument("--user", help="対象のinvitation_id（省略時は全ユーザー）")
+    migrate_parser.add_argument("--dry-run", action="store_true")
+    migrate_parser.add_argument("--rate", type=float, default=None, help="1秒あたりの最大移行ユーザー数")
+    subparsers.add_parser("cleanup", help="旧パスに残したリンクを削除する")
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        migrate(STORAGE_PATH, args.user, args.dry_run, args.rate)
+    elif args.command == "cleanup":
+        cleanup_links(STORAGE_PATH)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+# img/limits.py
+# アップロードのリクエスト全体のサイズ制限（ASGIミドルウェア）
+#
+# UploadFileの中身を読む時点では、Starletteがマルチパートの本文をすでに一時ファイルへ書き出している
+# そのため上限を超えるリクエストは、本文を受け取る前にContent-Lengthで、
+# Content-Lengthがない場合（chunked）は受信中のバイト数で打ち切り、413を返す
+
+import json
+import re
+from fastapi import HTTPException
+
+# ファイル以外のフォーム項目（crop, specsなど）とマルチパートの区切りの分
+MULTIPART_OVERHEAD_BYTES = 256 * 1024
+
+TOO_LARGE_BODY = json.dumps({"detail": "Request body too large"}).encode("utf-8")
+
+
+class RequestTooLarge(HTTPException):
+    # FastAPIはフォームの解析中の例外を400に変えるが、HTTPExceptionはそのまま返す
+    def __init__(self):
+        super().__init__(status_code=413, detail="Request body too large")
+
+
+class UploadSizeLimitMiddleware:
+    """
+    limits: [(パスの正規表現, 上限バイト数)]。パスはマウント先を除いたもの（/upload/... など）
+    """
+
+    def __init__(self, app, limits):
+        self.app = app
+        self.limits = [(re.compile(pattern), max_bytes) for pattern, max_bytes in limits]
+
+    def limit_for(self, scope):
+        if scope["method"] not in ("POST", "PUT", "PATCH"):
+            return None
+        path = scope["path"]
+        root_path = scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        for pattern, max_bytes in self.limits:
+            if pattern.match(path):
+                return max_bytes
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        max_bytes = self.limit_for(scope)
+        if max_bytes is None:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    too_large = int(value) > max_bytes
+                except ValueError:
+                    too_large = False
+                if too_large:
+                    # 本文は読まずに返す
+                    await self.reject(send)
+                    return
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    raise RequestTooLarge()
+            return message
+
+        async def tracked_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except RequestTooLarge:
+            if response_started:
+                raise
+            await self.reject(send)
+
+    @staticmethod
+    async def reject(send):
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(TOO_LARGE_BODY)).encode("latin-1")),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": TOO_LARGE_BODY})
@@ -1,50 +1,409 @@
 # img/main.py
 
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, File, UploadFile, Form, Header
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, File, UploadFile, Form, Header, Query, Request
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
 import os
 import json
 from PIL import Image
-import io
-from img.database import get_db
-from img.models import User
-from fastapi.responses import FileResponse
+from img.config import (
+    STORAGE_PATH, BLOB_PATH, ALLOWED_EXTENSIONS, is_valid_image,
+    DERIVATIVE_CACHE_DIR, DERIVATIVE_CACHE_MAX_BYTES,
+    DERIVATIVE_CACHE_HOT_MAX_BYTES, DERIVATIVE_CACHE_HOT_MAX_ITEM_BYTES,
+)
+from img.database import get_db, init_db, SessionLocal
+from lineapi.database import SessionLocal as MainSessionLocal
+from img.models import UploadSession, ResumableUpload, ResumableChunk
+from img.storage import BlobStore
+from img.cache import DerivativeCache, derivative_params
+from img.imaging import (
+    TRANSFORM_FITS, TRANSFORM_FORMATS, FORMAT_MIME_TYPES, FORMAT_EXTENSIONS, ANIMATED_EXTENSIONS, POSTER_WIDTH,
+    process_image_file, process_animation_file, transform_file, describe_image, probe_image,
+    ImageRejected,
+)
+from img.worker import image_worker_pool, WorkerPoolFull
+from img import manifest
+from img import layout
+from img import resumable
+from img import signing
+from img.limits import UploadSizeLimitMiddleware, MULTIPART_OVERHEAD_BYTES
+from img.sweeper import run_sweeper
+from img.membership import MembershipCache, run_membership_sync
+from img.responses import (
+    conditional_file_response, conditional_bytes_response, is_not_modified, IMMUTABLE_CACHE_CONTROL,
+)
+from fastapi.responses import Response
 import mimetypes
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Optional
 from typing import List
-import shutil
+import hashlib
+import tempfile
+from concurrent.futures.process import BrokenProcessPool
+import re
+import asyncio
+import secrets
+import time
 
 app = FastAPI()
 router = APIRouter()
 
-STORAGE_PATH = "storage/users/"
-ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif'}
-DEFAULT_CATEGORY = "sandbox"
+# 古い環境ではWebPのMIMEタイプが登録されていないため追加する
+mimetypes.add_type("image/webp", ".webp")
 
-def process_image(file, width, height, crop_data):
-    image = Image.open(file)
-    
-    if crop_data:
-        left = crop_data['x'] * image.width / 100
-        top = crop_data['y'] * image.height / 100
-        right = left + (crop_data['width'] * image.width / 100)
-        bottom = top + (crop_data['height'] * image.height / 100)
-        image = image.crop((left, top, right, bottom))
-    
-    image = image.resize((width, height), Image.LANCZOS)
-    
-    output = io.BytesIO()
-    image.save(output, format='JPEG', quality=85)
-    output.seek(0)
-    
-    return output
-
-def generate_unique_filename(original_filename):
+DEFAULT_CATEGORY = "sandbox"
+IMAGE_CACHE_CONTROL = "max-age=3600"  # 1時間のキャッシュ（以降はETagで再検証）
+PRIVATE_IMAGE_CACHE_CONTROL = "private, max-age={max_age}"  # 署名付きURLは共有キャッシュに載せない
+BLOB_NAME_PATTERN = re.compile(r"^([0-9a-f]{64})(\.[a-z]+)$")
+
+MAX_TRANSFORM_DIMENSION = 2000
+CROP_KEYS = ("x", "y", "width", "height")
+
+# アップロードの設定
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("IMG_MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+MAX_BATCH_FILES = 20
+
+# 形式の指定がないアニメーション画像（GIF・APNG・WebP）の保存形式（"gif" または "webp"）
+ANIMATED_OUTPUT_FORMAT = TRANSFORM_FORMATS.get(os.getenv("IMG_ANIMATED_FORMAT", "gif"), "GIF")
+
+# 保存時の容量目標（カテゴリ・サブディレクトリ名ごと、バイト）
+CATEGORY_BYTE_BUDGETS = {
+    "icon": 50 * 1024,
+    "header": 200 * 1024,
+    "blog": 300 * 1024,
+}
+
+# 仮アップロード（temp）の設定
+TEMP_SUB_DIRECTORY = "temp"
+UPLOAD_SESSION_TTL = int(os.getenv("IMG_UPLOAD_SESSION_TTL", 24 * 60 * 60))
+SWEEP_INTERVAL = int(os.getenv("IMG_SWEEP_INTERVAL", 10 * 60))
+SWEEP_BATCH_SIZE = 100
+
+# 分割アップロードの有効期限（チャンクを受信するたびに延長する）
+RESUMABLE_UPLOAD_TTL = int(os.getenv("IMG_RESUMABLE_UPLOAD_TTL", 24 * 60 * 60))
+
+# ユーザー存在確認キャッシュの差分同期間隔（秒）
+MEMBERSHIP_SYNC_INTERVAL = int(os.getenv("IMG_MEMBERSHIP_SYNC_INTERVAL", 60))
+
+# 上限を超えるアップロードは本文を受け取る前（Content-Length）か受信中に413で打ち切る
+app.add_middleware(UploadSizeLimitMiddleware, limits=[
+    (r"^/upload/", MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES),
+    (r"^/upload_batch/", MAX_BATCH_FILES * MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES),
+    (r"^/resumable/[^/]+/chunks/", resumable.MAX_CHUNK_SIZE),
+])
+
+derivative_cache = DerivativeCache(
+    cache_dir=DERIVATIVE_CACHE_DIR,
+    max_bytes=DERIVATIVE_CACHE_MAX_BYTES,
+    hot_max_bytes=DERIVATIVE_CACHE_HOT_MAX_BYTES,
+    hot_max_item_bytes=DERIVATIVE_CACHE_HOT_MAX_ITEM_BYTES,
+)
+
+# バックグラウンド処理（仮アップロードの掃除・ユーザー一覧の同期）
+sweeper_stats = {}
+_background_tasks = []
+
+def start_background_tasks():
+    if _background_tasks:
+        return
+    _background_tasks.append(asyncio.create_task(run_sweeper(
+        SessionLocal, blob_store, SWEEP_INTERVAL, SWEEP_BATCH_SIZE,
+        timedelta(seconds=UPLOAD_SESSION_TTL), sweeper_stats
+    )))
+    _background_tasks.append(asyncio.create_task(run_membership_sync(membership, MEMBERSHIP_SYNC_INTERVAL)))
+
+def stop_background_tasks():
+    for task in _background_tasks:
+        task.cancel()
+    _background_tasks.clear()
+    image_worker_pool.shutdown()
+
+# 単体起動時用（main.pyにマウントされた場合はmain.py側で開始・終了する）
+@app.on_event("startup")
+async def startup_background_tasks():
+    start_background_tasks()
+
+@app.on_event("shutdown")
+def shutdown_background_tasks():
+    stop_background_tasks()
+
+init_db()
+blob_store = BlobStore(BLOB_PATH, SessionLocal)
+
+# ユーザーの存在確認はメモリ上の集合で行う（正はlineapiのusersテーブル）
+membership = MembershipCache(MainSessionLocal, SessionLocal)
+membership.watch_user_inserts()
+
+async def run_image_job(func, *args):
+    """
+    画像処理をワーカープロセスで実行する。混雑時やワーカーの異常終了時は503とRetry-Afterを返す
+    """
+    try:
+        return await image_worker_pool.run(func, *args)
+    except WorkerPoolFull as e:
+        print("Image worker pool is full")
+        raise HTTPException(
+            status_code=503,
+            detail="Image processing is busy, please retry later",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except BrokenProcessPool:
+        # プールは次のジョブで作り直されるので、クライアントには再試行を促す
+        print("Image worker process terminated unexpectedly")
+        raise HTTPException(
+            status_code=503,
+            detail="Image processing failed, please retry later",
+            headers={"Retry-After": str(image_worker_pool.retry_after)}
+        )
+
+def make_temp_path(directory):
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".upload_", suffix=".tmp")
+    os.close(fd)
+    return temp_path
+
+async def stream_upload_to_temp(file: UploadFile, directory):
+    """
+    アップロードをチャンク単位で保存先ディレクトリの一時ファイルに書き出す
+    書き込みながらSHA-256を計算し、上限サイズを超えた時点で413を返す
+    """
+    temp_path = make_temp_path(directory)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(temp_path, "wb") as out:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail="File too large")
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return temp_path, size, digest.hexdigest()
+
+def generate_unique_filename(original_filename, content_hash):
+    # 同じ秒に複数アップロードされても衝突しないよう内容のハッシュを付ける
     now = datetime.now()
     file_extension = os.path.splitext(original_filename)[1].lower()
     date_time_str = now.strftime("%Y%m%d%H%M%S")
-    return f"{date_time_str}{file_extension}"
+    return f"{date_time_str}_{content_hash[:8]}{file_extension}"
+
+def byte_budget_for(category, sub_directory):
+    # より具体的なサブディレクトリ名を優先する（例: profile/header → header）
+    parts = [category] + (sub_directory.split("/") if sub_directory else [])
+    for part in reversed(parts):
+        if part in CATEGORY_BYTE_BUDGETS:
+            return CATEGORY_BYTE_BUDGETS[part]
+    return None
+
+def poster_path(logical_path):
+    # アニメーション画像の先頭フレーム（静止画）のURL（/img からの相対）
+    if signing.is_private(logical_path):
+        # 非公開カテゴリは本体と同じく署名付きURLにする
+        return f"{signing.signed_url(logical_path)}&width={POSTER_WIDTH}&format=jpeg"
+    return f"i/{logical_path.replace(os.sep, '/')}?width={POSTER_WIDTH}&format=jpeg"
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def validate_crop(crop_data):
+    """
+    クロップ範囲（画像に対する%の x / y / width / height）を検証する。不正な値は400
+    """
+    if crop_data is None:
+        return None
+    if not isinstance(crop_data, dict) or not all(is_number(crop_data.get(key)) for key in CROP_KEYS):
+        raise HTTPException(status_code=400, detail="Invalid crop")
+    x, y, crop_width, crop_height = (crop_data[key] for key in CROP_KEYS)
+    if not (0 <= x < 100 and 0 <= y < 100 and 0 < crop_width <= 100 and 0 < crop_height <= 100):
+        raise HTTPException(status_code=400, detail="Invalid crop")
+    return crop_data
+
+def parse_crop(crop):
+    # フォームのcrop（JSON文字列）
+    if not crop:
+        return None
+    try:
+        crop_data = json.loads(crop)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid crop")
+    return validate_crop(crop_data)
+
+def require_private_enabled(logical_path):
+    # 署名鍵がなければ非公開カテゴリは保存も配信もしない（署名付きURLを発行できないため）
+    if signing.is_private(logical_path) and not signing.is_enabled():
+        raise HTTPException(status_code=503, detail="Private images are not available")
+
+def logical_path_of(file_path):
+    # STORAGE_PATHからの相対パス（BlobStoreのキー）。分散配置の実パスからも同じ論理パスになる
+    return layout.logical_path(file_path)
+
+async def save_upload(db, file, invitation_id, category, sub_directory, width, height, crop_data, file_name,
+                      output_format=None):
+    """
+    アップロード1件分の保存処理（upload_image と upload_batch で共通）
+    """
+    require_private_enabled(os.path.join(invitation_id, category))
+    user_dir = layout.user_dir(invitation_id)
+    category_dir = os.path.join(user_dir, category)
+    if sub_directory:
+        category_dir = os.path.join(category_dir, sub_directory)
+
+    # 仮アップロードはセッションごとのディレクトリに置き、同時の下書きが上書きし合わないようにする
+    upload_token = None
+    if sub_directory == TEMP_SUB_DIRECTORY:
+        upload_token = secrets.token_urlsafe(16)
+        category_dir = os.path.join(category_dir, upload_token)
+
+    # ディレクトリの存在確認用デバッグログ
+    print(f"Final category directory path: {category_dir}")
+    os.makedirs(category_dir, exist_ok=True)
+
+    file_extension = os.path.splitext(file.filename)[1].lower()
+    if file_extension not in ALLOWED_EXTENSIONS:
+        print("Invalid file type")
+        raise HTTPException(status_code=400, detail="Invalid file type")
+    if output_format and output_format.lower() not in TRANSFORM_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid format")
+    
+    # アップロード内容はメモリに載せず、一時ファイルへ分割して書き出す
+    temp_path, upload_size, upload_hash = await stream_upload_to_temp(file, category_dir)
+
+    processed_path = None
+    try:
+        # デコード前にヘッダーだけで形式・ピクセル数・フレーム数を検査する
+        try:
+            probe = probe_image(temp_path, ALLOWED_EXTENSIONS, file_extension)
+        except ImageRejected as e:
+            print(f"Rejected image: {e.detail}")
+            raise HTTPException(status_code=413 if e.too_large else 400, detail=e.detail)
+
+        resize = bool(width and height)
+        if output_format:
+            pil_format = TRANSFORM_FORMATS[output_format.lower()]
+        elif probe["frames"] > 1:
+            pil_format = ANIMATED_OUTPUT_FORMAT
+        elif resize:
+            pil_format = "JPEG"
+        else:
+            pil_format = probe["format"]
+
+        # アニメーションのまま保存できる形式なら全フレームを加工する（JPEG等の指定時は先頭フレームのみ）
+        animated = probe["frames"] > 1 and pil_format in ANIMATED_EXTENSIONS
+        frames = poster = None
+        if animated:
+            processed_path = make_temp_path(category_dir)
+            stored = await run_image_job(
+                process_animation_file, temp_path, processed_path,
+                width if resize else None, height if resize else None,
+                crop_data if resize else None, "fill", pil_format,
+                byte_budget_for(category, sub_directory)
+            )
+            source_path = processed_path
+            stored_size, stored_hash = stored["size"], stored["sha256"]
+            stored_width, stored_height = stored["width"], stored["height"]
+            placeholder, frames, poster = stored["placeholder"], stored["frames"], stored["poster"]
+        elif pil_format in FORMAT_EXTENSIONS:
+            # 向きの補正・メタデータ除去・再エンコードはワーカープロセスで実行
+            processed_path = make_temp_path(category_dir)
+            stored = await run_image_job(
+                process_image_file, temp_path, processed_path,
+                width if resize else None, height if resize else None,
+                crop_data if resize else None, "fill", pil_format,
+                byte_budget_for(category, sub_directory)
+            )
+            source_path = processed_path
+            stored_size, stored_hash = stored["size"], stored["sha256"]
+            stored_width, stored_height = stored["width"], stored["height"]
+            placeholder = stored["placeholder"]
+        else:
+            stored_size, stored_hash = upload_size, upload_hash
+            source_path = temp_path
+            stored_width, stored_height = probe["width"], probe["height"]
+            try:
+                placeholder = await image_worker_pool.run(describe_image, temp_path)
+            except (WorkerPoolFull, BrokenProcessPool):
+                # プレースホルダーは必須ではないので、混雑時やワーカーの異常終了時は省略して保存を優先する
+                placeholder = None
+
+        # ファイル名の生成
+        if file_name:
+            unique_filename = file_name
+        else:
+            unique_filename = generate_unique_filename(file.filename, stored_hash)
+        if output_format or animated or pil_format != probe["format"]:
+            # 形式を指定・変換した場合（リサイズでJPEGにした場合を含む）は拡張子も合わせる
+            extension = ANIMATED_EXTENSIONS[pil_format] if animated else FORMAT_EXTENSIONS[pil_format]
+            unique_filename = os.path.splitext(unique_filename)[0] + extension
+
+        file_path = os.path.join(category_dir, unique_filename)
+        print(f"Saving file to: {file_path}")  # ファイル保存先の確認用
+
+        if signing.is_private(logical_path_of(file_path)):
+            # 非公開カテゴリはコンテンツアドレスURL（/b/）で配信されないよう、重複排除の対象にしない
+            blob_store.store_unshared(source_path, logical_path_of(file_path), file_path)
+            blob_extension = None
+        else:
+            # 同じ内容の画像は実体を1つだけ保存する
+            blob_extension = blob_store.store(source_path, logical_path_of(file_path), file_path, stored_hash, stored_size)
+        manifest.record_file(
+            db, logical_path_of(file_path), stored_size, stored_hash,
+            stored_width, stored_height, placeholder, frames
+        )
+        if poster:
+            # 一覧表示用の静止画は変換キャッシュに入れておき、初回表示から変換を待たずに返す
+            poster_key = DerivativeCache.make_key(
+                file_path, os.stat(file_path), derivative_params(POSTER_WIDTH, None, "cover", "JPEG")
+            )
+            derivative_cache.put(poster_key, poster)
+        print(f"File saved successfully: {file_path}")
+    except OSError as e:
+        print(f"Error saving file: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to save the file")
+    finally:
+        for path in (temp_path, processed_path):
+            if path and os.path.exists(path):
+                os.remove(path)
+
+    relative_path = logical_path_of(file_path)
+
+    result = {
+        "filename": unique_filename,
+        "path": relative_path,
+        "category": category,
+        "sub_directory": sub_directory,
+        "size": stored_size,
+        "sha256": stored_hash,
+        "content_path": f"b/{stored_hash}{blob_extension}",
+        "width": stored_width,
+        "height": stored_height,
+        "placeholder": placeholder
+    }
+    if animated:
+        result["frames"] = frames
+        result["poster_path"] = poster_path(relative_path)
+
+    # 非公開カテゴリは公開のコンテンツアドレスURLを返さず、期限付きの署名付きURLを返す
+    if signing.is_private(relative_path):
+        del result["content_path"]
+        result["signed_url"] = signing.signed_url(relative_path)
+
+    if upload_token:
+        expires_at = datetime.now() + timedelta(seconds=UPLOAD_SESSION_TTL)
+        db.add(UploadSession(
+            token=upload_token, invitation_id=invitation_id, category=category,
+            path=relative_path, expires_at=expires_at
+        ))
+        db.commit()
+        result["upload_token"] = upload_token
+        result["expires_at"] = expires_at
+
+    return result
 
 # main.py
 
@@ -60,67 +419,243 @@ async def upload_image(
     crop: Optional[str] = Form(None),
     sub_directory: Optional[str] = Form(None),
     file_name: Optional[str] = Form(None),
+    output_format: Optional[str] = Form(None, alias="format"),
     db: Session = Depends(get_db)
 ):
     print(f"Received upload request: invitation_id={invitation_id}, category={category}")
     print(f"width={width}, height={height}, sub_directory={sub_directory}, file_name={file_name}")
 
-    user_dir = os.path.join(STORAGE_PATH, invitation_id)
-    category_dir = os.path.join(user_dir, category)
-    if sub_directory:
-        category_dir = os.path.join(category_dir, sub_directory)
+    crop_data = parse_crop(crop)
+    return await save_upload(
+        db, file, invitation_id, category, sub_directory, width, height, crop_data, file_name, output_format
+    )
 
-    # ディレクトリの存在確認用デバッグログ
-    print(f"Final category directory path: {category_dir}")
-    os.makedirs(category_dir, exist_ok=True)
+def validate_batch_spec(index, spec):
+    # upload_batch の specs の1要素（upload_image のフォームと同じ項目）
+    invalid = HTTPException(status_code=400, detail=f"Invalid specs[{index}]")
+    if not isinstance(spec, dict):
+        raise invalid
+    for key in ("width", "height"):
+        value = spec.get(key)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 1):
+            raise invalid
+    for key in ("file_name", "format"):
+        if spec.get(key) is not None and not isinstance(spec[key], str):
+            raise invalid
+    if spec.get("format") and spec["format"].lower() not in TRANSFORM_FORMATS:
+        raise invalid
+    try:
+        validate_crop(spec.get("crop"))
+    except HTTPException:
+        raise invalid
 
-    file_extension = os.path.splitext(file.filename)[1].lower()
-    if file_extension not in ALLOWED_EXTENSIONS:
-        print("Invalid file type")
-        raise HTTPException(status_code=400, detail="Invalid file type")
-    
-    crop_data = json.loads(crop) if crop else None
-    
-    if width and height:
-        processed_image = process_image(file.file, width, height, crop_data)
-    else:
-        file.file.seek(0)
-        processed_image = file.file.read()
+@router.post("/upload_batch/{invitation_id}/{category}")
+async def upload_batch(
+    invitation_id: str,
+    category: str,
+    files: List[UploadFile] = File(...),
+    specs: Optional[str] = Form(None),
+    sub_directory: Optional[str] = Form(None)
+):
+    """
+    複数ファイルをまとめてアップロードする
+    specsはfilesと同じ順番のJSON配列で、各要素に width / height / crop / file_name / format を指定できる
+    画像処理はワーカープールで並列に実行し、ファイルごとの結果（失敗を含む）を返す
+    並列に保存するため、DBセッションはファイルごとに分ける
+    """
+    print(f"Received batch upload request: invitation_id={invitation_id}, category={category}, files={len(files)}")
 
-    # ファイル名の生成
-    if file_name:
-        unique_filename = file_name
-    else:
-        unique_filename = generate_unique_filename(file.filename)
-    
-    file_path = os.path.join(category_dir, unique_filename)
-    print(f"Saving file to: {file_path}")  # ファイル保存先の確認用
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"Too many files (max {MAX_BATCH_FILES})")
 
     try:
-        with open(file_path, "wb") as buffer:
-            if isinstance(processed_image, io.BytesIO):
-                buffer.write(processed_image.getvalue())
-            else:
-                buffer.write(processed_image)
-        print(f"File saved successfully: {file_path}")
-    except IOError as e:
-        print(f"Error saving file: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to save the file")
-
-    relative_path = os.path.relpath(file_path, STORAGE_PATH)
-    
+        spec_list = json.loads(specs) if specs else []
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid specs")
+    if not isinstance(spec_list, list) or len(spec_list) > len(files):
+        raise HTTPException(status_code=400, detail="Invalid specs")
+    # 1件でも不正な指定があれば、保存を始める前にまとめて400を返す
+    for index, spec in enumerate(spec_list):
+        validate_batch_spec(index, spec)
+    spec_list += [{}] * (len(files) - len(spec_list))
+
+    async def save_one(index, file, spec):
+        db = SessionLocal()
+        try:
+            result = await save_upload(
+                db, file, invitation_id, category, sub_directory,
+                spec.get("width"), spec.get("height"), spec.get("crop"), spec.get("file_name"),
+                spec.get("format")
+            )
+            return {"index": index, "success": True, **result}
+        except HTTPException as e:
+            return {"index": index, "success": False, "status_code": e.status_code, "detail": e.detail}
+        except Exception as e:
+            print(f"Error in batch upload: {str(e)}")
+            return {"index": index, "success": False, "status_code": 500, "detail": str(e)}
+        finally:
+            db.close()
+
+    results = await asyncio.gather(*(
+        save_one(index, file, spec) for index, (file, spec) in enumerate(zip(files, spec_list))
+    ))
+    succeeded = sum(1 for r in results if r["success"])
     return {
-        "filename": unique_filename,
-        "path": relative_path,
-        "category": category,
-        "sub_directory": sub_directory
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results
     }
 
+def get_active_resumable(db, upload_id):
+    upload = db.query(ResumableUpload).filter(
+        ResumableUpload.token == upload_id,
+        ResumableUpload.expires_at >= datetime.now()
+    ).first()
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload session not found or expired")
+    return upload
+
+# "/resumable/{invitation_id}/{category}" より先に登録する（後にすると complete がカテゴリ名として扱われる）
+@router.post("/resumable/{upload_id}/complete")
+async def complete_resumable_upload(
+    upload_id: str,
+    sha256: Optional[str] = Form(None),
+    db: Session = Depends(get_db)
+):
+    """
+    全チャンクの受信後、結合したファイルを upload_image と同じ処理で保存する
+    """
+    upload = get_active_resumable(db, upload_id)
+    missing = resumable.upload_status(db, upload)["missing"]
+    if missing:
+        raise HTTPException(status_code=409, detail={"message": "Missing chunks", "missing": missing})
+
+    partial_path = resumable.partial_path(upload_id)
+    if sha256 and sha256.lower() != await asyncio.to_thread(resumable.file_sha256, partial_path):
+        raise HTTPException(status_code=422, detail="File checksum mismatch")
+
+    options = json.loads(upload.options or "{}")
+    with open(partial_path, "rb") as f:
+        result = await save_upload(
+            db, UploadFile(file=f, filename=upload.filename), upload.invitation_id, upload.category,
+            options.get("sub_directory"), options.get("width"), options.get("height"), options.get("crop"),
+            options.get("file_name"), options.get("format")
+        )
+
+    resumable.discard_upload(db, upload_id)
+    db.commit()
+    return result
+
+@router.post("/resumable/{invitation_id}/{category}")
+async def create_resumable_upload(
+    invitation_id: str,
+    category: str,
+    filename: str = Form(...),
+    size: int = Form(..., ge=1),
+    chunk_size: Optional[int] = Form(None),
+    width: Optional[int] = Form(None),
+    height: Optional[int] = Form(None),
+    crop: Optional[str] = Form(None),
+    sub_directory: Optional[str] = Form(None),
+    file_name: Optional[str] = Form(None),
+    output_format: Optional[str] = Form(None, alias="format"),
+    db: Session = Depends(get_db)
+):
+    """
+    分割アップロードのセッションを作成する。画像の指定は upload_image と同じで、完了時に適用する
+    """
+    print(f"Received resumable upload request: invitation_id={invitation_id}, category={category}, size={size}")
+
+    require_private_enabled(os.path.join(invitation_id, category))
+    if os.path.splitext(filename)[1].lower() not in ALLOWED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="Invalid file type")
+    if output_format and output_format.lower() not in TRANSFORM_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid format")
+    if size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="File too large")
+    crop_data = parse_crop(crop)
+
+    chunk_size = min(max(chunk_size or resumable.DEFAULT_CHUNK_SIZE, resumable.MIN_CHUNK_SIZE), resumable.MAX_CHUNK_SIZE)
+    token = secrets.token_urlsafe(16)
+    await asyncio.to_thread(resumable.create_partial_file, token, size)
+
+    upload = ResumableUpload(
+        token=token, invitation_id=invitation_id, category=category, filename=filename,
+        total_size=size, chunk_size=chunk_size,
+        options=json.dumps({
+            "width": width, "height": height, "crop": crop_data,
+            "sub_directory": sub_directory, "file_name": file_name, "format": output_format
+        }),
+        expires_at=datetime.now() + timedelta(seconds=RESUMABLE_UPLOAD_TTL)
+    )
+    db.add(upload)
+    db.commit()
+    return resumable.upload_status(db, upload)
+
+@router.get("/resumable/{upload_id}")
+async def get_resumable_upload(upload_id: str, db: Session = Depends(get_db)):
+    return resumable.upload_status(db, get_active_resumable(db, upload_id))
+
+@router.put("/resumable/{upload_id}/chunks/{index}")
+async def upload_resumable_chunk(
+    request: Request,
+    upload_id: str,
+    index: int,
+    x_chunk_sha256: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """
+    チャンクを1つ受け取り、index * chunk_size の位置に書き込む。同じチャンクの再送は上書きになる
+    """
+    upload = get_active_resumable(db, upload_id)
+    if index < 0 or index >= resumable.chunk_count(upload):
+        raise HTTPException(status_code=400, detail="Invalid chunk index")
+
+    expected_size = resumable.expected_chunk_size(upload, index)
+    data = bytearray()
+    async for part in request.stream():
+        data += part
+        if len(data) > expected_size:
+            raise HTTPException(status_code=413, detail="Chunk too large")
+    if len(data) != expected_size:
+        raise HTTPException(status_code=400, detail=f"Chunk size mismatch (expected {expected_size} bytes)")
+
+    digest = hashlib.sha256(data).hexdigest()
+    if x_chunk_sha256 and x_chunk_sha256.lower() != digest:
+        raise HTTPException(status_code=422, detail="Chunk checksum mismatch")
+
+    await asyncio.to_thread(resumable.write_chunk, upload_id, index * upload.chunk_size, bytes(data))
+
+    chunk = db.query(ResumableChunk).filter(
+        ResumableChunk.token == upload_id, ResumableChunk.chunk_index == index
+    ).first()
+    if chunk:
+        chunk.sha256 = digest
+    else:
+        db.add(ResumableChunk(token=upload_id, chunk_index=index, sha256=digest))
+    upload.expires_at = datetime.now() + timedelta(seconds=RESUMABLE_UPLOAD_TTL)
+    try:
+        db.commit()
+    except IntegrityError:
+        # 同じチャンクが並列に再送された場合（内容は同じなので記録は1つでよい）
+        db.rollback()
+
+    return {"upload_id": upload_id, "index": index, "sha256": digest}
+
 
 @router.get("/")
 async def test_endpoint():
     return {"message": "Upload service is working!"}
 
+@router.get("/worker_stats")
+async def worker_stats():
+    return {
+        "worker_pool": image_worker_pool.stats(),
+        "derivative_cache": derivative_cache.stats(),
+        "temp_sweeper": sweeper_stats,
+        "membership": membership.stats()
+    }
+
 @router.get("/test")
 async def another_test_endpoint():
     return {"message": "This is another test endpoint in upload service"}
@@ -131,8 +666,7 @@ async def create_directory(
     db: Session = Depends(get_db)
 ):
     try:
-        user = db.query(User).filter(User.invitation_id == invitation_id).first()
-        if not user:
+        if not await membership.contains(invitation_id):
             raise HTTPException(status_code=404, detail="User with this invitation ID not found")
         
         directory_structure = {
@@ -146,7 +680,7 @@ async def create_directory(
             "reviews": {}
         }
         
-        base_path = create_user_directory(invitation_id, directory_structure)
+        base_path = layout.create_user_directory(invitation_id, directory_structure)
         return {
             "message": f"Directory structure created for user with invitation ID {invitation_id}",
             "path": base_path,
@@ -156,22 +690,63 @@ async def create_directory(
         print(f"Error: {str(e)}")  # サーバーコンソールにエラーを出力
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
-def is_valid_image(file_path):
-    return os.path.splitext(file_path)[1].lower() in ALLOWED_EXTENSIONS
-
 # main.py
 
+async def transformed_image_response(request, full_path, width, height, fit, output_format,
+                                     cache_control=IMAGE_CACHE_CONTROL):
+    """
+    変換済み画像を返す。キャッシュになければワーカープロセスで生成して保存する
+    """
+    params = derivative_params(width, height, fit, output_format)
+    key = DerivativeCache.make_key(full_path, os.stat(full_path), params)
+    etag = f'"{key}"'
+
+    # キャッシュキーは元画像の更新時刻・サイズを含むので、一致すれば変換せずに304を返せる
+    if is_not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+    data = derivative_cache.get(key)
+    if data is None:
+        try:
+            data = await run_image_job(transform_file, full_path, width, height, fit, output_format)
+        except (OSError, Image.DecompressionBombError) as e:
+            print(f"Error transforming image: {str(e)}")
+            raise HTTPException(status_code=422, detail="Failed to transform the image")
+        derivative_cache.put(key, data)
+
+    return conditional_bytes_response(request, data, FORMAT_MIME_TYPES[output_format], cache_control, etag)
+
 @app.get("/i/{path:path}")
-async def get_image(path: str, authorization: Optional[str] = Header(None)):
+async def get_image(
+    request: Request,
+    path: str,
+    width: Optional[int] = Query(None, ge=1, le=MAX_TRANSFORM_DIMENSION),
+    height: Optional[int] = Query(None, ge=1, le=MAX_TRANSFORM_DIMENSION),
+    fit: str = Query("cover"),
+    output_format: Optional[str] = Query(None, alias="format"),
+    expires: Optional[int] = Query(None),
+    sig: Optional[str] = Query(None),
+    authorization: Optional[str] = Header(None)
+):
     # リクエストされたパスをデバッグ出力
     print(f"Requested path: {path}")
     
-    full_path = os.path.abspath(os.path.join(STORAGE_PATH, path))
-    print(f"Full path resolved: {full_path}")  # 完全なパスの確認
-
-    if not full_path.startswith(os.path.abspath(STORAGE_PATH)):
+    resolved_path = layout.resolve_client_path(os.path.join(STORAGE_PATH, path))
+    if resolved_path is None:
         raise HTTPException(status_code=403, detail="Access denied")
 
+    # 非公開カテゴリは署名付きURLのみ（鍵だけで検証するのでDBは参照しない）
+    # 判定・検証は実際に読むファイルの論理パスで行う
+    logical = layout.logical_path(resolved_path)
+    cache_control = IMAGE_CACHE_CONTROL
+    require_private_enabled(logical)
+    if signing.is_private(logical):
+        if not signing.verify(logical, expires, sig):
+            raise HTTPException(status_code=403, detail="Access denied")
+        cache_control = PRIVATE_IMAGE_CACHE_CONTROL.format(max_age=max(0, min(expires - int(time.time()), 3600)))
+    full_path = os.path.abspath(resolved_path)
+    print(f"Full path resolved: {full_path}")  # 完全なパスの確認
+
     if not os.path.exists(full_path) or not is_valid_image(full_path):
         raise HTTPException(status_code=404, detail="Image not found")
 
@@ -180,36 +755,107 @@ async def get_image(path: str, authorization: Optional[str] = Header(None)):
     if not mime_type or not mime_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="Invalid file type")
 
-    return FileResponse(
-        full_path,
-        media_type=mime_type,
-        headers={"Cache-Control": "max-age=3600"}  # 1時間のキャッシュ
-    )
+    # width/height/format指定があれば変換済み画像を返す
+    if width or height or output_format:
+        if fit not in TRANSFORM_FITS:
+            raise HTTPException(status_code=400, detail="Invalid fit")
+        if output_format and output_format.lower() not in TRANSFORM_FORMATS:
+            raise HTTPException(status_code=400, detail="Invalid format")
+        pil_format = TRANSFORM_FORMATS[output_format.lower()] if output_format else "JPEG"
+        return await transformed_image_response(request, full_path, width, height, fit, pil_format, cache_control)
+
+    return conditional_file_response(request, full_path, mime_type, cache_control)
+
+# コンテンツアドレスURL（内容のSHA-256がファイル名なので永続的にキャッシュできる）
+@app.get("/b/{name}")
+async def get_blob(request: Request, name: str):
+    match = BLOB_NAME_PATTERN.match(name)
+    if not match or match.group(2) not in ALLOWED_EXTENSIONS:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    sha256, extension = match.groups()
+    blob_file = blob_store.blob_path(sha256, extension)
+    if not os.path.exists(blob_file):
+        raise HTTPException(status_code=404, detail="Image not found")
+    # 非公開カテゴリは重複排除しないが、それ以前に保存された実体は非公開のパスから参照されている
+    if any(signing.is_private(ref_path) for ref_path in blob_store.ref_paths(sha256)):
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    mime_type, _ = mimetypes.guess_type(blob_file)
+    return conditional_file_response(request, blob_file, mime_type, IMMUTABLE_CACHE_CONTROL, etag=f'"{sha256}"')
 
 
 # キャストごとの画像取得エンドポイント
 #curl "https://5611-122-217-34-64.ngrok-free.app/img/list/6XaDKrQE"
 @router.get("/list/{invitation_id}", response_model=List[str])
-async def list_files(invitation_id: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.invitation_id == invitation_id).first()
-    if not user:
+async def list_files(
+    invitation_id: str,
+    response: Response,
+    category: Optional[str] = None,
+    cursor: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    db: Session = Depends(get_db)
+):
+    """
+    image_filesテーブルから一覧を返す。limit指定時は次ページのcursorをX-Next-Cursorヘッダーで返す
+    """
+    if not await membership.contains(invitation_id):
         raise HTTPException(status_code=404, detail="User with this invitation ID not found")
 
-    user_dir = os.path.join(STORAGE_PATH, invitation_id)
-    if not os.path.exists(user_dir):
-        raise HTTPException(status_code=404, detail="Directory not found")
-
     try:
-        files = [os.path.join(dp, f) for dp, dn, filenames in os.walk(user_dir) for f in filenames]
-        return files
+        # 一覧が未作成のユーザーは初回のみファイルシステムから取り込む
+        if not manifest.has_user_files(db, invitation_id):
+            if not os.path.exists(layout.user_dir(invitation_id)):
+                raise HTTPException(status_code=404, detail="Directory not found")
+            manifest.reconcile_user(db, invitation_id)
+
+        entries = manifest.list_user_files(db, invitation_id, category, cursor, limit)
+        if limit and len(entries) == limit:
+            response.headers["X-Next-Cursor"] = str(entries[-1].id)
+        return [layout.client_path(entry.path) for entry in entries]
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
+# 画像のメタデータ（サイズ・プレースホルダー）取得エンドポイント
+#curl "https://5611-122-217-34-64.ngrok-free.app/img/meta/6XaDKrQE/blog/post_image_20241119120840.jpg"
+@router.get("/meta/{path:path}")
+async def get_image_meta(
+    path: str,
+    expires: Optional[int] = Query(None),
+    sig: Optional[str] = Query(None),
+    db: Session = Depends(get_db)
+):
+    resolved_path = layout.resolve_client_path(os.path.join(STORAGE_PATH, path))
+    if resolved_path is None:
+        raise HTTPException(status_code=403, detail="Access denied")
+    # sha256 からコンテンツアドレスURLを引けるため、非公開カテゴリは画像と同じ署名を求める
+    logical = layout.logical_path(resolved_path)
+    require_private_enabled(logical)
+    if signing.is_private(logical) and not signing.verify(logical, expires, sig):
+        raise HTTPException(status_code=403, detail="Access denied")
+    entry = manifest.get_file(db, logical)
+    if not entry:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return {
+        "path": entry.path,
+        "width": entry.width,
+        "height": entry.height,
+        "aspect_ratio": entry.width / entry.height if entry.width and entry.height else None,
+        "size": entry.size,
+        "sha256": entry.sha256,
+        "placeholder": entry.placeholder,
+        "frames": entry.frames,
+        "poster_path": poster_path(entry.path) if entry.frames and entry.frames > 1 else None
+    }
+
 # ファイル存在確認エンドポイント
 #curl "https://5611-122-217-34-64.ngrok-free.app/img/check_file?file_path=storage/users/6XaDKrQE/profile/cast/images/castimage_111.jpg"
 @router.get("/check_file")
 async def check_file(file_path: str):
-    if os.path.exists(file_path):
+    resolved_path = layout.resolve_client_path(file_path)
+    if resolved_path and os.path.exists(resolved_path):
         return {"message": "File exists", "file_path": file_path}
     else:
         return {"message": "File does not exist", "file_path": file_path}
@@ -218,11 +864,13 @@ async def check_file(file_path: str):
 #curl -X DELETE "https://5611-122-217-34-64.ngrok-free.app/img/delete_file?file_path=storage/users/6XaDKrQE/profile/cast/images/castimage_111.jpg"
 @router.delete("/delete_file")
 async def delete_file(file_path: str, db: Session = Depends(get_db)):
-    if not os.path.exists(file_path):
+    resolved_path = layout.resolve_client_path(file_path)
+    if not resolved_path or not os.path.exists(resolved_path):
         raise HTTPException(status_code=404, detail="File not found")
 
     try:
-        os.remove(file_path)
+        blob_store.release(logical_path_of(resolved_path), resolved_path)
+        manifest.remove_file(db, logical_path_of(resolved_path))
         return {"message": "File deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
@@ -232,18 +880,40 @@ async def delete_file(file_path: str, db: Session = Depends(get_db)):
 async def finalize_upload(
     invitation_id: str,
     category: str,
-    final_name: str = Form(...)  # 本保存ファイル名のみ
+    final_name: str = Form(...),  # 本保存ファイル名のみ
+    upload_token: Optional[str] = Form(None),
+    db: Session = Depends(get_db)
 ):
     """
-    仮アップロードされたtemp_image.jpgを指定のファイル名にリネームして移動するエンドポイント
+    仮アップロードされた画像を指定のファイル名にリネームして移動するエンドポイント
+    upload_tokenがあればそのセッションの画像を、なければ固定名のtemp_image.jpg（旧形式）か
+    最新のセッションの画像を対象にする
     """
 
     # パス設定
-    temp_dir = os.path.join(STORAGE_PATH, invitation_id, category, "temp")
-    temp_file_path = os.path.join(temp_dir, "temp_image.jpg")  # 仮ファイル名は固定
-    final_dir = os.path.join(STORAGE_PATH, invitation_id, category)
+    user_dir = layout.user_dir(invitation_id)
+    temp_dir = os.path.join(user_dir, category, TEMP_SUB_DIRECTORY)
+    final_dir = os.path.join(user_dir, category)
     final_file_path = os.path.join(final_dir, final_name)
 
+    session_query = db.query(UploadSession).filter(
+        UploadSession.invitation_id == invitation_id,
+        UploadSession.category == category,
+        UploadSession.expires_at >= datetime.now()
+    )
+    if upload_token:
+        upload_session = session_query.filter(UploadSession.token == upload_token).first()
+        if not upload_session:
+            raise HTTPException(status_code=404, detail="Upload session not found or expired")
+        temp_file_path = layout.physical_path(upload_session.path)
+    else:
+        upload_session = None
+        temp_file_path = os.path.join(temp_dir, "temp_image.jpg")  # 旧形式の固定ファイル名
+        if not os.path.exists(temp_file_path):
+            upload_session = session_query.order_by(UploadSession.created_at.desc()).first()
+            if upload_session:
+                temp_file_path = layout.physical_path(upload_session.path)
+
     # 仮ファイルの存在チェック
     if not os.path.exists(temp_file_path):
         raise HTTPException(status_code=404, detail="Temporary image not found")
@@ -253,13 +923,29 @@ async def finalize_upload(
 
     # 仮ファイルをリネーム・移動して本保存ファイルにする
     try:
-        shutil.move(temp_file_path, final_file_path)
+        blob_store.move(
+            logical_path_of(temp_file_path), temp_file_path,
+            logical_path_of(final_file_path), final_file_path
+        )
+        if manifest.move_file(db, logical_path_of(temp_file_path), logical_path_of(final_file_path)) is None:
+            # 一覧に載っていなかった仮ファイルはここで登録する
+            manifest.record_file(
+                db, logical_path_of(final_file_path), os.path.getsize(final_file_path),
+                None, *manifest.read_dimensions(final_file_path)
+            )
+        if upload_session:
+            db.delete(upload_session)
+            db.commit()
+            try:
+                os.rmdir(os.path.dirname(temp_file_path))
+            except OSError:
+                pass
         print(f"File moved successfully to {final_file_path}")
         
         # 成功レスポンス
         return {
             "message": "Image finalized and moved successfully",
-            "file_path": final_file_path
+            "file_path": layout.client_path(logical_path_of(final_file_path))
         }
     
     except Exception as e:
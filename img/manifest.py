@@ -0,0 +1,175 @@
+# img/manifest.py
+# ユーザーごとの画像ファイル一覧（image_filesテーブル）の管理
+#
+# 使い方（ファイルシステムとの突き合わせ）:
+#   python -m img.manifest rebuild
+#   python -m img.manifest rebuild --user 6XaDKrQE
+
+import os
+import sys
+import argparse
+import hashlib
+from PIL import Image
+from sqlalchemy.orm import Session
+from img.config import STORAGE_PATH, is_valid_image
+from img.models import ImageFile
+from img import layout
+
+def split_logical_path(logical_path):
+    # "{invitation_id}/{category}/..." を (invitation_id, category) に分解する
+    parts = logical_path.replace(os.sep, "/").split("/")
+    category = parts[1] if len(parts) > 2 else ""
+    return parts[0], category
+
+def read_dimensions(file_path):
+    # ヘッダーのみ読み込むためデコードは発生しない
+    try:
+        with Image.open(file_path) as image:
+            return image.width, image.height
+    except (OSError, Image.DecompressionBombError):
+        return None, None
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def record_file(db: Session, logical_path, size, sha256=None, width=None, height=None, placeholder=None,
+                frames=None):
+    invitation_id, category = split_logical_path(logical_path)
+    entry = db.query(ImageFile).filter(ImageFile.path == logical_path).first()
+    if entry is None:
+        entry = ImageFile(path=logical_path, invitation_id=invitation_id, category=category)
+        db.add(entry)
+    entry.size = size
+    entry.sha256 = sha256
+    entry.width = width
+    entry.height = height
+    entry.placeholder = placeholder
+    entry.frames = frames
+    db.commit()
+    return entry
+
+def get_file(db: Session, logical_path):
+    return db.query(ImageFile).filter(ImageFile.path == logical_path).first()
+
+def remove_file(db: Session, logical_path):
+    db.query(ImageFile).filter(ImageFile.path == logical_path).delete()
+    db.commit()
+
+def move_file(db: Session, src_logical, dst_logical):
+    db.query(ImageFile).filter(ImageFile.path == dst_logical).delete()
+    entry = db.query(ImageFile).filter(ImageFile.path == src_logical).first()
+    if entry:
+        invitation_id, category = split_logical_path(dst_logical)
+        entry.path = dst_logical
+        entry.invitation_id = invitation_id
+        entry.category = category
+    db.commit()
+    return entry
+
+def list_user_files(db: Session, invitation_id, category=None, cursor=None, limit=None):
+    """
+    id順に返す。cursorは前ページ最後のid
+    """
+    query = db.query(ImageFile).filter(ImageFile.invitation_id == invitation_id)
+    if category:
+        query = query.filter(ImageFile.category == category)
+    if cursor:
+        query = query.filter(ImageFile.id > cursor)
+    query = query.order_by(ImageFile.id)
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+def has_user_files(db: Session, invitation_id):
+    return db.query(ImageFile.id).filter(ImageFile.invitation_id == invitation_id).first() is not None
+
+def _walk_user_files(user_dir):
+    for dirpath, _, filenames in os.walk(user_dir):
+        for filename in filenames:
+            # アップロード途中の一時ファイルは対象外
+            if filename.startswith(".") or not is_valid_image(filename):
+                continue
+            yield os.path.join(dirpath, filename)
+
+def reconcile_user(db: Session, invitation_id, storage_path=STORAGE_PATH):
+    """
+    1ユーザー分のファイル一覧をファイルシステムに合わせる。(追加, 更新, 削除) の件数を返す
+    """
+    user_dir = layout.user_dir(invitation_id, storage_path)
+    entries = {
+        entry.path: entry
+        for entry in db.query(ImageFile).filter(ImageFile.invitation_id == invitation_id)
+    }
+
+    added = updated = 0
+    seen = set()
+    for file_path in _walk_user_files(user_dir):
+        logical_path = layout.logical_path(file_path, storage_path)
+        seen.add(logical_path)
+        size = os.path.getsize(file_path)
+        entry = entries.get(logical_path)
+        if entry is not None and entry.size == size:
+            continue
+        width, height = read_dimensions(file_path)
+        if entry is None:
+            _, category = split_logical_path(logical_path)
+            db.add(ImageFile(
+                path=logical_path, invitation_id=invitation_id, category=category,
+                size=size, sha256=file_sha256(file_path), width=width, height=height,
+            ))
+            added += 1
+        else:
+            entry.size = size
+            entry.sha256 = file_sha256(file_path)
+            entry.width, entry.height = width, height
+            updated += 1
+
+    removed = 0
+    for logical_path, entry in entries.items():
+        if logical_path not in seen:
+            db.delete(entry)
+            removed += 1
+
+    db.commit()
+    return added, updated, removed
+
+def rebuild_manifest(db: Session, invitation_id=None, storage_path=STORAGE_PATH):
+    if invitation_id:
+        user_ids = [invitation_id]
+    else:
+        on_disk = {name for name, _ in layout.iter_user_dirs(storage_path)}
+        in_db = {row[0] for row in db.query(ImageFile.invitation_id).distinct()}
+        user_ids = sorted(on_disk | in_db)
+
+    totals = [0, 0, 0]
+    for user_id in user_ids:
+        counts = reconcile_user(db, user_id, storage_path)
+        totals = [t + c for t, c in zip(totals, counts)]
+        if any(counts):
+            print(f"{user_id}: added={counts[0]} updated={counts[1]} removed={counts[2]}")
+    print(f"Manifest rebuilt: users={len(user_ids)} added={totals[0]} updated={totals[1]} removed={totals[2]}")
+    return totals
+
+def main(argv=None):
+    from img.database import SessionLocal, init_db
+
+    parser = argparse.ArgumentParser(description="画像ファイル一覧の管理")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild = subparsers.add_parser("rebuild", help="ファイルシステムと突き合わせて一覧を再構築する")
+    rebuild.add_argument("--user", help="対象のinvitation_id（省略時は全ユーザー）")
+    args = parser.parse_args(argv)
+
+    init_db()
+    db = SessionLocal()
+    try:
+        if args.command == "rebuild":
+            rebuild_manifest(db, args.user)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
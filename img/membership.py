@@ -0,0 +1,273 @@
+# img/membership.py
+# invitation_id の存在確認用キャッシュ
+#
+# 正はlineapiのusersテーブル（MySQL）。起動時に全件読み込み、以降は定期的に差分（id増分）を取り込む
+# 同じプロセス内でのユーザー作成はSQLAlchemyのイベントでコミット後すぐに反映する
+# 取り込んだIDは画像サービスのusersテーブル（SQLite）にも複製し、2つのユーザー表がずれないようにする
+# （全件読み込みのときは、メインDBから削除されたユーザーを複製からも削除する）
+#
+# 載っていないIDはメインDBに1件だけ問い合わせる。同じIDへの問い合わせが続かないよう、
+# 見つからなかったIDは MEMBERSHIP_NEGATIVE_TTL 秒のあいだ覚えておく
+# DBへの問い合わせはイベントループを止めないよう別スレッドで行う
+
+import os
+import time
+import asyncio
+import threading
+from datetime import datetime
+from img.models import User
+
+REPLICATE_CHUNK_SIZE = 500
+MEMBERSHIP_NEGATIVE_TTL = float(os.getenv("IMG_MEMBERSHIP_NEGATIVE_TTL", 30))
+# 存在しないIDを大量に送られてもメモリを使い切らないよう、覚えておく件数に上限を設ける
+MAX_NEGATIVE_ENTRIES = 10000
+
+
+class MembershipCache:
+    def __init__(self, main_session_factory, local_session_factory, full_reload_every=60):
+        self.main_session_factory = main_session_factory
+        self.local_session_factory = local_session_factory
+        # 削除されたユーザーは差分では拾えないので、sync何回かに1回は全件読み直す
+        self.full_reload_every = full_reload_every
+
+        self._lock = threading.Lock()
+        self._members = set()
+        # 見つからなかったID -> 期限（time.monotonic）
+        self._missing = {}
+        self._last_id = 0
+        self._loaded = False
+        self._syncs = 0
+        self._listeners = []
+        self._stats = {
+            "hits": 0, "misses": 0, "negative_hits": 0, "fallbacks": 0, "last_sync": None, "source": None
+        }
+
+    def load(self):
+        """
+        全件を読み込む。メインDBに接続できない場合は画像サービス側のusersテーブルを使う
+        """
+        try:
+            from lineapi.models.user import User as MainUser
+
+            main_db = self.main_session_factory()
+            try:
+                rows = main_db.query(MainUser.id, MainUser.invitation_id).filter(MainUser.invitation_id.isnot(None)).all()
+            finally:
+                main_db.close()
+            members = {invitation_id for _, invitation_id in rows}
+            last_id = max((user_id for user_id, _ in rows), default=0)
+            source = "main"
+        except Exception as e:
+            print(f"Membership load from main DB failed, using local users: {str(e)}")
+            local_db = self.local_session_factory()
+            try:
+                members = {row[0] for row in local_db.query(User.invitation_id) if row[0]}
+            finally:
+                local_db.close()
+            last_id = 0
+            source = "local"
+
+        with self._lock:
+            self._members = members
+            self._missing = {}
+            self._last_id = last_id
+            self._loaded = True
+            self._stats["source"] = source
+            self._stats["last_sync"] = datetime.now().isoformat()
+        if source == "main":
+            self._replicate(members, prune=True)
+        print(f"Membership cache loaded: {len(members)} users from {source}")
+
+    def sync(self):
+        """
+        前回以降に作成されたユーザーを取り込む。新しく取り込んだ件数を返す
+        """
+        self._syncs += 1
+        if not self._loaded or self._stats["source"] != "main" or self._syncs % self.full_reload_every == 0:
+            self.load()
+            return 0
+
+        from lineapi.models.user import User as MainUser
+
+        main_db = self.main_session_factory()
+        try:
+            rows = (
+                main_db.query(MainUser.id, MainUser.invitation_id)
+                .filter(MainUser.id > self._last_id, MainUser.invitation_id.isnot(None))
+                .order_by(MainUser.id)
+                .all()
+            )
+        finally:
+            main_db.close()
+
+        added = {invitation_id for _, invitation_id in rows}
+        with self._lock:
+            self._members |= added
+            for invitation_id in added:
+                self._missing.pop(invitation_id, None)
+            if rows:
+                self._last_id = max(self._last_id, rows[-1][0])
+            self._stats["last_sync"] = datetime.now().isoformat()
+        if added:
+            self._replicate(added)
+        return len(added)
+
+    def add(self, invitation_id):
+        if invitation_id:
+            with self._lock:
+                self._members.add(invitation_id)
+                self._missing.pop(invitation_id, None)
+
+    async def contains(self, invitation_id):
+        if not self._loaded:
+            # 読み込み前は従来どおり画像サービスのusersテーブルを見る
+            self._stats["fallbacks"] += 1
+            return await asyncio.to_thread(self._lookup_local, invitation_id)
+
+        if invitation_id in self._members:
+            self._stats["hits"] += 1
+            return True
+        self._stats["misses"] += 1
+        if self._is_known_missing(invitation_id):
+            self._stats["negative_hits"] += 1
+            return False
+        found = await asyncio.to_thread(self._lookup_main, invitation_id)
+        if not found:
+            self._remember_missing(invitation_id)
+        return found
+
+    def _is_known_missing(self, invitation_id):
+        with self._lock:
+            expires = self._missing.get(invitation_id)
+            if expires is None:
+                return False
+            if expires > time.monotonic():
+                return True
+            del self._missing[invitation_id]
+            return False
+
+    def _remember_missing(self, invitation_id):
+        with self._lock:
+            if invitation_id in self._members:
+                # 問い合わせ中に作成・同期されたユーザー
+                return
+            if len(self._missing) >= MAX_NEGATIVE_ENTRIES:
+                # 古いものから捨てる（辞書は挿入順）
+                self._missing.pop(next(iter(self._missing)))
+            self._missing[invitation_id] = time.monotonic() + MEMBERSHIP_NEGATIVE_TTL
+
+    def _lookup_local(self, invitation_id):
+        local_db = self.local_session_factory()
+        try:
+            return local_db.query(User.id).filter(User.invitation_id == invitation_id).first() is not None
+        finally:
+            local_db.close()
+
+    def _lookup_main(self, invitation_id):
+        # 別プロセスで作成された直後のユーザーは次のsyncまで載っていないため、1件だけ確認する
+        from lineapi.models.user import User as MainUser
+
+        try:
+            main_db = self.main_session_factory()
+            try:
+                found = main_db.query(MainUser.id).filter(MainUser.invitation_id == invitation_id).first() is not None
+            finally:
+                main_db.close()
+        except Exception as e:
+            print(f"Membership lookup failed: {str(e)}")
+            return False
+        if found:
+            self.add(invitation_id)
+            self._replicate({invitation_id})
+        return found
+
+    def _replicate(self, invitation_ids, prune=False):
+        """
+        invitation_idsを画像サービスのusersテーブルに追加する
+        prune=Trueの場合（全件読み込み時）はinvitation_idsにないユーザーを削除する
+        """
+        local_db = self.local_session_factory()
+        try:
+            if prune and invitation_ids:
+                # メインDBが空を返した場合は接続先の誤りの可能性があるので削除しない
+                stale = sorted(
+                    row[0] for row in local_db.query(User.invitation_id)
+                    if row[0] and row[0] not in invitation_ids
+                )
+                for start in range(0, len(stale), REPLICATE_CHUNK_SIZE):
+                    chunk = stale[start:start + REPLICATE_CHUNK_SIZE]
+                    local_db.query(User).filter(User.invitation_id.in_(chunk)).delete(synchronize_session=False)
+                if stale:
+                    print(f"Removed {len(stale)} deleted users from local users")
+
+            invitation_ids = sorted(invitation_ids)
+            for start in range(0, len(invitation_ids), REPLICATE_CHUNK_SIZE):
+                chunk = invitation_ids[start:start + REPLICATE_CHUNK_SIZE]
+                existing = {
+                    row[0] for row in local_db.query(User.invitation_id).filter(User.invitation_id.in_(chunk))
+                }
+                local_db.add_all(User(invitation_id=i) for i in chunk if i not in existing)
+            local_db.commit()
+        except Exception as e:
+            local_db.rollback()
+            print(f"Error replicating users: {str(e)}")
+        finally:
+            local_db.close()
+
+    def watch_user_inserts(self):
+        """
+        同じプロセス内で作成されたユーザーを即時に反映する
+        ロールバックされたユーザーを載せないよう、INSERT時には控えておき、コミット後に反映する
+        """
+        from sqlalchemy import event
+        from sqlalchemy.orm import Session, object_session
+        from lineapi.models.user import User as MainUser
+
+        pending_key = f"membership_pending_{id(self)}"
+
+        def after_insert(mapper, connection, target):
+            session = object_session(target)
+            if session is None:
+                return
+            session.info.setdefault(pending_key, set()).add(target.invitation_id)
+
+        def after_commit(session):
+            for invitation_id in session.info.pop(pending_key, ()):
+                self.add(invitation_id)
+
+        def after_rollback(session):
+            session.info.pop(pending_key, None)
+
+        self._listeners = [
+            (MainUser, "after_insert", after_insert),
+            (Session, "after_commit", after_commit),
+            (Session, "after_rollback", after_rollback),
+        ]
+        for target, name, listener in self._listeners:
+            event.listen(target, name, listener)
+
+    def unwatch_user_inserts(self):
+        from sqlalchemy import event
+
+        for target, name, listener in self._listeners:
+            event.remove(target, name, listener)
+        self._listeners = []
+
+    def stats(self):
+        with self._lock:
+            return {"members": len(self._members), "last_id": self._last_id, **self._stats}
+
+
+async def run_membership_sync(cache, interval):
+    try:
+        await asyncio.to_thread(cache.load)
+    except Exception as e:
+        print(f"Error loading membership cache: {str(e)}")
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            added = await asyncio.to_thread(cache.sync)
+            if added:
+                print(f"Membership cache synced {added} new users")
+        except Exception as e:
+            print(f"Error in membership sync: {str(e)}")
@@ -1,10 +1,82 @@
 # modeles.py
 
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Integer, String, DateTime, Index, Text
+from sqlalchemy.sql import func
 from img.database import Base
 
 class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True, index=True)
-    invitation_id = Column(String, unique=True, index=True)
\ No newline at end of file
+    invitation_id = Column(String, unique=True, index=True)
+
+# コンテンツアドレス方式で保存した画像の実体（SHA-256単位で1つだけ保存）
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    sha256 = Column(String(64), primary_key=True)
+    extension = Column(String(10), nullable=False)
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=func.now())
+
+# ユーザーごとの論理パス（STORAGE_PATHからの相対パス）と実体の対応
+class BlobRef(Base):
+    __tablename__ = "blob_refs"
+
+    path = Column(String, primary_key=True)
+    sha256 = Column(String(64), index=True, nullable=False)
+    created_at = Column(DateTime, default=func.now())
+
+# ユーザーごとの画像ファイル一覧（list_filesで os.walk せずに済むように保持する）
+class ImageFile(Base):
+    __tablename__ = "image_files"
+
+    id = Column(Integer, primary_key=True, index=True)
+    invitation_id = Column(String, nullable=False)
+    path = Column(String, unique=True, nullable=False)  # STORAGE_PATHからの相対パス
+    category = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    sha256 = Column(String(64), nullable=True)
+    placeholder = Column(Text, nullable=True)  # 低画質プレースホルダー（data URI）
+    frames = Column(Integer, nullable=True)  # アニメーション画像のフレーム数
+    created_at = Column(DateTime, default=func.now())
+
+    __table_args__ = (
+        Index("ix_image_files_user_category_id", "invitation_id", "category", "id"),
+    )
+
+# 仮アップロード（temp）のセッション。finalize_upload はトークンで対象を特定する
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+
+    token = Column(String(64), primary_key=True)
+    invitation_id = Column(String, nullable=False, index=True)
+    category = Column(String, nullable=False)
+    path = Column(String, nullable=False)  # STORAGE_PATHからの相対パス
+    expires_at = Column(DateTime, nullable=False, index=True)
+    created_at = Column(DateTime, default=func.now())
+
+# 再開可能な分割アップロードのセッション（受信済みチャンクは resumable_chunks に1行ずつ記録する）
+class ResumableUpload(Base):
+    __tablename__ = "resumable_uploads"
+
+    token = Column(String(64), primary_key=True)
+    invitation_id = Column(String, nullable=False, index=True)
+    category = Column(String, nullable=False)
+    filename = Column(String, nullable=False)
+    total_size = Column(Integer, nullable=False)
+    chunk_size = Column(Integer, nullable=False)
+    options = Column(Text, nullable=True)  # width / height / crop / sub_directory / file_name / format（JSON）
+    expires_at = Column(DateTime, nullable=False, index=True)
+    created_at = Column(DateTime, default=func.now())
+
+class ResumableChunk(Base):
+    __tablename__ = "resumable_chunks"
+
+    token = Column(String(64), primary_key=True)
+    chunk_index = Column(Integer, primary_key=True)
+    sha256 = Column(String(64), nullable=False)
+    created_at = Column(DateTime, default=func.now())
@@ -0,0 +1,116 @@
+# img/responses.py
+# ETag・条件付きGET・Range に対応した画像レスポンス
+
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+
+STREAM_CHUNK_SIZE = 64 * 1024
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# コンテンツアドレスURL用（内容が変わればURLも変わる）
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+def file_etag(stat_result):
+    # 更新時刻とサイズから作るETag
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+def _opaque_tag(tag):
+    # 弱い比較（If-None-Match）では W/ の有無を区別しない
+    return tag[2:] if tag.startswith("W/") else tag
+
+def is_not_modified(request: Request, etag, last_modified=None):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match がある場合は If-Modified-Since より優先する
+        candidates = {_opaque_tag(tag.strip()) for tag in if_none_match.split(",")}
+        return "*" in candidates or _opaque_tag(etag) in candidates
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def parse_range(range_header, size):
+    """
+    "bytes=start-end" 形式の単一レンジを (start, end) で返す
+    形式が正しくないもの・複数レンジは無視して（None）全体を返す。形式は正しいが範囲外のものだけ416にする
+    """
+    match = RANGE_PATTERN.match(range_header or "")
+    if not match:
+        return None
+    start_str, end_str = match.groups()
+    if not start_str and not end_str:
+        return None
+    if start_str:
+        start = int(start_str)
+        end = int(end_str) if end_str else size - 1
+        if end_str and end < start:
+            # 終了位置が開始位置より前のものは不正な指定として無視する
+            return None
+    else:
+        # "bytes=-500" は末尾500バイト
+        suffix = int(end_str)
+        if suffix == 0:
+            raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+        start = max(0, size - suffix)
+        end = size - 1
+    if start >= size:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, min(end, size - 1)
+
+def _iter_file(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def conditional_file_response(request: Request, path, media_type, cache_control, etag=None):
+    stat_result = os.stat(path)
+    etag = etag or file_etag(stat_result)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+
+    if is_not_modified(request, etag, stat_result.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    size = stat_result.st_size
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    # If-Range のETagが一致しない場合は全体を返す
+    if if_range is None or if_range == etag:
+        byte_range = parse_range(request.headers.get("range"), size)
+
+    if byte_range:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            _iter_file(path, start, end - start + 1),
+            status_code=206,
+            media_type=media_type,
+            headers=headers
+        )
+
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(_iter_file(path, 0, size), media_type=media_type, headers=headers)
+
+def conditional_bytes_response(request: Request, data, media_type, cache_control, etag):
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if is_not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type=media_type, headers=headers)
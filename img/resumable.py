@@ -0,0 +1,99 @@
+# img/resumable.py
+# 再開可能な分割アップロード
+#
+# 1. POST /resumable/{invitation_id}/{category} でセッションを作成（ファイル名・全体サイズ・画像の指定）
+# 2. PUT /resumable/{token}/chunks/{index} で各チャンクを送信（順不同・並列可、X-Chunk-SHA256で検証）
+# 3. GET /resumable/{token} で受信済みチャンクを確認し、足りない分だけ再送する
+# 4. POST /resumable/{token}/complete で結合したファイルを通常のアップロード処理に渡す
+#
+# 受信途中のファイルは全体サイズで確保しておき、チャンクは位置を指定して直接書き込む
+
+import os
+import hashlib
+from datetime import datetime
+from img.config import RESUMABLE_PATH
+from img.models import ResumableUpload, ResumableChunk
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+
+def partial_path(token):
+    return os.path.join(RESUMABLE_PATH, f"{token}.part")
+
+def chunk_count(upload):
+    return max(1, -(-upload.total_size // upload.chunk_size))
+
+def expected_chunk_size(upload, index):
+    if index < chunk_count(upload) - 1:
+        return upload.chunk_size
+    return upload.total_size - upload.chunk_size * (chunk_count(upload) - 1)
+
+def create_partial_file(token, total_size):
+    os.makedirs(RESUMABLE_PATH, exist_ok=True)
+    with open(partial_path(token), "wb") as f:
+        f.truncate(total_size)
+
+def write_chunk(token, offset, data):
+    # 位置指定の書き込みなので、別々のチャンクを並列に書いても干渉しない
+    fd = os.open(partial_path(token), os.O_WRONLY)
+    try:
+        written = 0
+        while written < len(data):
+            written += os.pwrite(fd, data[written:], offset + written)
+    finally:
+        os.close(fd)
+
+def received_chunks(db, token):
+    return {row[0] for row in db.query(ResumableChunk.chunk_index).filter(ResumableChunk.token == token)}
+
+def upload_status(db, upload):
+    received = received_chunks(db, upload.token)
+    return {
+        "upload_id": upload.token,
+        "total_size": upload.total_size,
+        "chunk_size": upload.chunk_size,
+        "chunk_count": chunk_count(upload),
+        "received": sorted(received),
+        "missing": [i for i in range(chunk_count(upload)) if i not in received],
+        "expires_at": upload.expires_at,
+    }
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def discard_upload(db, token):
+    db.query(ResumableChunk).filter(ResumableChunk.token == token).delete()
+    db.query(ResumableUpload).filter(ResumableUpload.token == token).delete()
+    path = partial_path(token)
+    if not os.path.exists(path):
+        return 0
+    size = os.path.getsize(path)
+    os.remove(path)
+    return size
+
+def sweep_expired_resumable(session_factory, batch_size):
+    """
+    期限切れの分割アップロードを1バッチ分削除する。(削除件数, 回収バイト数) を返す
+    """
+    db = session_factory()
+    try:
+        expired = (
+            db.query(ResumableUpload.token)
+            .filter(ResumableUpload.expires_at < datetime.now())
+            .order_by(ResumableUpload.expires_at)
+            .limit(batch_size)
+            .all()
+        )
+        reclaimed = sum(discard_upload(db, token) for token, in expired)
+        db.commit()
+        return len(expired), reclaimed
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
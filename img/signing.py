@@ -0,0 +1,61 @@
+# img/signing.py
+# 非公開カテゴリ（本人確認書類など）の画像URLの署名と検証
+#
+# 署名付きURL: i/{論理パス}?expires={UNIX時刻}&sig={HMAC-SHA256}
+# 検証は鍵とURLだけで完結するので、画像配信のたびにDBを参照しない
+# URLの有効期限は短いので、lineapiの /api/user/private-image-url で表示のたびに発行する（同じ IMG_SIGNING_KEY を使うこと）
+
+import os
+import hmac
+import time
+import base64
+import hashlib
+from urllib.parse import quote
+
+PRIVATE_CATEGORIES = {"id_verification"}
+DEFAULT_SIGNED_URL_TTL = int(os.getenv("IMG_SIGNED_URL_TTL", 10 * 60))
+
+# 鍵がなければ非公開カテゴリの保存・配信をしない
+# （プロセスごとの鍵では複数ワーカー・再起動をまたいで署名が通らず、非公開画像が読めなくなるため）
+SIGNING_KEY = os.getenv("IMG_SIGNING_KEY", "").encode("utf-8") or None
+if SIGNING_KEY is None:
+    print("IMG_SIGNING_KEY is not set, private image categories are disabled")
+
+class SigningKeyMissing(RuntimeError):
+    """IMG_SIGNING_KEY が設定されていない"""
+
+def is_enabled():
+    return SIGNING_KEY is not None
+
+def is_private(logical_path):
+    parts = os.path.normpath(logical_path).split(os.sep)
+    return len(parts) > 1 and parts[1] in PRIVATE_CATEGORIES
+
+def path_owner(logical_path):
+    # 論理パスの先頭（invitation_id）
+    return os.path.normpath(logical_path).split(os.sep)[0]
+
+def _signature(logical_path, expires):
+    if SIGNING_KEY is None:
+        raise SigningKeyMissing("IMG_SIGNING_KEY is not set")
+    message = f"{os.path.normpath(logical_path)}\n{expires}".encode("utf-8")
+    digest = hmac.new(SIGNING_KEY, message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
+
+def sign_path(logical_path, ttl=DEFAULT_SIGNED_URL_TTL):
+    # (expires, sig) を返す
+    expires = int(time.time()) + ttl
+    return expires, _signature(logical_path, expires)
+
+def signed_url(logical_path, ttl=DEFAULT_SIGNED_URL_TTL):
+    # /img からの相対URL（content_path と同じ形式）
+    expires, sig = sign_path(logical_path, ttl)
+    return f"i/{quote(os.path.normpath(logical_path).replace(os.sep, '/'))}?expires={expires}&sig={sig}"
+
+def verify(logical_path, expires, sig):
+    if not expires or not sig or SIGNING_KEY is None:
+        return False
+    if expires < time.time():
+        return False
+    # 比較にかかる時間から署名を推測されないよう定数時間で比較する
+    return hmac.compare_digest(_signature(logical_path, expires), sig)
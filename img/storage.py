@@ -0,0 +1,183 @@
+# img/storage.py
+
+import os
+import shutil
+import threading
+from sqlalchemy.exc import IntegrityError
+from img.models import Blob, BlobRef
+
+
+class BlobStore:
+    """
+    SHA-256をキーにした重複排除ストレージ
+    実体は blob_dir 以下に1つだけ置き、ユーザーごとの論理パスにはハードリンクを張る
+    論理パスと実体の対応・参照数はSQLiteで管理する
+    """
+
+    def __init__(self, blob_dir, session_factory):
+        self.blob_dir = blob_dir
+        self.session_factory = session_factory
+        # 参照数の更新とファイル操作を直列化する
+        self._lock = threading.Lock()
+
+    def blob_path(self, sha256, extension):
+        return os.path.join(self.blob_dir, sha256[:2], sha256[2:4], f"{sha256}{extension}")
+
+    def store(self, source_path, logical_path, file_path, sha256, size):
+        """
+        source_path（一時ファイル）を取り込み、file_pathに配置する
+        同じ内容の実体が既にあれば一時ファイルは捨てて参照数だけ増やす
+        実体の拡張子を返す
+        """
+        with self._lock:
+            for attempt in range(2):
+                db = self.session_factory()
+                try:
+                    return self._store(db, source_path, logical_path, file_path, sha256, size)
+                except IntegrityError:
+                    # 複数プロセスで同じ内容を同時に登録した場合は、既にある実体として参照数を増やし直す
+                    db.rollback()
+                    if attempt:
+                        raise
+                except Exception:
+                    db.rollback()
+                    raise
+                finally:
+                    db.close()
+
+    def _store(self, db, source_path, logical_path, file_path, sha256, size):
+        extension = os.path.splitext(file_path)[1].lower()
+        blob = self._find_blob(db, sha256)
+        if blob:
+            # 登録の競合からのやり直しでは一時ファイルは実体として置き済み
+            if os.path.exists(source_path):
+                os.remove(source_path)
+        else:
+            blob = Blob(sha256=sha256, extension=extension, size=size, ref_count=0)
+            blob_file = self.blob_path(sha256, extension)
+            os.makedirs(os.path.dirname(blob_file), exist_ok=True)
+            os.replace(source_path, blob_file)
+            db.add(blob)
+
+        # 同じ論理パスの上書きなら古い実体の参照を外す
+        ref = db.query(BlobRef).filter(BlobRef.path == logical_path).first()
+        if ref and ref.sha256 != sha256:
+            self._decrement(db, ref.sha256)
+            ref.sha256 = sha256
+            blob.ref_count += 1
+        elif not ref:
+            db.add(BlobRef(path=logical_path, sha256=sha256))
+            blob.ref_count += 1
+
+        # 実体の登録（INSERT）の競合はここで IntegrityError になる
+        db.flush()
+        self._link(self.blob_path(sha256, blob.extension), file_path)
+        db.commit()
+        return blob.extension
+
+    @staticmethod
+    def _find_blob(db, sha256):
+        return db.query(Blob).filter(Blob.sha256 == sha256).first()
+
+    def store_unshared(self, source_path, logical_path, file_path):
+        """
+        重複排除せずにsource_pathをfile_pathへ置く
+        blob_dirに実体を置かないので /b/ からは配信されない（非公開カテゴリ用）
+        同じ論理パスに共有の実体が付いていれば参照を外す
+        """
+        with self._lock:
+            db = self.session_factory()
+            try:
+                ref = db.query(BlobRef).filter(BlobRef.path == logical_path).first()
+                if ref:
+                    self._decrement(db, ref.sha256)
+                    db.delete(ref)
+                os.replace(source_path, file_path)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+    def release(self, logical_path, file_path):
+        """
+        論理パスのファイルを削除し、参照がなくなった実体も削除する
+        """
+        with self._lock:
+            db = self.session_factory()
+            try:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                ref = db.query(BlobRef).filter(BlobRef.path == logical_path).first()
+                if ref:
+                    self._decrement(db, ref.sha256)
+                    db.delete(ref)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+    def move(self, src_logical, src_path, dst_logical, dst_path):
+        """
+        論理パスを付け替える（実体と参照数はそのまま）
+        """
+        with self._lock:
+            db = self.session_factory()
+            try:
+                dst_ref = db.query(BlobRef).filter(BlobRef.path == dst_logical).first()
+                if dst_ref:
+                    self._decrement(db, dst_ref.sha256)
+                    db.delete(dst_ref)
+                    db.flush()
+                os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+                shutil.move(src_path, dst_path)
+                src_ref = db.query(BlobRef).filter(BlobRef.path == src_logical).first()
+                if src_ref:
+                    src_ref.path = dst_logical
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+    def lookup(self, logical_path):
+        db = self.session_factory()
+        try:
+            ref = db.query(BlobRef).filter(BlobRef.path == logical_path).first()
+            return ref.sha256 if ref else None
+        finally:
+            db.close()
+
+    def ref_paths(self, sha256):
+        # 実体を参照している論理パスの一覧
+        db = self.session_factory()
+        try:
+            return [ref.path for ref in db.query(BlobRef.path).filter(BlobRef.sha256 == sha256)]
+        finally:
+            db.close()
+
+    def _decrement(self, db, sha256):
+        blob = db.query(Blob).filter(Blob.sha256 == sha256).first()
+        if not blob:
+            return
+        blob.ref_count -= 1
+        if blob.ref_count <= 0:
+            blob_file = self.blob_path(blob.sha256, blob.extension)
+            if os.path.exists(blob_file):
+                os.remove(blob_file)
+            db.delete(blob)
+
+    @staticmethod
+    def _link(blob_file, file_path):
+        # 一時名でリンクを作ってから置き換えることで、読み込み中のリクエストに影響させない
+        temp_link = f"{file_path}.{threading.get_ident()}.link"
+        try:
+            os.link(blob_file, temp_link)
+        except OSError:
+            # ハードリンクできないファイルシステムではコピーする
+            shutil.copyfile(blob_file, temp_link)
+        os.replace(temp_link, file_path)
@@ -0,0 +1,173 @@
+# img/sweeper.py
+# 期限切れの仮アップロード・分割アップロードを定期的に削除する
+# DBに載っていない古い一時ファイル（マニフェスト導入前の仮アップロード、保存途中で残った .tmp）は
+# ディレクトリを走査して削除する
+
+import os
+import time
+import asyncio
+from datetime import datetime
+from img import layout
+from img.config import STORAGE_PATH
+from img.resumable import sweep_expired_resumable
+from img.models import UploadSession, ImageFile
+
+TEMP_DIRECTORY = "temp"
+TEMP_FILE_SUFFIX = ".tmp"
+REFERENCE_CHUNK_SIZE = 500
+
+def _remove_temp_file(db, blob_store, logical_path, file_path=None):
+    file_path = file_path or layout.physical_path(logical_path)
+    size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+    blob_store.release(logical_path, file_path)
+    db.query(ImageFile).filter(ImageFile.path == logical_path).delete()
+
+    # セッションごとのディレクトリが空になったら削除する
+    directory = os.path.dirname(file_path)
+    if os.path.basename(os.path.dirname(directory)) == TEMP_DIRECTORY:
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass
+    return size
+
+def sweep_expired_uploads(session_factory, blob_store, batch_size, legacy_ttl):
+    """
+    期限切れのアップロードセッションと、セッションを持たない古いtempファイルを1バッチ分削除する
+    (削除件数, 回収バイト数) を返す
+    """
+    now = datetime.now()
+    db = session_factory()
+    try:
+        removed = reclaimed = 0
+
+        sessions = (
+            db.query(UploadSession)
+            .filter(UploadSession.expires_at < now)
+            .order_by(UploadSession.expires_at)
+            .limit(batch_size)
+            .all()
+        )
+        for upload_session in sessions:
+            reclaimed += _remove_temp_file(db, blob_store, upload_session.path)
+            db.delete(upload_session)
+            removed += 1
+
+        # 旧形式（固定ファイル名）のtempファイル
+        remaining = batch_size - removed
+        if remaining > 0:
+            stale_files = (
+                db.query(ImageFile)
+                .filter(ImageFile.path.like("%/temp/%"), ImageFile.created_at < now - legacy_ttl)
+                .order_by(ImageFile.id)
+                .limit(remaining)
+                .all()
+            )
+            active_paths = {
+                row[0] for row in db.query(UploadSession.path)
+                .filter(UploadSession.path.in_([f.path for f in stale_files]))
+            }
+            for stale_file in stale_files:
+                if stale_file.path in active_paths:
+                    continue
+                reclaimed += _remove_temp_file(db, blob_store, stale_file.path)
+                removed += 1
+
+        db.commit()
+        return removed, reclaimed
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def _is_temp_file(logical_path):
+    # 保存途中の一時ファイル（*.tmp）か、仮アップロード用の temp ディレクトリ内のファイル
+    parts = logical_path.split(os.sep)
+    return parts[-1].endswith(TEMP_FILE_SUFFIX) or TEMP_DIRECTORY in parts[1:-1]
+
+def sweep_orphaned_temp_files(session_factory, blob_store, ttl, storage_path=STORAGE_PATH):
+    """
+    アップロードセッションにも image_files にも載っていない、ttlより古い一時ファイルを削除する
+    (削除件数, 回収バイト数) を返す
+    """
+    cutoff = time.time() - ttl.total_seconds()
+    candidates = {}
+    for invitation_id, user_path in layout.iter_user_dirs(storage_path):
+        for root, _, files in os.walk(user_path):
+            for name in files:
+                file_path = os.path.join(root, name)
+                logical = os.path.join(invitation_id, os.path.relpath(file_path, user_path))
+                if not _is_temp_file(logical):
+                    continue
+                try:
+                    if os.lstat(file_path).st_mtime < cutoff:
+                        candidates[logical] = file_path
+                except OSError:
+                    continue
+    if not candidates:
+        return 0, 0
+
+    db = session_factory()
+    try:
+        referenced = set()
+        paths = sorted(candidates)
+        for start in range(0, len(paths), REFERENCE_CHUNK_SIZE):
+            chunk = paths[start:start + REFERENCE_CHUNK_SIZE]
+            referenced.update(row[0] for row in db.query(UploadSession.path).filter(UploadSession.path.in_(chunk)))
+            referenced.update(row[0] for row in db.query(ImageFile.path).filter(ImageFile.path.in_(chunk)))
+
+        removed = reclaimed = 0
+        for logical in paths:
+            if logical in referenced:
+                # DBに載っているものは sweep_expired_uploads が期限で削除する
+                continue
+            reclaimed += _remove_temp_file(db, blob_store, logical, candidates[logical])
+            removed += 1
+        db.commit()
+        return removed, reclaimed
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+async def run_sweeper(session_factory, blob_store, interval, batch_size, legacy_ttl, stats):
+    """
+    interval秒ごとに期限切れファイルをバッチ単位で削除し続ける
+    """
+    while True:
+        try:
+            total_removed = total_reclaimed = 0
+            while True:
+                removed, reclaimed = await asyncio.to_thread(
+                    sweep_expired_uploads, session_factory, blob_store, batch_size, legacy_ttl
+                )
+                total_removed += removed
+                total_reclaimed += reclaimed
+                if removed < batch_size:
+                    break
+            # 完了しなかった分割アップロード
+            while True:
+                removed, reclaimed = await asyncio.to_thread(sweep_expired_resumable, session_factory, batch_size)
+                total_removed += removed
+                total_reclaimed += reclaimed
+                if removed < batch_size:
+                    break
+            # DBに載っていない一時ファイル
+            removed, reclaimed = await asyncio.to_thread(
+                sweep_orphaned_temp_files, session_factory, blob_store, legacy_ttl
+            )
+            total_removed += removed
+            total_reclaimed += reclaimed
+            stats.update({
+                "last_run": datetime.now().isoformat(),
+                "last_removed": total_removed,
+                "last_reclaimed_bytes": total_reclaimed,
+                "total_reclaimed_bytes": stats.get("total_reclaimed_bytes", 0) + total_reclaimed,
+            })
+            if total_removed:
+                print(f"Temp sweeper removed {total_removed} files, reclaimed {total_reclaimed} bytes")
+        except Exception as e:
+            print(f"Error in temp sweeper: {str(e)}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,132 @@
+# img/worker.py
+
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class WorkerPoolFull(Exception):
+    """処理待ちのジョブが上限に達している"""
+
+    def __init__(self, retry_after):
+        super().__init__("Image worker pool is full")
+        self.retry_after = retry_after
+
+
+def _timed_call(func, args):
+    # ワーカープロセス側で実行時間を計測して返す
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+class ImageWorkerPool:
+    """
+    画像のデコード・リサイズ・エンコードをイベントループの外で実行するプロセスプール
+    実行中＋待機中のジョブ数が上限を超えたら WorkerPoolFull を送出する
+    """
+
+    def __init__(self, max_workers, max_queue, retry_after=2):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._executor = None
+        self._pending = 0
+        self._broken = 0
+        self._stats = {}
+
+    def _get_executor(self):
+        if self._executor is None:
+            # イベントループのスレッドを複製しないよう spawn で起動する
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    @property
+    def in_flight(self):
+        return self._pending
+
+    @property
+    def queue_depth(self):
+        return max(0, self._pending - self.max_workers)
+
+    async def run(self, func, *args):
+        if self._pending >= self.max_workers + self.max_queue:
+            self._record(func.__name__, None, None, rejected=True)
+            raise WorkerPoolFull(self.retry_after)
+
+        self._pending += 1
+        start = time.perf_counter()
+        executor = self._get_executor()
+        try:
+            loop = asyncio.get_running_loop()
+            result, run_seconds = await loop.run_in_executor(
+                executor, _timed_call, func, args
+            )
+        except BrokenProcessPool:
+            # ワーカーが異常終了した（OOM killer等）プールは以後すべて失敗するため、次のジョブで作り直す
+            self._record(func.__name__, time.perf_counter() - start, None, failed=True)
+            self._discard_executor(executor)
+            raise
+        except Exception:
+            self._record(func.__name__, time.perf_counter() - start, None, failed=True)
+            raise
+        finally:
+            self._pending -= 1
+
+        self._record(func.__name__, time.perf_counter() - start, run_seconds)
+        return result
+
+    def _record(self, job, total_seconds, run_seconds, rejected=False, failed=False):
+        stats = self._stats.setdefault(job, {
+            "count": 0, "failed": 0, "rejected": 0,
+            "total_seconds": 0.0, "run_seconds": 0.0, "wait_seconds": 0.0, "max_seconds": 0.0,
+        })
+        if rejected:
+            stats["rejected"] += 1
+            return
+        if failed:
+            stats["failed"] += 1
+            return
+        stats["count"] += 1
+        stats["total_seconds"] += total_seconds
+        stats["run_seconds"] += run_seconds
+        stats["wait_seconds"] += max(0.0, total_seconds - run_seconds)
+        stats["max_seconds"] = max(stats["max_seconds"], total_seconds)
+
+    def stats(self):
+        jobs = {}
+        for job, s in self._stats.items():
+            avg = s["total_seconds"] / s["count"] if s["count"] else 0.0
+            jobs[job] = {**s, "avg_seconds": avg}
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "restarts": self._broken,
+            "jobs": jobs,
+        }
+
+    def _discard_executor(self, executor):
+        # 同じプールで失敗した他のジョブが、作り直した後のプールを捨てないようにする
+        if self._executor is executor:
+            self._executor = None
+            self._broken += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+image_worker_pool = ImageWorkerPool(
+    max_workers=int(os.getenv("IMG_WORKERS", os.cpu_count() or 2)),
+    max_queue=int(os.getenv("IMG_WORKER_QUEUE", 32)),
+)
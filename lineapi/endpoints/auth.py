@@ -6,6 +6,7 @@ from dotenv import load_dotenv
 import os
 import logging
 import requests
+from metrics import external_call
 
 # 環境変数を読　み込む
 load_dotenv()
@@ -56,7 +57,8 @@ async def callback(request: Request, response: Response):
         "client_secret": line_channel_secret,
     }
 
-    token_response = requests.post(token_url, headers=headers, data=data)
+    with external_call("line", "oauth_token"):
+        token_response = requests.post(token_url, headers=headers, data=data)
     if token_response.status_code != 200:
         logger.error(f"Failed to get access token: {token_response.text}")
         raise HTTPException(status_code=token_response.status_code, detail=f"Failed to get access token: {token_response.text}")
@@ -70,7 +72,8 @@ async def callback(request: Request, response: Response):
     # ユーザープロフィール取得
     profile_url = "https://api.line.me/v2/profile"
     headers = {"Authorization": f"Bearer {access_token}"}
-    profile_response = requests.get(profile_url, headers=headers)
+    with external_call("line", "get_login_profile"):
+        profile_response = requests.get(profile_url, headers=headers)
     if profile_response.status_code != 200:
         logger.error(f"Failed to get profile: {profile_response.text}")
         raise HTTPException(status_code=profile_response.status_code, detail=f"Failed to get profile: {profile_response.text}")
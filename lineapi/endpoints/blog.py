@@ -1,12 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException
 from enum import Enum
-from lineapi.repositories.blog_repository import BlogRepository
-from sqlalchemy.orm import Session
+from lineapi.repositories.blog_repository import AsyncBlogRepository
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
 from pydantic import BaseModel, Field
 from typing import Optional, List
 import logging
-from lineapi.database import get_db
+from lineapi.database import get_async_db
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -30,11 +30,11 @@ class PostUpdate(BaseModel):
 async def create_post(
     cast_id: str,
     post_data: PostCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
-        blog_repo = BlogRepository(db)
-        post = blog_repo.create_post(
+        blog_repo = AsyncBlogRepository(db)
+        post = await blog_repo.create_post(
             cast_id=cast_id,
             body=post_data.body,
             photo_url=post_data.photo_url,
@@ -60,9 +60,9 @@ async def create_post(
         raise HTTPException(status_code=500, detail={"message": "Internal server error", "error": str(e)})
 
 @router.get("/posts/{post_id}")
-async def get_post(post_id: int, db: Session = Depends(get_db)):
-    blog_repo = BlogRepository(db)
-    post = blog_repo.get_post(post_id)
+async def get_post(post_id: int, db: AsyncSession = Depends(get_async_db)):
+    blog_repo = AsyncBlogRepository(db)
+    post = await blog_repo.get_post(post_id)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
     return {
@@ -84,10 +84,10 @@ async def get_cast_posts(
     cast_id: str,
     skip: int = 0,
     limit: int = 20,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    blog_repo = BlogRepository(db)
-    posts = blog_repo.get_posts_by_cast(cast_id, skip, limit)
+    blog_repo = AsyncBlogRepository(db)
+    posts = await blog_repo.get_posts_by_cast(cast_id, skip, limit)
     return {
         "message": "Posts retrieved successfully",
         "posts": [
@@ -107,11 +107,11 @@ async def get_cast_posts(
 async def update_post(
     post_id: int,
     post_data: PostUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     try:
-        blog_repo = BlogRepository(db)
-        updated_post = blog_repo.update_post(post_id, post_data.dict(exclude_unset=True))
+        blog_repo = AsyncBlogRepository(db)
+        updated_post = await blog_repo.update_post(post_id, post_data.dict(exclude_unset=True))
         if not updated_post:
             raise HTTPException(status_code=404, detail="Post not found")
         return {
@@ -130,10 +130,10 @@ async def update_post(
         raise HTTPException(status_code=500, detail={"message": "Database error", "error": str(se)})
 
 @router.delete("/posts/{post_id}")
-async def delete_post(post_id: int, db: Session = Depends(get_db)):
+async def delete_post(post_id: int, db: AsyncSession = Depends(get_async_db)):
     try:
-        blog_repo = BlogRepository(db)
-        if blog_repo.delete_post(post_id):
+        blog_repo = AsyncBlogRepository(db)
+        if await blog_repo.delete_post(post_id):
             return {"message": "Post deleted successfully"}
         raise HTTPException(status_code=404, detail="Post not found")
     except SQLAlchemyError as se:
@@ -141,12 +141,12 @@ async def delete_post(post_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail={"message": "Database error", "error": str(se)})
 
 @router.post("/posts/{post_id}/like")
-async def increment_likes(post_id: int, db: Session = Depends(get_db)):
+async def increment_likes(post_id: int, db: AsyncSession = Depends(get_async_db)):
     """
     指定された投稿のいいね数をインクリメントするエンドポイント
     """
-    blog_repo = BlogRepository(db)
-    post = blog_repo.increment_likes(post_id)
+    blog_repo = AsyncBlogRepository(db)
+    post = await blog_repo.increment_likes(post_id)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
     return {
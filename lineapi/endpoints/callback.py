@@ -13,6 +13,7 @@ from datetime import datetime
 from linebot import LineBotApi
 from linebot.exceptions import LineBotApiError
 from lineapi.repositories.user_repository import UserRepository
+from metrics import external_call
 
 # 環境変数の読み込み
 load_dotenv()
@@ -151,7 +152,8 @@ def get_line_token(code):
         "client_id": line_channel_id,
         "client_secret": line_channel_secret,
     }
-    response = requests.post(token_url, headers=headers, data=data)
+    with external_call("line", "oauth_token"):
+        response = requests.post(token_url, headers=headers, data=data)
     if response.status_code != 200:
         logger.error(f"Failed to get access token. Status: {response.status_code}, Response: {response.text}")
         raise HTTPException(status_code=response.status_code, detail="Failed to get access token")
@@ -160,7 +162,8 @@ def get_line_token(code):
 def get_line_profile(access_token):
     profile_url = "https://api.line.me/v2/profile"
     headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(profile_url, headers=headers)
+    with external_call("line", "get_login_profile"):
+        response = requests.get(profile_url, headers=headers)
     if response.status_code != 200:
         logger.error(f"Failed to get profile. Status: {response.status_code}, Response: {response.text}")
         raise HTTPException(status_code=response.status_code, detail="Failed to get profile")
@@ -168,7 +171,8 @@ def get_line_profile(access_token):
 
 def check_friendship(user_id):
     try:
-        line_bot_api.get_profile(user_id)
+        with external_call("line", "get_bot_profile"):
+            line_bot_api.get_profile(user_id)
         return True
     except LineBotApiError:
         return False
\ No newline at end of file
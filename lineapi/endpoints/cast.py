@@ -3,8 +3,9 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError  # 追加
-from lineapi.database import get_db
-from lineapi.repositories.cast_repository import CastRepository
+from sqlalchemy.ext.asyncio import AsyncSession
+from lineapi.database import get_db, get_async_db
+from lineapi.repositories.cast_repository import AsyncCastRepository
 from pydantic import BaseModel, Field, validator
 from typing import Optional, List
 import string
@@ -82,9 +83,9 @@ async def get_constants():
 
 
 @router.get("/{cast_id}/profile")
-async def get_cast_profile(cast_id: str, db: Session = Depends(get_db)):
-    cast_repo = CastRepository(db)
-    cast = cast_repo.get_cast_by_cast_id(cast_id)
+async def get_cast_profile(cast_id: str, db: AsyncSession = Depends(get_async_db)):
+    cast_repo = AsyncCastRepository(db)
+    cast = await cast_repo.get_cast_by_cast_id(cast_id)
     if not cast:
         raise HTTPException(status_code=404, detail="Cast not found")
     return {
@@ -113,13 +114,13 @@ async def get_cast_profile(cast_id: str, db: Session = Depends(get_db)):
     }
 
 @router.post("/{cast_id}/update")
-async def update_cast_profile(cast_id: str, profile_update: CastProfileUpdate, db: Session = Depends(get_db)):
+async def update_cast_profile(cast_id: str, profile_update: CastProfileUpdate, db: AsyncSession = Depends(get_async_db)):
     logger.info(f"Updating profile for cast_id: {cast_id}")
     logger.debug(f"Profile update data: {profile_update.dict()}")
 
     try:
-        cast_repo = CastRepository(db)
-        updated_cast = cast_repo.update_cast_profile(cast_id, profile_update.dict(exclude_unset=True))
+        cast_repo = AsyncCastRepository(db)
+        updated_cast = await cast_repo.update_cast_profile(cast_id, profile_update.dict(exclude_unset=True))
         if not updated_cast:
             logger.warning(f"Cast not found for cast_id: {cast_id}")
             raise HTTPException(status_code=404, detail="Cast not found")
@@ -142,12 +143,12 @@ async def update_cast_profile(cast_id: str, profile_update: CastProfileUpdate, d
     
 
 @router.post("/{cast_id}/create")
-async def create_cast_profile(cast_id: str, db: Session = Depends(get_db)):
+async def create_cast_profile(cast_id: str, db: AsyncSession = Depends(get_async_db)):
     logger.info(f"Creating profile for cast_id: {cast_id}")
     
     try:
-        cast_repo = CastRepository(db)
-        existing_profile = cast_repo.get_cast_by_cast_id(cast_id)
+        cast_repo = AsyncCastRepository(db)
+        existing_profile = await cast_repo.get_cast_by_cast_id(cast_id)
         
         if existing_profile:
             logger.warning(f"Profile already exists for cast_id: {cast_id}")
@@ -160,7 +161,7 @@ async def create_cast_profile(cast_id: str, db: Session = Depends(get_db)):
             # 他のフィールドはデフォルト値または NULL になります
         )
         
-        created_profile = cast_repo.create_cast_profile(new_profile)
+        created_profile = await cast_repo.create_cast_profile(new_profile)
         
         logger.info(f"Successfully created profile for cast_id: {cast_id}")
         return {
@@ -179,6 +180,7 @@ async def create_cast_profile(cast_id: str, db: Session = Depends(get_db)):
         logger.exception(f"Unexpected error creating profile for cast_id {cast_id}: {str(e)}")
         raise HTTPException(status_code=500, detail={"message": "Internal server error", "error": str(e)})
 
+# option.detail をリレーションの遅延読み込みで参照するため同期セッションのまま
 @router.get("/{cast_id}/options")
 async def get_cast_options(cast_id: str, db: Session = Depends(get_db)):
     """
@@ -2,8 +2,9 @@
 
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from lineapi.database import get_db
-from lineapi.repositories.cast_schedule_repository import CastScheduleRepository
+from sqlalchemy.ext.asyncio import AsyncSession
+from lineapi.database import get_db, get_async_db
+from lineapi.repositories.cast_schedule_repository import CastScheduleRepository, AsyncCastScheduleRepository
 from lineapi.models.cast_schedule import CastSchedule
 from datetime import date, time, datetime, timedelta
 from pydantic import BaseModel
@@ -40,10 +41,10 @@ class CastSchedule(CastScheduleBase):
         from_attributes = True
 
 @router.post("/update-or-create", response_model=CastSchedule)
-async def update_or_create_cast_schedule(schedule: CastScheduleCreate, db: Session = Depends(get_db)):
-    repo = CastScheduleRepository(db)
+async def update_or_create_cast_schedule(schedule: CastScheduleCreate, db: AsyncSession = Depends(get_async_db)):
+    repo = AsyncCastScheduleRepository(db)
     try:
-        updated_schedule = repo.update_or_create_schedule(
+        updated_schedule = await repo.update_or_create_schedule(
             cast_id=schedule.cast_id,
             schedule_date=schedule.date,
             start_time=schedule.start_time,
@@ -57,17 +58,17 @@ async def update_or_create_cast_schedule(schedule: CastScheduleCreate, db: Sessi
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/get-by-cast-and-date/{cast_id}/{schedule_date}")
-async def get_cast_schedule(cast_id: str, schedule_date: date, db: Session = Depends(get_db)):
-    repo = CastScheduleRepository(db)
-    schedule = repo.get_schedule_by_cast_and_date(cast_id, schedule_date)
+async def get_cast_schedule(cast_id: str, schedule_date: date, db: AsyncSession = Depends(get_async_db)):
+    repo = AsyncCastScheduleRepository(db)
+    schedule = await repo.get_schedule_by_cast_and_date(cast_id, schedule_date)
     if not schedule:
         raise HTTPException(status_code=404, detail="Schedule not found")
     return schedule
 
 @router.get("/get-by-cast/{cast_id}")
-async def get_cast_schedules(cast_id: str, db: Session = Depends(get_db)):
-    repo = CastScheduleRepository(db)
-    schedules = repo.get_schedules_by_cast(cast_id)
+async def get_cast_schedules(cast_id: str, db: AsyncSession = Depends(get_async_db)):
+    repo = AsyncCastScheduleRepository(db)
+    schedules = await repo.get_schedules_by_cast(cast_id)
     return schedules
 
 @router.get("/get-by-station-and-date/{station_name}/{schedule_date}")
@@ -77,17 +78,17 @@ async def get_station_schedules(station_name: str, schedule_date: date, db: Sess
     return schedules
 
 @router.get("/get-week-schedule/{cast_id}")
-async def get_week_schedule(cast_id: str, db: Session = Depends(get_db)):
-    repo = CastScheduleRepository(db)
+async def get_week_schedule(cast_id: str, db: AsyncSession = Depends(get_async_db)):
+    repo = AsyncCastScheduleRepository(db)
     today = date.today()
     end_date = today + timedelta(days=6)
-    schedules = repo.get_schedules_by_cast_and_date_range(cast_id, today, end_date)
+    schedules = await repo.get_schedules_by_cast_and_date_range(cast_id, today, end_date)
     return schedules
 
 @router.delete("/delete/{cast_id}/{schedule_date}")
-async def delete_cast_schedule(cast_id: str, schedule_date: date, db: Session = Depends(get_db)):
-    repo = CastScheduleRepository(db)
-    success = repo.delete_schedule(cast_id, schedule_date)
+async def delete_cast_schedule(cast_id: str, schedule_date: date, db: AsyncSession = Depends(get_async_db)):
+    repo = AsyncCastScheduleRepository(db)
+    success = await repo.delete_schedule(cast_id, schedule_date)
     if not success:
         raise HTTPException(status_code=404, detail="Schedule not found")
     return {"status": "success", "message": "Schedule deleted"}
@@ -104,11 +105,11 @@ class BatchUpdateRequest(BaseModel):
     shifts: List[Shift]
 
 @router.post("/batch-update")
-async def batch_update_schedules(batch_request: BatchUpdateRequest, db: Session = Depends(get_db)):
-    repo = CastScheduleRepository(db)
+async def batch_update_schedules(batch_request: BatchUpdateRequest, db: AsyncSession = Depends(get_async_db)):
+    repo = AsyncCastScheduleRepository(db)
     try:
         # リポジトリに新たに追加したメソッドを使用
-        repo.batch_update_or_create_schedules(batch_request.cast_id, batch_request.shifts)
+        await repo.batch_update_or_create_schedules(batch_request.cast_id, batch_request.shifts)
         return {"status": "success", "message": "Schedules updated or created successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
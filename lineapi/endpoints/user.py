@@ -4,6 +4,7 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from lineapi.database import get_db
 from lineapi.repositories.user_repository import UserRepository
+from img import signing
 from pydantic import BaseModel, Field
 from typing import Optional
 from datetime import datetime
@@ -95,6 +96,22 @@ async def get_user_profile(line_id: str, db: Session = Depends(get_db)):
 
 
 
+#非公開画像（本人確認書類など）の署名付きURL取得
+#URLの有効期限は短いため、画像を表示するたびに発行する
+@router.get("/private-image-url")
+async def get_private_image_url(line_id: str, path: str, db: Session = Depends(get_db)):
+    if not signing.is_enabled():
+        raise HTTPException(status_code=503, detail="Private images are not available")
+    user_repo = UserRepository(db)
+    user = user_repo.get_user_by_line_id(line_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    # 本人の非公開カテゴリの画像だけ発行する
+    if not signing.is_private(path) or signing.path_owner(path) != user.invitation_id:
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    return {"path": path, "signed_url": signing.signed_url(path)}
+
 #モックログイン
 @router.post("/mock_login")
 async def mock_login(line_id: str, db: Session = Depends(get_db)):
@@ -9,6 +9,7 @@ from dotenv import load_dotenv
 import os
 import logging
 import time
+from metrics import external_call
 
 # 環境変数を読み込む
 load_dotenv()
@@ -51,25 +52,28 @@ def handle_message(event: MessageEvent):
     # LINEユーザーIDを取得
     user_id = event.source.user_id
     
-    # AIの返答を生成する関数を呼び出し
-    reply_message = ai_message(user_message, user_id)
+    # AIの返答を生成する関数を呼び出し（スレッドの確認から返答の完了待ちまでを1回として計測）
+    with external_call("openai", "assistant_reply"):
+        reply_message = ai_message(user_message, user_id)
     # 返信メッセージが空でないことを確認
     if not reply_message:
         reply_message = "申し訳ありません、現在応答できません。"
     
-    line_bot_api.reply_message(
-        event.reply_token,
-        TextSendMessage(text=reply_message)
-    )
+    with external_call("line", "reply_message"):
+        line_bot_api.reply_message(
+            event.reply_token,
+            TextSendMessage(text=reply_message)
+        )
 
 @handler.add(MessageEvent, message=ImageMessage)
 def handle_image_message(event: MessageEvent):
     line_bot_api = LineBotApi(line_channel_access_token)
     # 画像メッセージを受け取ったことをユーザーに知らせる
-    line_bot_api.reply_message(
-        event.reply_token,
-        TextSendMessage(text="画像を受け取りました！")
-    )
+    with external_call("line", "reply_message"):
+        line_bot_api.reply_message(
+            event.reply_token,
+            TextSendMessage(text="画像を受け取りました！")
+        )
 
 # AIにメッセージを送信して返答を得る関数
 def ai_message(user_message: str, user_id: str) -> str:
@@ -0,0 +1,149 @@
+# lineapi/query_stats.py
+# リクエストごとのSQLの件数・DB時間の集計と、遅いクエリのログ
+#
+# - middleware.py の RequestMiddleware がリクエストの開始時に集計用のオブジェクトを用意する（contextvarsで保持）
+# - エンジンの before/after_cursor_execute で件数と時間を足す
+# - 件数と時間はアクセスログに出し、QUERY_STATS_HEADERS=1 のときはレスポンスヘッダー（X-DB-Query-Count / X-DB-Query-Time）にも付ける
+# - SLOW_QUERY_MS を超えたクエリは、値を除いたSQL・パラメータの形・呼び出し元のリポジトリのメソッドをログに出す
+
+import os
+import re
+import sys
+import time
+import logging
+from contextvars import ContextVar
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 200))
+# 1リクエストでこれを超える件数のクエリを発行したら警告する（N+1の検出用）
+QUERY_COUNT_WARNING = int(os.getenv("QUERY_COUNT_WARNING", 30))
+MAX_LOGGED_SQL_LENGTH = 1000
+# 件数・時間をレスポンスヘッダーで返すか（開発環境用。内部の情報なので本番では付けない）
+QUERY_STATS_HEADERS = os.getenv("QUERY_STATS_HEADERS", "0") == "1"
+
+LINEAPI_DIR = os.path.dirname(os.path.abspath(__file__))
+# 呼び出し元として扱わないファイル（DB接続まわり）
+IGNORED_CALLER_FILES = {os.path.join(LINEAPI_DIR, "database.py"), os.path.abspath(__file__)}
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|\?")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+_current = ContextVar("query_stats", default=None)
+
+
+class QueryStats:
+    def __init__(self, request=None):
+        # ログに出すリクエストの説明（"GET /api/cast/xxx" など）
+        self.request = request
+        self.count = 0
+        self.seconds = 0.0
+        self.slow = 0
+
+    @property
+    def milliseconds(self):
+        return self.seconds * 1000
+
+
+def start_request(request=None):
+    """
+    リクエストの集計を開始する。(集計, トークン) を返すので、終了時にトークンを end_request に渡す
+    """
+    stats = QueryStats(request)
+    return stats, _current.set(stats)
+
+def end_request(token):
+    _current.reset(token)
+
+def current():
+    return _current.get()
+
+def normalize_sql(statement):
+    """
+    値とプレースホルダーを ? にそろえ、IN (?, ?, ...) をまとめる（同じ形のクエリを同じ文字列にする）
+    """
+    sql = _STRING_LITERAL.sub("?", statement)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _IN_LIST.sub("(?...)", sql)
+    sql = _WHITESPACE.sub(" ", sql).strip()
+    if len(sql) > MAX_LOGGED_SQL_LENGTH:
+        sql = sql[:MAX_LOGGED_SQL_LENGTH] + "..."
+    return sql
+
+def parameters_shape(parameters, executemany=False):
+    """
+    パラメータの値は出さず、キーと型だけを返す（個人情報をログに残さないため）
+    """
+    if executemany and isinstance(parameters, (list, tuple)):
+        first = parameters[0] if parameters else None
+        return f"{len(parameters)} x {parameters_shape(first)}"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}" for key, value in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        return "(" + ", ".join(type(value).__name__ for value in parameters) + ")"
+    return type(parameters).__name__
+
+def _describe_frame(frame):
+    code = frame.f_code
+    owner = frame.f_locals.get("self")
+    name = f"{type(owner).__name__}.{code.co_name}" if owner is not None else code.co_name
+    return f"{name} ({os.path.relpath(code.co_filename, os.path.dirname(LINEAPI_DIR))}:{frame.f_lineno})"
+
+def _find_caller(frame):
+    # 最初に見つかったlineapi内のフレーム（リポジトリ、なければエンドポイントなど）を返す
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename.startswith(LINEAPI_DIR + os.sep) and filename not in IGNORED_CALLER_FILES:
+            return _describe_frame(frame)
+        frame = frame.f_back
+    return None
+
+def find_caller():
+    caller = _find_caller(sys._getframe(1))
+    if caller is None:
+        # AsyncSessionのクエリはgreenletの中で実行されるため、呼び出し元は親のgreenlet側のスタックにある
+        try:
+            import greenlet
+            parent = greenlet.getcurrent().parent
+            if parent is not None:
+                caller = _find_caller(parent.gr_frame)
+        except ImportError:
+            pass
+    return caller or "unknown"
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # 実行ごとのcontextに持たせるので、クエリが失敗しても値が残り続けることはない
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+
+    stats = _current.get()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += elapsed
+
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        if stats is not None:
+            stats.slow += 1
+        during = f" during {stats.request}" if stats is not None and stats.request else ""
+        logger.warning(
+            f"Slow query ({elapsed * 1000:.1f}ms) from {find_caller()}{during}: {normalize_sql(statement)} "
+            f"params={parameters_shape(parameters, executemany)}"
+        )
+
+def instrument(engine):
+    """
+    エンジンにクエリの計測を登録する（AsyncEngineの場合は sync_engine を渡す）
+    """
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
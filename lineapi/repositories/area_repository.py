@@ -1,6 +1,8 @@
 # repositories/area_repository.py
 
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from lineapi.models.prefecture import Prefecture
 from lineapi.models.line import Line
 from lineapi.models.station import Station
@@ -30,4 +32,34 @@ class StationRepository:
         station = self.db.query(Station).filter(Station.id == station_id).first()
         if station:
             return station.name
-        return None  # 駅が見つからなかった場合はNoneを返す
\ No newline at end of file
+        return None  # 駅が見つからなかった場合はNoneを返す
+
+
+# async def のエンドポイント用（AsyncSessionを使い、DB待ちの間イベントループを止めない）
+class AsyncPrefectureRepository:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def get_all_prefectures(self):
+        result = await self.db.execute(select(Prefecture))
+        return result.scalars().all()
+
+class AsyncLineRepository:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def get_lines_by_prefecture(self, prefecture_id: int):
+        result = await self.db.execute(select(Line).join(Line.prefectures).where(Prefecture.id == prefecture_id))
+        return result.scalars().all()
+
+class AsyncStationRepository:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def get_stations_by_line(self, line_id: int):
+        result = await self.db.execute(select(Station).where(Station.line_id == line_id).order_by(Station.e_sort))
+        return result.scalars().all()
+
+    async def get_station_name_by_id(self, station_id: int):
+        result = await self.db.execute(select(Station.name).where(Station.id == station_id))
+        return result.scalars().first()
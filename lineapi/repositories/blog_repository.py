@@ -1,5 +1,7 @@
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Dict, Any, List, Optional
 from lineapi.models.blog import Post
 import logging
@@ -86,3 +88,88 @@ class BlogRepository:
                 self.db.rollback()
                 raise
         return None
+
+
+# async def のエンドポイント用（AsyncSessionを使い、DB待ちの間イベントループを止めない）
+class AsyncBlogRepository:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def create_post(self, cast_id: str, body: str, photo_url: Optional[str] = None,
+                          status: str = 'public') -> Post:
+        try:
+            post = Post(
+                cast_id=cast_id,
+                body=body,
+                photo_url=photo_url,
+                status=status,
+                likes_count=0
+            )
+            self.db.add(post)
+            await self.db.commit()
+            await self.db.refresh(post)
+            return post
+        except SQLAlchemyError as e:
+            logger.error(f"Database error while creating post: {str(e)}")
+            await self.db.rollback()
+            raise
+
+    async def get_post(self, post_id: int) -> Optional[Post]:
+        result = await self.db.execute(select(Post).where(
+            Post.id == post_id,
+            Post.is_deleted == False
+        ))
+        return result.scalars().first()
+
+    async def get_posts_by_cast(self, cast_id: str, skip: int = 0, limit: int = 20) -> List[Post]:
+        result = await self.db.execute(select(Post).where(
+            Post.cast_id == cast_id,
+            Post.is_deleted == False
+        ).order_by(Post.created_at.desc()).offset(skip).limit(limit))
+        return result.scalars().all()
+
+    async def update_post(self, post_id: int, update_data: Dict[str, Any]) -> Optional[Post]:
+        post = await self.get_post(post_id)
+        if post:
+            try:
+                for key, value in update_data.items():
+                    if hasattr(post, key):
+                        setattr(post, key, value)
+                await self.db.commit()
+                await self.db.refresh(post)
+                return post
+            except SQLAlchemyError as e:
+                logger.error(f"Database error while updating post: {str(e)}")
+                await self.db.rollback()
+                raise
+        return None
+
+    async def delete_post(self, post_id: int) -> bool:
+        post = await self.get_post(post_id)
+        if post:
+            try:
+                post.is_deleted = True
+                await self.db.commit()
+                return True
+            except SQLAlchemyError as e:
+                logger.error(f"Database error while deleting post: {str(e)}")
+                await self.db.rollback()
+                raise
+        return False
+
+    async def increment_likes(self, post_id: int) -> Optional[Post]:
+        """
+        指定された投稿のいいね数をインクリメントする
+        """
+        post = await self.get_post(post_id)
+        if post:
+            try:
+                post.likes_count += 1
+                await self.db.commit()
+                await self.db.refresh(post)
+                return post
+            except SQLAlchemyError as e:
+                logger.error(f"Database error while incrementing likes: {str(e)}")
+                await self.db.rollback()
+                raise
+        return None
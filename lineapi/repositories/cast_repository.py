@@ -1,7 +1,9 @@
 # repositories/cast_repository.py
 
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 from lineapi.models.cast import BasicCastInfo
 from typing import Dict, Any
 import logging
@@ -45,4 +47,44 @@ class CastRepository:
         self.db.add(new_profile)
         self.db.commit()
         self.db.refresh(new_profile)
-        return new_profile
\ No newline at end of file
+        return new_profile
+
+
+# async def のエンドポイント用（AsyncSessionを使い、DB待ちの間イベントループを止めない）
+class AsyncCastRepository:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def get_cast_by_cast_id(self, cast_id: str):
+        result = await self.db.execute(select(BasicCastInfo).where(BasicCastInfo.cast_id == cast_id))
+        return result.scalars().first()
+
+    async def update_cast_profile(self, cast_id: str, update_data: Dict[str, Any]):
+        logger.info(f"Attempting to update cast profile for cast_id: {cast_id}")
+        logger.debug(f"Update data: {update_data}")
+
+        cast = await self.get_cast_by_cast_id(cast_id)
+        if cast:
+            try:
+                for key, value in update_data.items():
+                    if hasattr(cast, key):
+                        setattr(cast, key, value)
+                    else:
+                        logger.warning(f"Attribute {key} not found in cast object")
+                await self.db.commit()
+                await self.db.refresh(cast)
+                logger.info(f"Successfully updated cast profile for cast_id: {cast_id}")
+                return cast
+            except SQLAlchemyError as e:
+                logger.error(f"Database error while updating cast profile: {str(e)}")
+                await self.db.rollback()
+                raise
+        else:
+            logger.warning(f"Cast not found for cast_id: {cast_id}")
+            return None
+
+    async def create_cast_profile(self, new_profile: BasicCastInfo):
+        self.db.add(new_profile)
+        await self.db.commit()
+        await self.db.refresh(new_profile)
+        return new_profile
@@ -1,6 +1,8 @@
 #lineapi/repositories/cast_schedule_repository.py
 
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from lineapi.models.cast_schedule import CastSchedule
 from datetime import date, time
 
@@ -97,4 +99,88 @@ class CastScheduleRepository:
         except Exception as e:
             self.db.rollback()
             raise e
-    
\ No newline at end of file
+
+
+# async def のエンドポイント用（AsyncSessionを使い、DB待ちの間イベントループを止めない）
+class AsyncCastScheduleRepository:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def update_or_create_schedule(self, cast_id: str, schedule_date: date, start_time: time, end_time: time, is_available: bool, station_code: int) -> CastSchedule:
+        schedule = await self.get_schedule_by_cast_and_date(cast_id, schedule_date)
+
+        if schedule:
+            schedule.start_time = start_time
+            schedule.end_time = end_time
+            schedule.is_available = is_available
+            schedule.station_code = station_code
+        else:
+            schedule = CastSchedule(
+                cast_id=cast_id,
+                date=schedule_date,
+                start_time=start_time,
+                end_time=end_time,
+                is_available=is_available,
+                station_code=station_code
+            )
+            self.db.add(schedule)
+
+        await self.db.commit()
+        await self.db.refresh(schedule)
+        return schedule
+
+    async def get_schedule_by_cast_and_date(self, cast_id: str, schedule_date: date) -> CastSchedule:
+        result = await self.db.execute(select(CastSchedule).where(
+            CastSchedule.cast_id == cast_id,
+            CastSchedule.date == schedule_date
+        ))
+        return result.scalars().first()
+
+    async def get_schedules_by_cast(self, cast_id: str):
+        result = await self.db.execute(select(CastSchedule).where(CastSchedule.cast_id == cast_id))
+        return result.scalars().all()
+
+    async def get_schedules_by_cast_and_date_range(self, cast_id: str, start_date: date, end_date: date):
+        result = await self.db.execute(select(CastSchedule).where(
+            CastSchedule.cast_id == cast_id,
+            CastSchedule.date >= start_date,
+            CastSchedule.date <= end_date
+        ))
+        return result.scalars().all()
+
+    async def delete_schedule(self, cast_id: str, schedule_date: date) -> bool:
+        schedule = await self.get_schedule_by_cast_and_date(cast_id, schedule_date)
+        if schedule:
+            await self.db.delete(schedule)
+            await self.db.commit()
+            return True
+        return False
+
+    async def batch_update_or_create_schedules(self, cast_id: str, shifts: list):
+        try:
+            # 対象日の既存シフトは1回のクエリでまとめて取得する
+            result = await self.db.execute(select(CastSchedule).where(
+                CastSchedule.cast_id == cast_id,
+                CastSchedule.date.in_([shift.date for shift in shifts])
+            ))
+            existing = {schedule.date: schedule for schedule in result.scalars()}
+
+            for shift in shifts:
+                existing_schedule = existing.get(shift.date)
+                if existing_schedule:
+                    existing_schedule.start_time = shift.start_time
+                    existing_schedule.end_time = shift.end_time
+                    existing_schedule.station_code = shift.station_code
+                else:
+                    self.db.add(CastSchedule(
+                        cast_id=cast_id,
+                        date=shift.date,
+                        start_time=shift.start_time,
+                        end_time=shift.end_time,
+                        station_code=shift.station_code
+                    ))
+
+            await self.db.commit()
+        except Exception as e:
+            await self.db.rollback()
+            raise e
@@ -4,11 +4,15 @@ import os
 import logging
 from fastapi import FastAPI, Request, Response, HTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from lineapi.endpoints import routers  # まとめてインポート
-from lineapi.database import SessionLocal
 from img.main import app as upload_service_app
+from img.main import start_background_tasks as start_image_tasks, stop_background_tasks as stop_image_tasks
+from static_files import PrecompressedStaticFiles, SpaIndex
+from middleware import RequestMiddleware
+from lineapi import query_stats
+from img.worker import image_worker_pool
+import metrics
 
 
 
@@ -24,6 +28,15 @@ app = FastAPI(debug=True)
 # upload_service をマウント
 app.mount("/img", upload_service_app)
 
+# マウントしたアプリのイベントは呼ばれないため、画像サービスのバックグラウンド処理はここで開始・終了する
+@app.on_event("startup")
+async def startup_image_tasks():
+    start_image_tasks()
+
+@app.on_event("shutdown")
+def shutdown_image_tasks():
+    stop_image_tasks()
+
 
 # CORS設定
 app.add_middleware(
@@ -42,47 +55,37 @@ app.mount("/line-static", StaticFiles(directory="lineapi/static"), name="line-st
 build_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "webapp/build"))
 if not os.path.exists(build_dir):
     raise RuntimeError(f"Directory '{build_dir}' does not exist")
-app.mount("/static", StaticFiles(directory=os.path.join(build_dir, "static")), name="static")
-
-# データベースセッションの取得
-@app.middleware("http")
-async def db_session_middleware(request: Request, call_next):
-    response = Response("Internal server error", status_code=500)
-    try:
-        request.state.db = SessionLocal()
-        response = await call_next(request)
-    finally:
-        request.state.db.close()
-    return response
-
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    logger.info(f"Received request: {request.method} {request.url.path}")
-    response = await call_next(request)
-    logger.info(f"Response status: {response.status_code}")
-    return response
-
-@app.middleware("http")
-async def api_middleware(request: Request, call_next):
-    if request.url.path.startswith("/api/"):
-        logger.info(f"Processing API request: {request.url.path}")
-        response = await call_next(request)
-        if response.status_code == 404:
-            logger.warning(f"API endpoint not found: {request.url.path}")
-            return JSONResponse(status_code=404, content={"detail": "API endpoint not found"})
-        return response
-    return await call_next(request)
+# 事前圧縮（gzip/br）とハッシュ付きファイル名のimmutableキャッシュに対応
+app.mount("/static", PrecompressedStaticFiles(directory=os.path.join(build_dir, "static")), name="static")
+# index.htmlは起動時にメモリに載せる
+spa_index = SpaIndex(os.path.join(build_dir, "index.html"))
+
+# DBセッションの用意・リクエストログ・/api/ の404の置き換え（ASGIミドルウェア1つにまとめている）
+# SQLの件数・DB時間のレスポンスヘッダー（X-DB-Query-Count / X-DB-Query-Time）は QUERY_STATS_HEADERS=1 のときだけ付ける
+app.add_middleware(RequestMiddleware, query_headers=query_stats.QUERY_STATS_HEADERS)
 
 # エンドポイントのインクルード
 for router, prefix in routers:
     app.include_router(router, prefix=prefix)
 
+# 画像処理の混み具合（待ち行列が伸びると503を返し始める）
+metrics.register_gauge("image_worker_queue_depth", "Image jobs waiting for a worker process", lambda: image_worker_pool.queue_depth)
+metrics.register_gauge("image_worker_in_flight", "Image jobs running or waiting", lambda: image_worker_pool.in_flight)
+
+# Prometheus形式のメトリクス（catch-allのReactのルートより先に登録する）
+# 許可されていないリクエストには存在しないものとして404を返す（METRICS_TOKEN / METRICS_ALLOWED_HOSTS）
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint(request: Request):
+    client_host = request.client.host if request.client else None
+    if not metrics.is_scrape_allowed(request.headers, client_host):
+        raise HTTPException(status_code=404, detail="Not Found")
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 # React アプリケーションのルートハンドラ
 # すべてのその他のリクエストを index.html にリダイレクト
 @app.get("/{full_path:path}")
-async def serve_react_app(full_path: str):
-    index_path = os.path.join(build_dir, "index.html")
+async def serve_react_app(request: Request, full_path: str):
     # ファイルが存在しない場合はエラーを出力
-    if not os.path.exists(index_path):
+    if spa_index.content is None:
         return {"error": "index.html not found"}
-    return FileResponse(index_path)
\ No newline at end of file
+    return spa_index.response(request)
\ No newline at end of file
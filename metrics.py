@@ -0,0 +1,214 @@
+#DELIVERY/metrics.py
+# Prometheus形式のメトリクス（main.py の /metrics で公開）
+#
+# - HTTP: ルートごとの処理時間ヒストグラム・ステータス別の件数・処理中の件数（middleware.py で記録）
+# - DB: 接続プールの取得待ち時間・プールのサイズ/使用中/オーバーフロー（lineapi/database.py で登録）
+# - 画像処理: ワーカープールの待ち行列の長さ（main.py で登録）
+# - 外部API: LINE・OpenAI の呼び出し時間（external_call で囲む）
+#
+# /metrics は外部に公開しない（is_scrape_allowed）
+# - METRICS_TOKEN を設定した場合は "Authorization: Bearer <token>" を付けたリクエストだけを許可する
+# - 未設定の場合はプロキシを経由しない同一ホスト（METRICS_ALLOWED_HOSTS）からのリクエストだけを許可する
+#
+# 記録は辞書の加算だけで、ロックは取らない（ほぼイベントループのスレッドからしか呼ばれないため）
+# ヒストグラムのバケットは固定で、記録時は該当バケットを1つ加算するだけ（累積は出力時に計算する）
+
+import os
+import hmac
+import time
+import bisect
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+METRICS_ALLOWED_HOSTS = {
+    host.strip() for host in os.getenv("METRICS_ALLOWED_HOSTS", "127.0.0.1,::1").split(",") if host.strip()
+}
+# 同じホストのリバースプロキシ経由のリクエストは接続元がループバックになるため、これらのヘッダーがあれば拒否する
+PROXY_HEADERS = ("x-forwarded-for", "x-real-ip", "forwarded")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+EXTERNAL_CALL_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+# (メトリクス名, 説明, プールのメソッド名)
+POOL_GAUGES = [
+    ("db_pool_size", "Configured size of the DB connection pool", "size"),
+    ("db_pool_checked_out", "DB connections currently checked out", "checkedout"),
+    ("db_pool_checked_in", "Idle DB connections in the pool", "checkedin"),
+    ("db_pool_overflow", "DB connections opened beyond the pool size", "overflow"),
+]
+
+_metrics = []
+_collectors = []
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in list(self._values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Gauge:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        _metrics.append(self)
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        for labels, value in list(self._values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # ラベルごとに [バケットごとの件数（最後は+Inf）, 合計]
+        self._series = {}
+        _metrics.append(self)
+
+    def observe(self, value, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total) in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), list(counts)):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by method, route and status", ("method", "route", "status")
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by method and route", ("method", "route")
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being processed")
+HTTP_REQUESTS_IN_FLIGHT.set(0)
+
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled DB connection", ("engine",), POOL_WAIT_BUCKETS
+)
+
+EXTERNAL_CALL_DURATION = Histogram(
+    "external_call_duration_seconds", "Latency of calls to external APIs", ("service", "operation", "outcome"),
+    EXTERNAL_CALL_BUCKETS,
+)
+
+
+def is_scrape_allowed(headers, client_host):
+    if METRICS_TOKEN:
+        # トークンを推測されないよう定数時間で比較する
+        authorization = headers.get("authorization", "")
+        return hmac.compare_digest(authorization.encode("utf-8"), f"Bearer {METRICS_TOKEN}".encode("utf-8"))
+    if any(name in headers for name in PROXY_HEADERS):
+        return False
+    return client_host in METRICS_ALLOWED_HOSTS
+
+def register_gauge(name, documentation, func):
+    """
+    出力のたびに func() の値を読むゲージを登録する（キューの長さなど、記録側に手を入れたくないもの）
+    """
+    def collect():
+        yield f"# HELP {name} {documentation}"
+        yield f"# TYPE {name} gauge"
+        yield f"{name} {_number(func())}"
+    _collectors.append(collect)
+
+_engines = []
+
+def register_engine_pool(name, engine):
+    """
+    SQLAlchemyのエンジンの接続プールの状態を出力する（dispose後にプールが作り直されても追従する）
+    """
+    _engines.append((name, engine))
+
+def _collect_pools():
+    # 同じメトリクスの行はまとめて出力する必要があるので、メトリクスごとに全エンジン分を出す
+    for metric_name, documentation, method in POOL_GAUGES:
+        yield f"# HELP {metric_name} {documentation}"
+        yield f"# TYPE {metric_name} gauge"
+        for name, engine in _engines:
+            pool = engine.pool
+            if hasattr(pool, method):
+                yield f'{metric_name}{{engine="{_escape(name)}"}} {_number(getattr(pool, method)())}'
+
+@contextmanager
+def external_call(service, operation):
+    """
+    外部APIの呼び出しを囲んで時間を記録する
+        with external_call("line", "get_profile"):
+            ...
+    """
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        EXTERNAL_CALL_DURATION.observe(time.perf_counter() - started, service, operation, outcome)
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.collect())
+    for collect in [_collect_pools] + _collectors:
+        try:
+            lines.extend(collect())
+        except Exception as e:
+            # 1つの値が読めなくても他のメトリクスは返す
+            lines.append(f"# collector error: {_escape(e)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,114 @@
+#DELIVERY/middleware.py
+# アプリ全体のミドルウェア（ASGIで直接実装）
+#
+# 以前は @app.middleware("http") を3つ重ねていたが、BaseHTTPMiddlewareはリクエストごとに
+# タスクとレスポンスのコピーを挟み、ストリーミングレスポンスも途中で溜め込んでしまうため1つにまとめた
+#
+# - リクエスト単位のDBセッション（get_db と共有、使われたときだけ作成）の用意と終了
+# - リクエスト/レスポンスのログ
+# - /api/ 配下の404を {"detail": "API endpoint not found"} に置き換える
+# - ルートごとの処理時間・ステータス別の件数・処理中の件数の記録（metrics.py）
+# - リクエストごとのSQLの件数・DB時間の集計（lineapi/query_stats.py）。query_headers=True のときはレスポンスヘッダーにも付ける
+
+import json
+import time
+import logging
+import metrics
+from lineapi.database import RequestSession
+from lineapi import query_stats
+
+logger = logging.getLogger(__name__)
+
+API_PREFIX = "/api/"
+API_NOT_FOUND_BODY = json.dumps({"detail": "API endpoint not found"}).encode("utf-8")
+UNMATCHED_ROUTE = "unmatched"
+
+def route_label(scope, root_path):
+    """
+    メトリクスのラベルに使うルート名（/api/cast/{cast_id} のようなテンプレート）
+    実際のパスを使うとラベルの種類が際限なく増えるため、一致したルートのパスを使う
+    """
+    # マウントしたアプリ（/img, /static）ではroot_pathにマウント先のパスが足されている
+    mount = scope.get("root_path", "")[len(root_path):]
+    route = scope.get("route")
+    if route is not None and getattr(route, "path", None):
+        return mount + route.path
+    return mount or UNMATCHED_ROUTE
+
+
+class RequestMiddleware:
+    def __init__(self, app, session_class=RequestSession, query_headers=False):
+        self.app = app
+        self.session_class = session_class
+        self.query_headers = query_headers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        root_path = scope.get("root_path", "")
+        path = scope["path"]
+        is_api = path.startswith(API_PREFIX)
+        if is_api:
+            logger.info(f"Processing API request: {path}")
+        logger.info(f"Received request: {scope['method']} {path}")
+
+        # request.state.db_session として参照できる（Requestのstateはscope["state"]を使う）
+        db_session = self.session_class()
+        scope.setdefault("state", {})["db_session"] = db_session
+        stats, stats_token = query_stats.start_request(f"{scope['method']} {path}")
+
+        def stats_headers():
+            if not self.query_headers:
+                return []
+            return [
+                (b"x-db-query-count", str(stats.count).encode("latin-1")),
+                (b"x-db-query-time", f"{stats.milliseconds:.1f}ms".encode("latin-1")),
+            ]
+
+        replaced = False
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal replaced, status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                logger.info(f"Response status: {status} (queries={stats.count}, db_time={stats.milliseconds:.1f}ms)")
+                if is_api and status == 404:
+                    logger.warning(f"API endpoint not found: {path}")
+                    replaced = True
+                    await send({
+                        "type": "http.response.start",
+                        "status": 404,
+                        "headers": [
+                            (b"content-type", b"application/json"),
+                            (b"content-length", str(len(API_NOT_FOUND_BODY)).encode("latin-1")),
+                        ] + stats_headers(),
+                    })
+                    await send({"type": "http.response.body", "body": API_NOT_FOUND_BODY})
+                    return
+                if self.query_headers:
+                    message = {**message, "headers": list(message.get("headers", [])) + stats_headers()}
+            elif message["type"] == "http.response.body" and replaced:
+                # 置き換えたレスポンスの元の本文は捨てる
+                return
+            await send(message)
+
+        metrics.HTTP_REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # レスポンスを送り終えてから閉じる（ストリーミング中も使える）
+            db_session.close()
+            query_stats.end_request(stats_token)
+            metrics.HTTP_REQUESTS_IN_FLIGHT.dec()
+            route = route_label(scope, root_path)
+            metrics.HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, scope["method"], route)
+            metrics.HTTP_REQUESTS.inc(scope["method"], route, str(status))
+            if stats.count > query_stats.QUERY_COUNT_WARNING:
+                logger.warning(
+                    f"{stats.count} queries ({stats.milliseconds:.1f}ms) for {scope['method']} {route}, "
+                    f"check for lazy loading in a loop"
+                )
@@ -0,0 +1,208 @@
+#DELIVERY/static_files.py
+# Reactのビルド済みファイルの配信
+#
+# - js/css等はgzip（brotliがあればbrも）で事前圧縮したファイルを作り、Accept-Encodingに合わせて返す
+# - ファイル名にハッシュを含むもの（main.1a2b3c4d.js など）は内容が変わらないのでimmutableでキャッシュさせる
+# - ファイル一覧は起動時にメモリに載せ、リクエストごとに存在確認（stat）をしない
+# - index.htmlは内容ごとメモリに載せ、ETagで再検証させる
+#
+# ビルド時に事前圧縮しておく場合:
+#   python static_files.py webapp/build
+
+import os
+import re
+import sys
+import gzip
+import hashlib
+import logging
+import mimetypes
+from email.utils import formatdate
+from fastapi import Request, Response
+from fastapi.staticfiles import StaticFiles
+from starlette.exceptions import HTTPException
+from fastapi.responses import FileResponse
+from img.responses import is_not_modified
+
+try:
+    import brotli
+except ImportError:  # brotliがなければgzipのみ
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_EXTENSIONS = {".js", ".css", ".html", ".json", ".map", ".svg", ".txt", ".xml", ".ico"}
+MIN_COMPRESS_BYTES = 1024
+HASHED_NAME_PATTERN = re.compile(r"\.[0-9a-f]{8,}\.")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# 優先順（先にあるものを選ぶ）
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+def _compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+def available_encodings():
+    return [(name, suffix) for name, suffix in ENCODINGS if name != "br" or brotli]
+
+def precompress(directory):
+    """
+    圧縮対象のファイルの .gz / .br を作る（既に新しいものがあれば作り直さない）。作成した数を返す
+    """
+    created = 0
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if os.path.splitext(filename)[1] not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            stat_result = os.stat(path)
+            if stat_result.st_size < MIN_COMPRESS_BYTES:
+                continue
+            data = None
+            for encoding, suffix in available_encodings():
+                compressed_path = path + suffix
+                if os.path.exists(compressed_path) and os.path.getmtime(compressed_path) >= stat_result.st_mtime:
+                    continue
+                if data is None:
+                    with open(path, "rb") as f:
+                        data = f.read()
+                compressed = _compress(data, encoding)
+                # 圧縮しても小さくならないものは作らない
+                if len(compressed) >= len(data):
+                    continue
+                try:
+                    with open(compressed_path + ".tmp", "wb") as f:
+                        f.write(compressed)
+                    os.replace(compressed_path + ".tmp", compressed_path)
+                    created += 1
+                except OSError as e:
+                    # 書き込めない環境では非圧縮のまま配信する
+                    logger.warning(f"Failed to write {compressed_path}: {e}")
+                    return created
+    return created
+
+def accepted_encodings(accept_encoding):
+    accepted = set()
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        params = params.replace(" ", "")
+        try:
+            quality = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            quality = 1.0
+        if quality > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+def _etag(stat_result, encoding=""):
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}{"-" + encoding if encoding else ""}"'
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    起動時に作ったファイル一覧から、圧縮済みファイルを選んで返すStaticFiles
+    """
+
+    def __init__(self, directory, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.root = os.path.abspath(directory)
+        created = precompress(self.root)
+        self._index = self._build_index()
+        logger.info(f"Static files indexed: {len(self._index)} files ({created} precompressed variants created)")
+
+    def _build_index(self):
+        index = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith((".gz", ".br", ".tmp")):
+                    continue
+                path = os.path.join(dirpath, filename)
+                relative = os.path.relpath(path, self.root).replace(os.sep, "/")
+                media_type, _ = mimetypes.guess_type(filename)
+                cache_control = IMMUTABLE_CACHE_CONTROL if HASHED_NAME_PATTERN.search(filename) else REVALIDATE_CACHE_CONTROL
+                variants = {}
+                for encoding, suffix in [("", "")] + available_encodings():
+                    if encoding and not os.path.exists(path + suffix):
+                        continue
+                    stat_result = os.stat(path + suffix)
+                    variants[encoding] = (path + suffix, stat_result, _etag(stat_result, encoding))
+                index[relative] = {
+                    "media_type": media_type or "application/octet-stream",
+                    "cache_control": cache_control,
+                    "variants": variants,
+                }
+        return index
+
+    async def get_response(self, path, scope):
+        # 事前圧縮ファイルの判定より先に、基底クラスと同じくGET/HEAD以外を405にする
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405, headers={"Allow": "GET, HEAD"})
+        entry = self._index.get(path.replace(os.sep, "/").lstrip("/"))
+        if entry is None:
+            return await super().get_response(path, scope)
+
+        request = Request(scope)
+        accepted = accepted_encodings(request.headers.get("accept-encoding"))
+        encoding = next((name for name, _ in ENCODINGS if name in accepted and name in entry["variants"]), "")
+        file_path, stat_result, etag = entry["variants"][encoding]
+
+        headers = {"ETag": etag, "Cache-Control": entry["cache_control"]}
+        if len(entry["variants"]) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if encoding:
+            headers["Content-Encoding"] = encoding
+
+        if is_not_modified(request, etag):
+            return Response(status_code=304, headers=headers)
+        # stat_resultを渡すとFileResponseは再度statしない
+        return FileResponse(file_path, media_type=entry["media_type"], headers=headers, stat_result=stat_result)
+
+
+class SpaIndex:
+    """
+    index.htmlをメモリに載せて返す（リクエストごとのファイルアクセスなし）
+    デプロイ時はプロセスを再起動して読み直す
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.content = None
+        self.variants = {}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            logger.error(f"index.html not found: {self.path}")
+            return
+        with open(self.path, "rb") as f:
+            self.content = f.read()
+        self.etag = f'"{hashlib.sha256(self.content).hexdigest()[:32]}"'
+        self.mtime = os.path.getmtime(self.path)
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+        self.variants = {"": self.content}
+        for encoding, _ in available_encodings():
+            self.variants[encoding] = _compress(self.content, encoding)
+
+    def response(self, request: Request):
+        accepted = accepted_encodings(request.headers.get("accept-encoding"))
+        encoding = next((name for name, _ in ENCODINGS if name in accepted and name in self.variants), "")
+        etag = self.etag[:-1] + f"-{encoding}\"" if encoding else self.etag
+        headers = {
+            "ETag": etag,
+            "Last-Modified": self.last_modified,
+            "Cache-Control": REVALIDATE_CACHE_CONTROL,
+            "Vary": "Accept-Encoding",
+        }
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        if is_not_modified(request, etag, self.mtime):
+            return Response(status_code=304, headers=headers)
+        return Response(self.variants[encoding], media_type="text/html", headers=headers)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    target = sys.argv[1] if len(sys.argv) > 1 else "webapp/build"
+    print(f"Precompressed {precompress(target)} files in {target}")
@@ -0,0 +1,51 @@
+# tests/conftest.py
+# テスト用の共通設定
+#
+# 画像サービスは STORAGE_PATH などをカレントディレクトリからの相対パスで使うため、
+# 一時ディレクトリに移動してから読み込む（リポジトリの storage/ や db/ には書き込まない）
+
+import io
+import os
+import sys
+import tempfile
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+WORK_DIR = tempfile.mkdtemp(prefix="precas-tests-")
+os.environ.setdefault("IMG_DB_PATH", os.path.join(WORK_DIR, "app.db"))
+os.environ.setdefault("IMG_SIGNING_KEY", "test-signing-key")
+os.chdir(WORK_DIR)
+
+
+def make_image_bytes(size=(64, 48), format="JPEG", color=(200, 40, 40), **save_options):
+    from PIL import Image
+
+    image = Image.new("RGB", size, color)
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, **save_options)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def write_image(tmp_path):
+    def write(name, **kwargs):
+        path = tmp_path / name
+        path.write_bytes(make_image_bytes(**kwargs))
+        return str(path)
+    return write
+
+
+@pytest.fixture
+def img_session_factory(tmp_path):
+    # 画像サービスのテーブルを持つ、テストごとに空のSQLite
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from img.database import Base
+    import img.models  # noqa: F401
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'img.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
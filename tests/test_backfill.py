@@ -0,0 +1,57 @@
+import os
+import pytest
+from conftest import make_image_bytes
+from img import backfill
+
+SPECS = [(32, 32, "cover", "JPEG"), (16, None, "cover", "WEBP")]
+
+
+@pytest.fixture
+def image_root(tmp_path, monkeypatch):
+    root = tmp_path / "users"
+    for user in ("AAAA0001", "BBBB0002"):
+        category = root / user / "blog"
+        category.mkdir(parents=True)
+        for index in range(3):
+            (category / f"post_{index}.jpg").write_bytes(make_image_bytes(size=(120, 90), color=(index * 60, 90, 30)))
+    monkeypatch.setattr(backfill, "DERIVATIVE_CACHE_DIR", str(tmp_path / "derivatives"))
+    return str(root)
+
+
+def count_derivatives(tmp_path):
+    return sum(len(files) for _, _, files in os.walk(tmp_path / "derivatives"))
+
+
+def test_estimate_output(image_root):
+    count, source_bytes, estimated = backfill.estimate_output(image_root, SPECS, sample_size=2)
+    assert count == 6
+    assert source_bytes == sum(
+        os.path.getsize(os.path.join(dirpath, name)) for dirpath, _, names in os.walk(image_root) for name in names
+    )
+    assert estimated > 0
+
+
+def test_refuses_when_estimate_exceeds_cache(image_root, tmp_path):
+    checkpoint = str(tmp_path / "checkpoint.json")
+    state = backfill.run_backfill(image_root, SPECS, 1, checkpoint, cache_max_bytes=100)
+    assert state["images"] == 0
+    assert count_derivatives(tmp_path) == 0
+
+    state = backfill.run_backfill(image_root, SPECS, 1, checkpoint, cache_max_bytes=100, force=True)
+    assert state["generated"] == 12
+    assert count_derivatives(tmp_path) == 12
+
+
+def test_reports_written_and_skipped_bytes(image_root, tmp_path):
+    state = backfill.run_backfill(image_root, SPECS, 1, str(tmp_path / "first.json"))
+    assert state["generated"] == 12
+    assert state["written_bytes"] > 0
+    assert state["skipped"] == 0
+    written_bytes = state["written_bytes"]
+
+    # 生成済みのものは飛ばし、そのサイズを数える
+    state = backfill.run_backfill(image_root, SPECS, 1, str(tmp_path / "second.json"))
+    assert state["generated"] == 0
+    assert state["written_bytes"] == 0
+    assert state["skipped"] == 12
+    assert state["skipped_bytes"] == written_bytes
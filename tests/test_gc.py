@@ -0,0 +1,131 @@
+import os
+import time
+import hashlib
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from conftest import make_image_bytes
+from img import gc, layout, manifest
+from img.models import ImageFile
+from img.storage import BlobStore
+from lineapi.models.blog import Post
+from lineapi.models.cast import BasicCastInfo
+from lineapi.models.user import User as LineUser
+
+USER = "GCUSER01"
+OLD = time.time() - 30 * 24 * 3600
+
+
+@pytest.mark.parametrize("logical_path, expected", [
+    (f"{USER}/blog/post_20240101.jpg", True),
+    (f"{USER}/profile/header/header_1.jpg", True),
+    (f"{USER}/profile/cast/images/castimage_3.jpg", False),
+    (f"{USER}/profile/icon/iconimage.png", False),
+    (f"{USER}/id_verification/passport.jpg", False),
+    (f"{USER}/blog/temp/abc/post.jpg", False),
+    (f"{USER}/blog", False),
+])
+def test_is_sweepable(logical_path, expected):
+    assert gc.is_sweepable(logical_path) is expected
+
+
+@pytest.mark.parametrize("value, default_dir, expected", [
+    ("post.jpg", "blog", f"{USER}/blog/post.jpg"),
+    (f"storage/users/{USER}/blog/post.jpg", None, f"{USER}/blog/post.jpg"),
+    (f"https://example.com/img/i/{USER}/profile/icon/iconimage.jpg?v=2", None, f"{USER}/profile/icon/iconimage.jpg"),
+    ("blog/./post.jpg", None, f"{USER}/blog/post.jpg"),
+    ("", "blog", None),
+])
+def test_reference_to_logical(value, default_dir, expected):
+    assert gc.reference_to_logical(USER, value, default_dir) == expected
+
+
+@pytest.fixture
+def main_db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'main.db'}")
+    for model in (Post, BasicCastInfo, LineUser):
+        model.__table__.create(engine)
+    db = sessionmaker(bind=engine)()
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def stored(tmp_path, img_session_factory):
+    blob_store = BlobStore(str(tmp_path / "blobs"), img_session_factory)
+    db = img_session_factory()
+
+    def store(relative, mtime=OLD):
+        logical = os.path.join(USER, relative)
+        file_path = layout.physical_path(logical)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        data = make_image_bytes(color=tuple(hashlib.sha256(logical.encode()).digest()[:3]))
+        source = tmp_path / "upload.jpg"
+        source.write_bytes(data)
+        blob_store.store(str(source), logical, file_path, hashlib.sha256(data).hexdigest(), len(data))
+        manifest.record_file(db, logical, len(data))
+        entry = manifest.get_file(db, logical)
+        entry.created_at = datetime.fromtimestamp(mtime)
+        db.commit()
+        os.utime(file_path, (mtime, mtime))
+        return logical, file_path
+
+    yield blob_store, db, store
+    db.close()
+
+
+def test_collect_shard_quarantines_only_unreferenced_files(tmp_path, main_db, stored):
+    blob_store, db, store = stored
+    main_db.add(Post(id=1, cast_id=USER, body="post", photo_url="referenced.jpg"))
+    main_db.commit()
+
+    store("blog/referenced.jpg")
+    orphan, orphan_path = store("blog/orphan.jpg")
+    store("blog/recent.jpg", mtime=time.time())
+    protected = [
+        store("profile/cast/images/castimage_1.jpg"),
+        store("profile/icon/iconimage.jpg"),
+        store("id_verification/passport.jpg"),
+        store("blog/temp/token/draft.jpg"),
+    ]
+    with open(orphan_path, "rb") as f:
+        orphan_data = f.read()
+    quarantine_dir = str(tmp_path / "quarantine")
+    shard = layout.shard_prefix(USER)[0]
+
+    stats = gc.collect_shard(main_db, db, blob_store, shard, timedelta(days=7), quarantine_dir, dry_run=True)
+    assert stats["quarantined"] == 1
+    assert stats["recent"] == 1
+    assert os.path.exists(orphan_path)
+
+    stats = gc.collect_shard(main_db, db, blob_store, shard, timedelta(days=7), quarantine_dir)
+    assert stats["quarantined"] == 1
+    assert stats["bytes"] == len(orphan_data)
+
+    # 隔離先に内容が残り、元の場所・blobの参照・一覧からは外れる
+    with open(os.path.join(quarantine_dir, orphan), "rb") as f:
+        assert f.read() == orphan_data
+    assert not os.path.exists(orphan_path)
+    assert blob_store.lookup(orphan) is None
+    assert manifest.get_file(db, orphan) is None
+
+    for logical, file_path in protected:
+        assert os.path.exists(file_path), logical
+    assert os.path.exists(layout.physical_path(os.path.join(USER, "blog", "referenced.jpg")))
+    assert os.path.exists(layout.physical_path(os.path.join(USER, "blog", "recent.jpg")))
+
+
+def test_quarantine_keeps_content_when_blob_is_released(tmp_path, stored):
+    blob_store, db, store = stored
+    logical, file_path = store("blog/only_copy.jpg")
+    with open(file_path, "rb") as f:
+        data = f.read()
+    blob_file = blob_store.blob_path(hashlib.sha256(data).hexdigest(), ".jpg")
+
+    gc.quarantine_file(blob_store, db, logical, file_path, str(tmp_path / "quarantine"))
+    # 参照数が0になってblobの実体は削除されても、隔離先のハードリンクに内容が残る
+    assert not os.path.exists(blob_file)
+    with open(tmp_path / "quarantine" / logical, "rb") as f:
+        assert f.read() == data
+    assert db.query(ImageFile).filter(ImageFile.path == logical).first() is None
@@ -0,0 +1,202 @@
+import functools
+import io
+import math
+import os
+import pytest
+from PIL import Image, ImageChops, ImageDraw, ImageFilter, ImageOps, ImageStat
+from img import imaging
+from img.imaging import (
+    decode_for_target, render_image, probe_image, process_animation_file, ImageRejected, _required_source_size, EXIF_ORIENTATION,
+)
+
+SOURCE_SIZE = (2000, 1500)
+
+
+def make_photo(size=SOURCE_SIZE):
+    """
+    縮小の品質を比べられるよう、グラデーションと細かい模様を含む画像を作る
+    実際のカメラ写真と同程度に輪郭を少しぼかす
+    """
+    width, height = size
+    gradient = Image.linear_gradient("L").resize(size)
+    radial = Image.radial_gradient("L").resize(size)
+    image = Image.merge("RGB", (gradient, radial, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+    draw = ImageDraw.Draw(image)
+    for i in range(0, width, 40):
+        draw.line([(i, 0), (width - i, height)], fill=(255, 255, 0), width=3)
+    for i in range(0, height, 60):
+        draw.ellipse([i, i // 2, i + 200, i // 2 + 120], outline=(0, 0, 255), width=4)
+    return image.filter(ImageFilter.GaussianBlur(1.5))
+
+
+@functools.lru_cache(maxsize=None)
+def photo_jpeg(orientation=None):
+    return jpeg_bytes(make_photo(), orientation)
+
+
+def jpeg_bytes(image, orientation=None, quality=95):
+    buffer = io.BytesIO()
+    options = {}
+    if orientation:
+        exif = Image.Exif()
+        exif[EXIF_ORIENTATION] = orientation
+        options["exif"] = exif
+    image.save(buffer, format="JPEG", quality=quality, **options)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("orientation", [1, 3, 5, 6, 7, 8])
+@pytest.mark.parametrize("width, height, crop", [
+    (500, None, None),
+    (None, 400, None),
+    (400, 300, None),
+    (300, 300, {"x": 10, "y": 20, "width": 40, "height": 50}),
+])
+def test_decode_never_below_required_size(orientation, width, height, crop):
+    data = photo_jpeg(orientation)
+    image = decode_for_target(io.BytesIO(data), width, height, crop)
+    need_w, need_h = _required_source_size(width, height, crop)
+    # 表示上の向きで、クロップ後に必要なサイズを確保していること
+    assert image.width >= need_w
+    assert image.height >= need_h
+    if not crop:
+        # 縮小デコードが効いていること
+        assert image.width * image.height < SOURCE_SIZE[0] * SOURCE_SIZE[1]
+
+
+def test_rotated_jpeg_is_downscaled_not_upscaled():
+    # 横長で保存され、Orientation 6（90度回転）で縦長に表示されるスマホ写真
+    data = photo_jpeg(6)
+    decoded = decode_for_target(io.BytesIO(data), 500, None, None)
+    assert decoded.size[0] < decoded.size[1]
+    assert decoded.width >= 500
+
+    rendered = render_image(io.BytesIO(data), 500, None, None)
+    assert rendered.size == (500, round(2000 * 500 / 1500))
+
+
+# draft + reduce の結果と、全画素デコード + LANCZOS の結果とのPSNRの下限（dB）
+MIN_PSNR = 30.0
+
+
+def psnr(a, b):
+    assert a.size == b.size
+    diff = ImageChops.difference(a.convert("RGB"), b.convert("RGB"))
+    mse = sum(rms ** 2 for rms in ImageStat.Stat(diff).rms) / 3
+    if mse == 0:
+        return float("inf")
+    return 10 * math.log10(255 ** 2 / mse)
+
+
+def reference_render(data, width, height, crop):
+    # 縮小デコードを使わない基準の結果
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    image.load()
+    if crop:
+        left = crop["x"] * image.width / 100
+        top = crop["y"] * image.height / 100
+        image = image.crop((
+            left, top,
+            left + crop["width"] * image.width / 100,
+            top + crop["height"] * image.height / 100,
+        ))
+    return image
+
+
+@pytest.mark.parametrize("orientation, width, height, crop", [
+    (None, 500, None, None),
+    (None, 200, 150, None),
+    (None, 300, 300, {"x": 10, "y": 20, "width": 40, "height": 50}),
+    (6, 500, None, None),
+    (8, 240, 320, None),
+    (6, 300, 300, {"x": 25, "y": 10, "width": 50, "height": 60}),
+])
+def test_reduced_decode_matches_full_decode(orientation, width, height, crop):
+    data = photo_jpeg(orientation)
+    rendered = render_image(io.BytesIO(data), width, height, crop)
+    expected = reference_render(data, width, height, crop).resize(rendered.size, Image.LANCZOS)
+    assert psnr(rendered, expected) >= MIN_PSNR
+
+
+ALLOWED = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+
+
+def write_animation(path, format, frames, size=(32, 24)):
+    images = [Image.new("RGB", size, (i * 40 % 256, 80, 160)) for i in range(frames)]
+    images[0].save(path, format=format, save_all=True, append_images=images[1:], duration=100, loop=0)
+    return str(path)
+
+
+@pytest.mark.parametrize("name, format", [
+    ("photo.jpg", "JPEG"),
+    ("photo.JPEG", "JPEG"),
+    ("icon.png", "PNG"),
+    ("anim.gif", "GIF"),
+    ("photo.webp", "WEBP"),
+])
+def test_probe_accepts_matching_extension(write_image, name, format):
+    probe = probe_image(write_image(name, format=format), ALLOWED, os.path.splitext(name)[1])
+    assert probe == {"format": format, "width": 64, "height": 48, "frames": 1}
+
+
+@pytest.mark.parametrize("name, format", [
+    ("photo.jpg", "PNG"),
+    ("icon.png", "JPEG"),
+    ("anim.gif", "WEBP"),
+    ("photo.webp", "GIF"),
+])
+def test_probe_rejects_extension_mismatch(write_image, name, format):
+    path = write_image(name, format=format)
+    with pytest.raises(ImageRejected) as exc_info:
+        probe_image(path, ALLOWED, os.path.splitext(name)[1])
+    assert exc_info.value.detail == "File extension does not match content"
+    assert not exc_info.value.too_large
+    # 拡張子を渡さなければ中身だけで判定する
+    assert probe_image(path, ALLOWED)["format"] == format
+
+
+def test_probe_rejects_unknown_content(tmp_path):
+    path = tmp_path / "fake.jpg"
+    path.write_bytes(b"<html>not an image</html>")
+    with pytest.raises(ImageRejected) as exc_info:
+        probe_image(str(path), ALLOWED, ".jpg")
+    assert exc_info.value.detail == "Invalid file type"
+
+
+def test_probe_rejects_too_many_pixels(write_image, monkeypatch):
+    path = write_image("big.png", format="PNG", size=(200, 100))
+    monkeypatch.setattr(imaging, "MAX_IMAGE_PIXELS", 200 * 100 - 1)
+    with pytest.raises(ImageRejected) as exc_info:
+        probe_image(path, ALLOWED, ".png")
+    assert exc_info.value.too_large
+
+
+@pytest.mark.parametrize("name, format", [("anim.gif", "GIF"), ("anim.png", "PNG"), ("anim.webp", "WEBP")])
+def test_probe_counts_frames_and_rejects_too_many(tmp_path, monkeypatch, name, format):
+    path = write_animation(tmp_path / name, format, frames=5)
+    assert probe_image(path, ALLOWED, os.path.splitext(name)[1])["frames"] == 5
+
+    monkeypatch.setattr(imaging, "MAX_IMAGE_FRAMES", 4)
+    with pytest.raises(ImageRejected) as exc_info:
+        probe_image(path, ALLOWED)
+    assert exc_info.value.detail == "Too many frames"
+    assert exc_info.value.too_large
+
+
+def test_probe_rejects_frames_over_pixel_budget(tmp_path, monkeypatch):
+    # 1フレームは上限内でも、フレーム数×ピクセル数が上限の4倍を超えるものは拒否する
+    path = write_animation(tmp_path / "anim.gif", "GIF", frames=5, size=(20, 10))
+    monkeypatch.setattr(imaging, "MAX_IMAGE_PIXELS", 20 * 10)
+    with pytest.raises(ImageRejected) as exc_info:
+        probe_image(path, ALLOWED)
+    assert exc_info.value.detail == "Too many frames"
+
+
+def test_animated_webp_keeps_all_frames(tmp_path):
+    source = write_animation(tmp_path / "anim.webp", "WEBP", frames=5, size=(64, 48))
+    output = str(tmp_path / "out.webp")
+    stored = process_animation_file(source, output, 32, 24, None, output_format="WEBP")
+    assert stored["frames"] == 5
+    with Image.open(output) as image:
+        assert image.n_frames == 5
+        assert image.size == (32, 24)
@@ -0,0 +1,179 @@
+import asyncio
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from img import membership as membership_module
+from img.membership import MembershipCache
+from img.models import User
+from lineapi.models.user import User as MainUser
+
+
+@pytest.fixture
+def databases(tmp_path):
+    main_engine = create_engine(f"sqlite:///{tmp_path / 'main.db'}")
+    MainUser.__table__.create(main_engine)
+    local_engine = create_engine(f"sqlite:///{tmp_path / 'local.db'}")
+    User.__table__.create(local_engine)
+    return sessionmaker(bind=main_engine), sessionmaker(bind=local_engine)
+
+
+class CountingFactory:
+    def __init__(self, factory):
+        self.factory = factory
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.factory()
+
+
+def add_main_user(main_factory, invitation_id):
+    db = main_factory()
+    db.add(MainUser(line_id=f"line-{invitation_id}", invitation_id=invitation_id))
+    db.commit()
+    db.close()
+
+
+def delete_main_user(main_factory, invitation_id):
+    db = main_factory()
+    db.query(MainUser).filter(MainUser.invitation_id == invitation_id).delete()
+    db.commit()
+    db.close()
+
+
+def local_ids(local_factory):
+    db = local_factory()
+    try:
+        return {row[0] for row in db.query(User.invitation_id)}
+    finally:
+        db.close()
+
+
+def test_missing_ids_are_cached(databases, monkeypatch):
+    main_factory, local_factory = databases
+    add_main_user(main_factory, "AAAA1111")
+    counting = CountingFactory(main_factory)
+    cache = MembershipCache(counting, local_factory)
+    cache.load()
+    loads = counting.calls
+
+    assert asyncio.run(cache.contains("AAAA1111"))
+    assert counting.calls == loads
+
+    # 存在しないIDは1回だけメインDBに問い合わせる
+    for _ in range(5):
+        assert not asyncio.run(cache.contains("BOGUS999"))
+    assert counting.calls == loads + 1
+    assert cache.stats()["negative_hits"] == 4
+
+    # 期限が切れたら問い合わせ直す
+    monkeypatch.setattr(membership_module, "MEMBERSHIP_NEGATIVE_TTL", 0)
+    cache._missing.clear()
+    assert not asyncio.run(cache.contains("BOGUS999"))
+    assert not asyncio.run(cache.contains("BOGUS999"))
+    assert counting.calls == loads + 3
+
+
+def test_user_created_elsewhere_is_found_and_clears_negative_entry(databases):
+    main_factory, local_factory = databases
+    cache = MembershipCache(main_factory, local_factory)
+    cache.load()
+    assert not asyncio.run(cache.contains("NEWUSER1"))
+
+    cache.add("NEWUSER1")
+    assert asyncio.run(cache.contains("NEWUSER1"))
+
+    add_main_user(main_factory, "NEWUSER2")
+    assert cache.sync() == 1
+    assert asyncio.run(cache.contains("NEWUSER2"))
+    assert "NEWUSER2" in local_ids(local_factory)
+
+
+def test_negative_cache_is_bounded(databases, monkeypatch):
+    main_factory, local_factory = databases
+    monkeypatch.setattr(membership_module, "MAX_NEGATIVE_ENTRIES", 3)
+    cache = MembershipCache(main_factory, local_factory)
+    cache.load()
+    for index in range(10):
+        asyncio.run(cache.contains(f"BOGUS{index:03d}"))
+    assert list(cache._missing) == ["BOGUS007", "BOGUS008", "BOGUS009"]
+
+
+def test_full_reload_removes_deleted_users_from_replica(databases):
+    main_factory, local_factory = databases
+    for invitation_id in ("KEEP0001", "GONE0001"):
+        add_main_user(main_factory, invitation_id)
+    cache = MembershipCache(main_factory, local_factory)
+    cache.load()
+    assert local_ids(local_factory) == {"KEEP0001", "GONE0001"}
+
+    delete_main_user(main_factory, "GONE0001")
+    cache.load()
+    assert local_ids(local_factory) == {"KEEP0001"}
+    assert not asyncio.run(cache.contains("GONE0001"))
+
+
+def test_empty_main_db_does_not_wipe_replica(databases):
+    main_factory, local_factory = databases
+    add_main_user(main_factory, "KEEP0001")
+    cache = MembershipCache(main_factory, local_factory)
+    cache.load()
+    delete_main_user(main_factory, "KEEP0001")
+    cache.load()
+    assert local_ids(local_factory) == {"KEEP0001"}
+
+
+def test_falls_back_to_local_users_before_load(databases):
+    main_factory, local_factory = databases
+    db = local_factory()
+    db.add(User(invitation_id="LOCAL001"))
+    db.commit()
+    db.close()
+    cache = MembershipCache(main_factory, local_factory)
+    assert asyncio.run(cache.contains("LOCAL001"))
+    assert not asyncio.run(cache.contains("NOBODY01"))
+    assert cache.stats()["fallbacks"] == 2
+
+
+@pytest.fixture
+def watched_cache(databases):
+    main_factory, local_factory = databases
+    cache = MembershipCache(main_factory, local_factory)
+    cache.load()
+    cache.watch_user_inserts()
+    yield cache
+    cache.unwatch_user_inserts()
+
+
+def test_inserted_user_is_added_after_commit(databases, watched_cache):
+    main_factory, _ = databases
+    db = main_factory()
+    db.add(MainUser(line_id="line-COMMIT01", invitation_id="COMMIT01"))
+    db.flush()
+    # コミットされるまではメンバーにしない
+    assert "COMMIT01" not in watched_cache._members
+    db.commit()
+    db.close()
+    assert asyncio.run(watched_cache.contains("COMMIT01"))
+
+
+def test_rolled_back_insert_is_not_added(databases, watched_cache):
+    main_factory, _ = databases
+    db = main_factory()
+    db.add(MainUser(line_id="line-ROLLBK01", invitation_id="ROLLBK01"))
+    db.flush()
+    db.rollback()
+    db.close()
+    assert "ROLLBK01" not in watched_cache._members
+
+    # 同じセッションで後からコミットしても、ロールバックした分は反映しない
+    db = main_factory()
+    db.add(MainUser(line_id="line-ROLLBK02", invitation_id="ROLLBK02"))
+    db.flush()
+    db.rollback()
+    db.add(MainUser(line_id="line-COMMIT02", invitation_id="COMMIT02"))
+    db.commit()
+    db.close()
+    assert "ROLLBK02" not in watched_cache._members
+    assert "COMMIT02" in watched_cache._members
+    assert not asyncio.run(watched_cache.contains("ROLLBK01"))
@@ -0,0 +1,29 @@
+import pytest
+import metrics
+
+
+@pytest.mark.parametrize("headers, client_host, expected", [
+    ({}, "127.0.0.1", True),
+    ({}, "::1", True),
+    ({}, "203.0.113.5", False),
+    ({}, None, False),
+    # 同じホストのリバースプロキシ経由
+    ({"x-forwarded-for": "203.0.113.5"}, "127.0.0.1", False),
+    ({"x-real-ip": "203.0.113.5"}, "127.0.0.1", False),
+    ({"forwarded": "for=203.0.113.5"}, "127.0.0.1", False),
+])
+def test_scrape_allowed_from_local_hosts_without_token(monkeypatch, headers, client_host, expected):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", None)
+    assert metrics.is_scrape_allowed(headers, client_host) is expected
+
+
+@pytest.mark.parametrize("headers, expected", [
+    ({"authorization": "Bearer s3cret"}, True),
+    ({"authorization": "Bearer s3cret", "x-forwarded-for": "203.0.113.5"}, True),
+    ({"authorization": "Bearer wrong"}, False),
+    ({"authorization": "s3cret"}, False),
+    ({}, False),
+])
+def test_scrape_requires_token_when_configured(monkeypatch, headers, expected):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "s3cret")
+    assert metrics.is_scrape_allowed(headers, "127.0.0.1") is expected
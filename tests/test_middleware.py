@@ -0,0 +1,106 @@
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.testclient import TestClient
+from middleware import RequestMiddleware, API_NOT_FOUND_BODY
+
+
+class FakeSession:
+    instances = []
+
+    def __init__(self):
+        self.closed = False
+        FakeSession.instances.append(self)
+
+    def close(self):
+        self.closed = True
+
+
+def build_app(**options):
+    app = FastAPI()
+    app.add_middleware(RequestMiddleware, session_class=FakeSession, **options)
+
+    @app.get("/api/items")
+    async def items():
+        return {"items": []}
+
+    @app.get("/api/gone")
+    async def gone():
+        return JSONResponse(status_code=404, content={"detail": "Cast not found"})
+
+    @app.get("/api/session")
+    async def session(request: Request):
+        return {"closed": request.state.db_session.closed}
+
+    @app.get("/api/error")
+    async def error():
+        raise RuntimeError("boom")
+
+    @app.get("/api/stream")
+    async def stream(request: Request):
+        db_session = request.state.db_session
+
+        async def chunks():
+            for _ in range(3):
+                # 送信中はセッションを閉じない
+                yield b"closed" if db_session.closed else b"open"
+        return StreamingResponse(chunks())
+
+    return app
+
+
+@pytest.fixture(autouse=True)
+def reset_sessions():
+    FakeSession.instances.clear()
+
+
+def test_query_headers_are_off_by_default():
+    response = TestClient(build_app()).get("/api/items")
+    assert response.status_code == 200
+    assert "x-db-query-count" not in response.headers
+    assert "x-db-query-time" not in response.headers
+
+
+@pytest.mark.parametrize("path", ["/api/items", "/api/missing"])
+def test_query_headers_when_enabled(path):
+    response = TestClient(build_app(query_headers=True)).get(path)
+    assert response.headers["x-db-query-count"] == "0"
+    assert response.headers["x-db-query-time"].endswith("ms")
+
+
+@pytest.mark.parametrize("path", ["/api/gone", "/api/no/such/route"])
+def test_api_404_is_rewritten(path):
+    response = TestClient(build_app()).get(path)
+    assert response.status_code == 404
+    assert response.content == API_NOT_FOUND_BODY
+    assert response.headers["content-type"] == "application/json"
+    assert response.headers["content-length"] == str(len(API_NOT_FOUND_BODY))
+
+
+def test_non_api_404_is_untouched():
+    response = TestClient(build_app()).get("/no/such/page")
+    assert response.status_code == 404
+    assert response.json() == {"detail": "Not Found"}
+
+
+def test_session_is_shared_and_closed_after_response():
+    response = TestClient(build_app()).get("/api/session")
+    assert response.json() == {"closed": False}
+    assert len(FakeSession.instances) == 1
+    assert FakeSession.instances[0].closed
+
+
+def test_session_is_closed_on_exception():
+    client = TestClient(build_app(), raise_server_exceptions=False)
+    assert client.get("/api/error").status_code == 500
+    assert FakeSession.instances and all(session.closed for session in FakeSession.instances)
+
+    with pytest.raises(RuntimeError):
+        TestClient(build_app()).get("/api/error")
+    assert all(session.closed for session in FakeSession.instances)
+
+
+def test_session_stays_open_while_streaming():
+    response = TestClient(build_app()).get("/api/stream")
+    assert response.content == b"open" * 3
+    assert FakeSession.instances[0].closed
@@ -0,0 +1,155 @@
+import hashlib
+import io
+import os
+import time
+import pytest
+from urllib.parse import urlsplit, parse_qs
+from PIL import Image
+from fastapi.testclient import TestClient
+from conftest import make_image_bytes
+from img import layout, signing
+from img.config import STORAGE_PATH
+from img.main import app, blob_store
+
+USER = "PRIVUSR1"
+PRIVATE_PATH = os.path.join(USER, "id_verification", "passport.jpg")
+PUBLIC_PATH = os.path.join(USER, "blog", "post.jpg")
+
+
+@pytest.fixture(scope="module")
+def client():
+    return TestClient(app)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def stored_files():
+    for logical in (PRIVATE_PATH, PUBLIC_PATH):
+        file_path = layout.physical_path(logical)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as f:
+            f.write(make_image_bytes())
+
+
+def sharded(logical):
+    return os.path.join(*layout.shard_prefix(USER), logical).replace(os.sep, "/")
+
+
+def signed_query(logical, ttl=60):
+    expires, sig = signing.sign_path(logical, ttl)
+    return {"expires": expires, "sig": sig}
+
+
+def test_is_private():
+    assert signing.is_private(PRIVATE_PATH)
+    assert signing.is_private(f"{USER}/./id_verification/a.jpg")
+    assert not signing.is_private(PUBLIC_PATH)
+    assert not signing.is_private("id_verification")
+
+
+def test_sign_and_verify():
+    expires, sig = signing.sign_path(PRIVATE_PATH)
+    assert signing.verify(PRIVATE_PATH, expires, sig)
+    assert not signing.verify(PUBLIC_PATH, expires, sig)
+    assert not signing.verify(PRIVATE_PATH, expires + 1, sig)
+    assert not signing.verify(PRIVATE_PATH, expires, None)
+    expired = int(time.time()) - 1
+    assert not signing.verify(PRIVATE_PATH, expired, signing._signature(PRIVATE_PATH, expired))
+
+
+def test_signed_url_is_accepted(client):
+    url = urlsplit(signing.signed_url(PRIVATE_PATH))
+    query = {name: values[0] for name, values in parse_qs(url.query).items()}
+    response = client.get(f"/{url.path}", params=query)
+    assert response.status_code == 200
+    assert response.headers["cache-control"].startswith("private")
+
+
+def test_private_image_requires_signature(client):
+    assert client.get(f"/i/{PRIVATE_PATH}").status_code == 403
+    assert client.get(f"/i/{PUBLIC_PATH}").status_code == 200
+
+
+def test_resolve_client_path_rejects_physical_shard_paths():
+    assert layout.resolve_client_path(os.path.join(STORAGE_PATH, sharded(PRIVATE_PATH))) is None
+    assert layout.resolve_client_path(os.path.join(STORAGE_PATH, PRIVATE_PATH)) == layout.physical_path(PRIVATE_PATH)
+
+
+@pytest.mark.parametrize("endpoint", ["/i", "/meta"])
+def test_shard_path_does_not_bypass_signature(client, endpoint):
+    # 実パスの形でも非公開ファイルは読めない（署名を付けても論理パスでしか受け付けない）
+    assert client.get(f"{endpoint}/{sharded(PRIVATE_PATH)}").status_code == 403
+    assert client.get(f"{endpoint}/{sharded(PRIVATE_PATH)}", params=signed_query(PRIVATE_PATH)).status_code == 403
+
+
+def test_private_upload_is_not_deduplicated(tmp_path):
+    logical = os.path.join(USER, "id_verification", "license.jpg")
+    file_path = layout.physical_path(logical)
+    source = tmp_path / "upload.jpg"
+    source.write_bytes(make_image_bytes(color=(1, 2, 3)))
+    blob_store.store_unshared(str(source), logical, file_path)
+    assert os.path.exists(file_path)
+    assert blob_store.lookup(logical) is None
+
+
+def test_blob_referenced_by_private_path_is_not_served(client, tmp_path):
+    # 非公開カテゴリを重複排除の対象から外す前に保存されたblob
+    data = make_image_bytes(color=(9, 9, 9))
+    sha256 = hashlib.sha256(data).hexdigest()
+    source = tmp_path / "legacy.jpg"
+    source.write_bytes(data)
+    logical = os.path.join(USER, "id_verification", "legacy.jpg")
+    file_path = layout.physical_path(logical)
+    blob_store.store(str(source), logical, file_path, sha256, len(data))
+    assert client.get(f"/b/{sha256}.jpg").status_code == 404
+
+    # 公開カテゴリのblobはそのまま配信する
+    public = os.path.join(USER, "blog", "shared.jpg")
+    data = make_image_bytes(color=(7, 7, 7))
+    sha256 = hashlib.sha256(data).hexdigest()
+    source.write_bytes(data)
+    blob_store.store(str(source), public, layout.physical_path(public), sha256, len(data))
+    assert client.get(f"/b/{sha256}.jpg").status_code == 200
+
+
+def test_path_owner():
+    assert signing.path_owner(PRIVATE_PATH) == USER
+    assert signing.path_owner(f"{USER}/../OTHER001/id_verification/a.jpg") == "OTHER001"
+
+
+def test_private_categories_are_disabled_without_signing_key(client, monkeypatch):
+    # プロセスごとの鍵で署名すると他のワーカー・再起動後に読めなくなるため、鍵がなければ扱わない
+    query = signed_query(PRIVATE_PATH)
+    monkeypatch.setattr(signing, "SIGNING_KEY", None)
+    assert not signing.is_enabled()
+    assert not signing.verify(PRIVATE_PATH, query["expires"], query["sig"])
+    with pytest.raises(signing.SigningKeyMissing):
+        signing.sign_path(PRIVATE_PATH)
+
+    assert client.get(f"/i/{PRIVATE_PATH}", params=query).status_code == 503
+    assert client.get(f"/meta/{PRIVATE_PATH}", params=query).status_code == 503
+    response = client.post(f"/upload/{USER}/id_verification", files={"file": ("id.jpg", make_image_bytes())})
+    assert response.status_code == 503
+    # 公開カテゴリはそのまま使える
+    assert client.get(f"/i/{PUBLIC_PATH}").status_code == 200
+
+
+def test_private_animation_poster_is_signed(client):
+    frames = [Image.new("RGB", (64, 48), (i * 60, 20, 20)) for i in range(3)]
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format="GIF", save_all=True, append_images=frames[1:], duration=100, loop=0)
+    response = client.post(f"/upload/{USER}/id_verification", files={"file": ("anim.gif", buffer.getvalue())})
+    assert response.status_code == 200
+    result = response.json()
+
+    url = urlsplit(result["signed_url"])
+    query = {name: values[0] for name, values in parse_qs(url.query).items()}
+    meta = client.get(f"/meta/{result['path']}", params=query)
+    assert meta.status_code == 200
+
+    for poster in (result["poster_path"], meta.json()["poster_path"]):
+        assert "sig=" in poster
+        response = client.get(f"/{poster}")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "image/jpeg"
+        # 署名を外した静止画のURLは拒否する
+        assert client.get(f"/{poster.split('?')[0]}", params={"width": 640, "format": "jpeg"}).status_code == 403
@@ -0,0 +1,113 @@
+import os
+import pytest
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+from img.responses import parse_range, is_not_modified, conditional_file_response, file_etag
+
+SIZE = 1000
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=900-", (900, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=990-2000", (990, 999)),
+])
+def test_parse_range_valid(header, expected):
+    assert parse_range(header, SIZE) == expected
+
+
+@pytest.mark.parametrize("header", [
+    None,
+    "",
+    "bytes=",
+    "bytes=-",
+    "bytes=abc-def",
+    "bytes=5-3",
+    "bytes=--3",
+    "bytes=+1-2",
+    "bytes=0-1,5-6",
+    "items=0-1",
+])
+def test_parse_range_ignores_invalid_headers(header):
+    assert parse_range(header, SIZE) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=5000-6000", "bytes=-0"])
+def test_parse_range_unsatisfiable(header):
+    with pytest.raises(HTTPException) as exc_info:
+        parse_range(header, SIZE)
+    assert exc_info.value.status_code == 416
+    assert exc_info.value.headers["Content-Range"] == f"bytes */{SIZE}"
+
+
+class FakeRequest:
+    def __init__(self, **headers):
+        self.headers = {name.replace("_", "-"): value for name, value in headers.items()}
+
+
+@pytest.mark.parametrize("if_none_match, expected", [
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"xyz", "abc"', True),
+    ("*", True),
+    ('"xyz"', False),
+    ('"abcd"', False),
+    ('"xabc"', False),
+])
+def test_is_not_modified_if_none_match(if_none_match, expected):
+    assert is_not_modified(FakeRequest(if_none_match=if_none_match), '"abc"') is expected
+
+
+@pytest.mark.parametrize("if_none_match", ['W/"abc"', '"abc"', '"xyz", W/"abc"'])
+def test_is_not_modified_weak_etag(if_none_match):
+    # 圧縮を挟むプロキシが付けた弱いETagとも一致させる
+    assert is_not_modified(FakeRequest(if_none_match=if_none_match), 'W/"abc"')
+
+
+def test_is_not_modified_if_modified_since():
+    request = FakeRequest(if_modified_since="Sun, 01 Jan 2023 00:00:00 GMT")
+    assert is_not_modified(request, '"abc"', 1672531200)
+    assert not is_not_modified(request, '"abc"', 1672531201)
+    # If-None-Match がある場合はそちらを優先する
+    request = FakeRequest(if_none_match='"xyz"', if_modified_since="Sun, 01 Jan 2023 00:00:00 GMT")
+    assert not is_not_modified(request, '"abc"', 1672531200)
+
+
+@pytest.fixture
+def file_client(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(bytes(range(256)) * 4)
+    app = FastAPI()
+
+    @app.get("/file")
+    async def get_file(request: Request):
+        return conditional_file_response(request, str(path), "application/octet-stream", "max-age=60")
+
+    return TestClient(app), str(path)
+
+
+def test_file_response_range_and_conditional(file_client):
+    client, path = file_client
+    etag = file_etag(os.stat(path))
+
+    full = client.get("/file")
+    assert full.status_code == 200
+    assert full.headers["etag"] == etag
+    assert len(full.content) == 1024
+
+    partial = client.get("/file", headers={"Range": "bytes=10-19"})
+    assert partial.status_code == 206
+    assert partial.headers["content-range"] == "bytes 10-19/1024"
+    assert partial.content == bytes(range(10, 20))
+
+    assert client.get("/file", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/file", headers={"Range": "bytes=2000-"}).status_code == 416
+    # 不正なRangeは無視して全体を返す
+    invalid = client.get("/file", headers={"Range": "bytes=20-10"})
+    assert invalid.status_code == 200
+    assert len(invalid.content) == 1024
+    # If-Rangeが一致しなければ全体を返す
+    stale = client.get("/file", headers={"Range": "bytes=10-19", "If-Range": '"stale"'})
+    assert stale.status_code == 200
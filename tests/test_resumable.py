@@ -0,0 +1,126 @@
+import io
+import os
+import hashlib
+import pytest
+from PIL import Image
+from fastapi.testclient import TestClient
+from img import resumable
+from img.main import app
+
+USER = "RSUSER01"
+CHUNK_SIZE = resumable.MIN_CHUNK_SIZE
+
+
+@pytest.fixture(scope="module")
+def client():
+    return TestClient(app)
+
+
+@pytest.fixture(scope="module")
+def photo():
+    # 3チャンクに分かれる大きさのJPEG（ノイズは圧縮されにくい）
+    image = Image.frombytes("RGB", (800, 600), os.urandom(800 * 600 * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=95)
+    data = buffer.getvalue()
+    assert 2 * CHUNK_SIZE < len(data) <= 3 * CHUNK_SIZE
+    return data
+
+
+def chunk(data, index):
+    return data[index * CHUNK_SIZE:(index + 1) * CHUNK_SIZE]
+
+
+def put_chunk(client, upload_id, index, body, checksum=None):
+    headers = {"X-Chunk-SHA256": checksum or hashlib.sha256(body).hexdigest()}
+    return client.put(f"/resumable/{upload_id}/chunks/{index}", content=body, headers=headers)
+
+
+def create_upload(client, data):
+    response = client.post(f"/resumable/{USER}/blog", data={
+        "filename": "photo.jpg", "size": str(len(data)), "chunk_size": str(CHUNK_SIZE),
+    })
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_chunks_are_assembled_in_any_order(client, photo):
+    status = create_upload(client, photo)
+    upload_id = status["upload_id"]
+    assert status["chunk_count"] == 3
+    assert status["missing"] == [0, 1, 2]
+
+    # 最後のチャンクから順不同で送る
+    assert put_chunk(client, upload_id, 2, chunk(photo, 2)).status_code == 200
+    assert put_chunk(client, upload_id, 0, chunk(photo, 0)).status_code == 200
+
+    response = client.post(f"/resumable/{upload_id}/complete")
+    assert response.status_code == 409
+    assert response.json()["detail"]["missing"] == [1]
+
+    # 再送は上書きになる
+    assert put_chunk(client, upload_id, 1, chunk(photo, 1)).status_code == 200
+    assert put_chunk(client, upload_id, 1, chunk(photo, 1)).status_code == 200
+    assert client.get(f"/resumable/{upload_id}").json()["missing"] == []
+    with open(resumable.partial_path(upload_id), "rb") as f:
+        assert f.read() == photo
+
+    wrong = client.post(f"/resumable/{upload_id}/complete", data={"sha256": "0" * 64})
+    assert wrong.status_code == 422
+
+    response = client.post(f"/resumable/{upload_id}/complete", data={"sha256": hashlib.sha256(photo).hexdigest()})
+    assert response.status_code == 200
+    result = response.json()
+    assert result["path"].startswith(f"{USER}/blog/")
+    assert (result["width"], result["height"]) == (800, 600)
+    assert client.get(f"/i/{result['path']}").status_code == 200
+
+    # 完了後は受信途中のファイルとセッションを削除する
+    assert not os.path.exists(resumable.partial_path(upload_id))
+    assert client.get(f"/resumable/{upload_id}").status_code == 404
+
+
+def test_invalid_chunks_are_rejected(client, photo):
+    upload_id = create_upload(client, photo)["upload_id"]
+    body = chunk(photo, 0)
+
+    assert put_chunk(client, upload_id, 3, chunk(photo, 2)).status_code == 400
+    assert put_chunk(client, upload_id, 0, body[:-1]).status_code == 400
+    assert put_chunk(client, upload_id, 2, chunk(photo, 2) + b"x").status_code == 413
+    assert put_chunk(client, upload_id, 0, body, checksum="0" * 64).status_code == 422
+    assert client.get(f"/resumable/{upload_id}").json()["missing"] == [0, 1, 2]
+    assert put_chunk(client, "no-such-upload", 0, body).status_code == 404
+
+
+def test_expected_chunk_sizes():
+    class Upload:
+        total_size = 2 * CHUNK_SIZE + 10
+        chunk_size = CHUNK_SIZE
+
+    assert resumable.chunk_count(Upload) == 3
+    assert [resumable.expected_chunk_size(Upload, i) for i in range(3)] == [CHUNK_SIZE, CHUNK_SIZE, 10]
+
+
+@pytest.mark.parametrize("crop", [
+    "{not json",
+    "[1, 2]",
+    '{"x": 0, "y": 0, "width": 50}',
+    '{"x": "0", "y": 0, "width": 50, "height": 50}',
+    '{"x": true, "y": 0, "width": 50, "height": 50}',
+    '{"x": 0, "y": 0, "width": 0, "height": 50}',
+    '{"x": 0, "y": 120, "width": 50, "height": 50}',
+])
+def test_invalid_crop_is_rejected(client, crop):
+    response = client.post(f"/resumable/{USER}/blog", data={
+        "filename": "photo.jpg", "size": "100", "crop": crop, "width": "100", "height": "100",
+    })
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid crop"
+
+
+def test_valid_crop_is_accepted(client):
+    response = client.post(f"/resumable/{USER}/blog", data={
+        "filename": "photo.jpg", "size": "100", "width": "100", "height": "100",
+        "crop": '{"unit": "%", "x": 10, "y": 20.5, "width": 40, "height": 50}',
+    })
+    assert response.status_code == 200
@@ -0,0 +1,50 @@
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from static_files import PrecompressedStaticFiles, SpaIndex
+
+
+@pytest.fixture
+def client(tmp_path):
+    static_dir = tmp_path / "static"
+    static_dir.mkdir()
+    (static_dir / "main.1a2b3c4d.js").write_text("console.log('hello');\n" * 200)
+    (tmp_path / "index.html").write_text("<html><body>app</body></html>\n" * 100)
+
+    app = FastAPI()
+    app.mount("/static", PrecompressedStaticFiles(directory=str(static_dir)), name="static")
+    spa_index = SpaIndex(str(tmp_path / "index.html"))
+
+    @app.get("/")
+    async def index(request: Request):
+        return spa_index.response(request)
+
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("url", ["/static/main.1a2b3c4d.js", "/"])
+def test_conditional_requests(client, url):
+    headers = {"Accept-Encoding": "gzip"}
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    etag = response.headers["etag"]
+
+    for if_none_match in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+        cached = client.get(url, headers={**headers, "If-None-Match": if_none_match})
+        assert cached.status_code == 304, if_none_match
+
+    # 部分一致では304にしない
+    for if_none_match in (etag[:-2] + '"', '"x' + etag[1:], f'"{etag}"'):
+        assert client.get(url, headers={**headers, "If-None-Match": if_none_match}).status_code == 200
+
+    # 別のエンコーディングのETagでは304にしない
+    assert client.get(url, headers={"Accept-Encoding": "identity", "If-None-Match": etag}).status_code == 200
+
+
+@pytest.mark.parametrize("method", ["POST", "PUT", "DELETE"])
+def test_only_get_and_head_are_allowed(client, method):
+    response = client.request(method, "/static/main.1a2b3c4d.js")
+    assert response.status_code == 405
+    assert response.headers["allow"] == "GET, HEAD"
+    assert client.head("/static/main.1a2b3c4d.js").status_code == 200
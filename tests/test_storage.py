@@ -0,0 +1,141 @@
+import os
+import hashlib
+import pytest
+from conftest import make_image_bytes
+from img.models import Blob, BlobRef
+from img.storage import BlobStore
+
+
+@pytest.fixture
+def store(tmp_path, img_session_factory):
+    return BlobStore(str(tmp_path / "blobs"), img_session_factory)
+
+
+@pytest.fixture
+def put(tmp_path, store):
+    users = tmp_path / "users"
+
+    def put(logical_path, data):
+        source = tmp_path / f"upload-{hashlib.sha256(logical_path.encode()).hexdigest()[:8]}"
+        source.write_bytes(data)
+        file_path = users / logical_path
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        extension = store.store(str(source), logical_path, str(file_path), hashlib.sha256(data).hexdigest(), len(data))
+        assert not source.exists()
+        return str(file_path), extension
+    return put
+
+
+def blob_row(store, data):
+    db = store.session_factory()
+    try:
+        return db.query(Blob).filter(Blob.sha256 == hashlib.sha256(data).hexdigest()).first()
+    finally:
+        db.close()
+
+
+def blob_file(store, data, extension=".jpg"):
+    return store.blob_path(hashlib.sha256(data).hexdigest(), extension)
+
+
+def test_same_content_is_stored_once(store, put):
+    data = make_image_bytes()
+    first, extension = put("AAAA0001/blog/a.jpg", data)
+    second, _ = put("BBBB0002/blog/b.jpg", data)
+
+    assert extension == ".jpg"
+    assert blob_row(store, data).ref_count == 2
+    assert os.path.samefile(first, blob_file(store, data))
+    assert os.path.samefile(second, blob_file(store, data))
+    assert sorted(store.ref_paths(hashlib.sha256(data).hexdigest())) == ["AAAA0001/blog/a.jpg", "BBBB0002/blog/b.jpg"]
+
+
+def test_release_removes_blob_with_last_reference(store, put):
+    data = make_image_bytes()
+    first, _ = put("AAAA0001/blog/a.jpg", data)
+    second, _ = put("BBBB0002/blog/b.jpg", data)
+
+    store.release("AAAA0001/blog/a.jpg", first)
+    assert not os.path.exists(first)
+    assert blob_row(store, data).ref_count == 1
+    assert os.path.exists(blob_file(store, data))
+
+    store.release("BBBB0002/blog/b.jpg", second)
+    assert blob_row(store, data) is None
+    assert not os.path.exists(blob_file(store, data))
+    # 参照のないパスの解放は何もしない
+    store.release("BBBB0002/blog/b.jpg", second)
+
+
+def test_overwrite_moves_reference_to_new_content(store, put):
+    old = make_image_bytes(color=(1, 1, 1))
+    new = make_image_bytes(color=(2, 2, 2))
+    put("AAAA0001/profile/icon.jpg", old)
+    file_path, _ = put("AAAA0001/profile/icon.jpg", new)
+
+    assert blob_row(store, old) is None
+    assert not os.path.exists(blob_file(store, old))
+    assert blob_row(store, new).ref_count == 1
+    assert store.lookup("AAAA0001/profile/icon.jpg") == hashlib.sha256(new).hexdigest()
+
+    # 同じ内容での上書きは参照数を増やさない
+    put("AAAA0001/profile/icon.jpg", new)
+    assert blob_row(store, new).ref_count == 1
+    assert os.path.samefile(file_path, blob_file(store, new))
+
+
+def test_move_keeps_reference_count(store, put, tmp_path):
+    data = make_image_bytes()
+    src, _ = put("AAAA0001/blog/temp/a.jpg", data)
+    other = make_image_bytes(color=(5, 5, 5))
+    dst, _ = put("AAAA0001/blog/a.jpg", other)
+
+    store.move("AAAA0001/blog/temp/a.jpg", src, "AAAA0001/blog/a.jpg", dst)
+    assert not os.path.exists(src)
+    assert os.path.samefile(dst, blob_file(store, data))
+    assert store.lookup("AAAA0001/blog/temp/a.jpg") is None
+    assert store.lookup("AAAA0001/blog/a.jpg") == hashlib.sha256(data).hexdigest()
+    assert blob_row(store, data).ref_count == 1
+    # 上書きされた移動先の実体は参照がなくなって削除される
+    assert blob_row(store, other) is None
+
+
+def test_refs_are_consistent_with_counts(store, put):
+    data = make_image_bytes()
+    for index in range(3):
+        put(f"AAAA0001/blog/{index}.jpg", data)
+    db = store.session_factory()
+    try:
+        refs = db.query(BlobRef).filter(BlobRef.sha256 == hashlib.sha256(data).hexdigest()).count()
+    finally:
+        db.close()
+    assert refs == blob_row(store, data).ref_count == 3
+
+
+def test_concurrent_insert_from_another_process_is_retried(tmp_path, store, put, monkeypatch):
+    # 別プロセス（ロックを共有しない別のBlobStore）が同じ内容を先に登録した場合
+    data = make_image_bytes(color=(5, 6, 7))
+    put("USER0001/blog/a.jpg", data)
+
+    other = BlobStore(store.blob_dir, store.session_factory)
+    lookups = []
+    find_blob = BlobStore._find_blob
+
+    def stale_find_blob(db, sha256):
+        # 1回目は登録前の状態を読んだことにする
+        lookups.append(sha256)
+        return None if len(lookups) == 1 else find_blob(db, sha256)
+
+    monkeypatch.setattr(other, "_find_blob", stale_find_blob)
+    source = tmp_path / "upload-other"
+    source.write_bytes(data)
+    file_path = tmp_path / "users" / "USER0002" / "blog" / "b.jpg"
+    file_path.parent.mkdir(parents=True)
+    extension = other.store(str(source), "USER0002/blog/b.jpg", str(file_path), hashlib.sha256(data).hexdigest(), len(data))
+
+    assert extension == ".jpg"
+    assert len(lookups) == 2
+    assert not source.exists()
+    assert file_path.read_bytes() == data
+    assert blob_row(store, data).ref_count == 2
+    assert sorted(store.ref_paths(hashlib.sha256(data).hexdigest())) == ["USER0001/blog/a.jpg", "USER0002/blog/b.jpg"]
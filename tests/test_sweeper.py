@@ -0,0 +1,53 @@
+import os
+import time
+from datetime import datetime, timedelta
+from img import layout
+from img.models import UploadSession, ImageFile
+from img.storage import BlobStore
+from img.sweeper import sweep_orphaned_temp_files
+
+USER = "SWEEP001"
+TTL = timedelta(hours=1)
+
+
+def write(path, age):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x" * 10)
+    mtime = time.time() - age.total_seconds()
+    os.utime(path, (mtime, mtime))
+
+
+def test_orphaned_temp_files_are_swept(tmp_path, img_session_factory):
+    storage = str(tmp_path / "users")
+    user_path = layout.sharded_user_dir(USER, storage)
+    old, new = TTL * 2, TTL / 2
+    files = {
+        "blog/.upload_crashed.tmp": (old, False),
+        "blog/.upload_writing.tmp": (new, True),
+        "blog/temp/temp_image.jpg": (old, False),
+        "blog/temp/TOKEN1/session.jpg": (old, True),
+        "blog/temp/listed.jpg": (old, True),
+        "blog/temp/recent.jpg": (new, True),
+        "blog/post.jpg": (old, True),
+    }
+    for relative, (age, _) in files.items():
+        write(os.path.join(user_path, relative), age)
+
+    db = img_session_factory()
+    # DBに載っているものは期限での削除に任せる
+    db.add(UploadSession(
+        token="TOKEN1", invitation_id=USER, category="blog",
+        path=f"{USER}/blog/temp/TOKEN1/session.jpg", expires_at=datetime.now() + TTL,
+    ))
+    db.add(ImageFile(invitation_id=USER, path=f"{USER}/blog/temp/listed.jpg", category="blog", size=10))
+    db.commit()
+    db.close()
+
+    blob_store = BlobStore(str(tmp_path / "blobs"), img_session_factory)
+    removed, reclaimed = sweep_orphaned_temp_files(img_session_factory, blob_store, TTL, storage)
+    assert (removed, reclaimed) == (2, 20)
+    for relative, (_, kept) in files.items():
+        assert os.path.exists(os.path.join(user_path, relative)) is kept, relative
+
+    assert sweep_orphaned_temp_files(img_session_factory, blob_store, TTL, storage) == (0, 0)
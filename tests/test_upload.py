@@ -0,0 +1,95 @@
+import io
+import os
+import pytest
+from PIL import Image
+from fastapi.testclient import TestClient
+from conftest import make_image_bytes
+from img import layout
+from img import main as img_main
+from img.main import app
+
+USER = "UPLOAD01"
+
+
+@pytest.fixture(scope="module")
+def client():
+    return TestClient(app)
+
+
+def upload(client, name, data, **form):
+    return client.post(f"/upload/{USER}/blog", files={"file": (name, data)}, data=form)
+
+
+@pytest.mark.parametrize("name, format", [("icon.png", "PNG"), ("still.gif", "GIF")])
+def test_resized_upload_is_stored_with_jpeg_extension(client, name, format):
+    # 形式の指定がないリサイズはJPEGで保存するので、拡張子もJPEGにする
+    response = upload(client, name, make_image_bytes(format=format), width="32", height="24")
+    assert response.status_code == 200
+    result = response.json()
+    assert result["path"].endswith(".jpg")
+    assert result["content_path"].endswith(".jpg")
+
+    for path in (f"/i/{result['path']}", f"/{result['content_path']}"):
+        served = client.get(path)
+        assert served.status_code == 200
+        assert served.headers["content-type"] == "image/jpeg"
+        assert Image.open(io.BytesIO(served.content)).format == "JPEG"
+
+
+def test_upload_without_resize_keeps_format(client):
+    response = upload(client, "icon.png", make_image_bytes(format="PNG", color=(1, 200, 3)))
+    assert response.status_code == 200
+    result = response.json()
+    assert result["path"].endswith(".png")
+    assert client.get(f"/i/{result['path']}").headers["content-type"] == "image/png"
+
+
+@pytest.mark.parametrize("crop", ["{not json", '{"x": 0, "y": 0}', '"crop"'])
+def test_upload_rejects_invalid_crop(client, crop):
+    response = upload(client, "photo.jpg", make_image_bytes(), width="32", height="24", crop=crop)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid crop"
+
+
+def test_upload_with_crop(client):
+    crop = '{"x": 25, "y": 25, "width": 50, "height": 50}'
+    response = upload(client, "photo.jpg", make_image_bytes(size=(200, 100)), width="50", height="25", crop=crop)
+    assert response.status_code == 200
+    assert (response.json()["width"], response.json()["height"]) == (50, 25)
+
+
+def batch_files(count):
+    return [("files", (f"photo{i}.jpg", make_image_bytes(color=(i * 30, 10, 10)))) for i in range(count)]
+
+
+@pytest.mark.parametrize("specs, index", [
+    ('[{"width": 10, "height": 10}, "bad"]', 1),
+    ('[{"width": "10", "height": 10}]', 0),
+    ('[{"width": 10.5, "height": 10}]', 0),
+    ('[{}, {"width": 10, "height": 10, "crop": {"x": 0}}]', 1),
+    ('[{"format": "tiff"}]', 0),
+    ('[{"file_name": 3}]', 0),
+])
+def test_batch_rejects_invalid_specs_before_saving(client, specs, index):
+    response = client.post(f"/upload_batch/{USER}/reviews", files=batch_files(2), data={"specs": specs})
+    assert response.status_code == 400
+    assert response.json()["detail"] == f"Invalid specs[{index}]"
+    # 正しい指定のファイルも保存しない
+    assert not os.path.exists(os.path.join(layout.user_dir(USER), "reviews"))
+
+
+def test_batch_uses_a_session_per_file(client, monkeypatch):
+    sessions = []
+    session_local = img_main.SessionLocal
+
+    def session_factory():
+        sessions.append(session_local())
+        return sessions[-1]
+
+    monkeypatch.setattr(img_main, "SessionLocal", session_factory)
+    specs = '[{"width": 16, "height": 12}, {}, {"format": "png"}]'
+    response = client.post(f"/upload_batch/{USER}/blog", files=batch_files(3), data={"specs": specs})
+    assert response.status_code == 200
+    assert response.json()["succeeded"] == 3
+    assert len(sessions) == 3
+    assert len({id(session) for session in sessions}) == 3
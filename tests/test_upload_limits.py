@@ -0,0 +1,65 @@
+from fastapi import FastAPI, File, UploadFile, Request
+from fastapi.testclient import TestClient
+from img.limits import UploadSizeLimitMiddleware
+
+LIMIT = 1024
+
+
+def build_app(calls):
+    app = FastAPI()
+    app.add_middleware(UploadSizeLimitMiddleware, limits=[(r"^/upload/", LIMIT), (r"^/raw/", LIMIT)])
+
+    @app.post("/upload/{name}")
+    async def upload(name: str, file: UploadFile = File(...)):
+        calls.append(name)
+        return {"size": len(await file.read())}
+
+    @app.put("/raw/{name}")
+    async def raw(name: str, request: Request):
+        calls.append(name)
+        return {"size": len(await request.body())}
+
+    @app.post("/other")
+    async def other(request: Request):
+        return {"size": len(await request.body())}
+
+    return app
+
+
+def test_rejects_on_content_length_before_reading_body():
+    calls = []
+    client = TestClient(build_app(calls))
+    response = client.post("/upload/a", files={"file": ("a.jpg", b"x" * (LIMIT * 2), "image/jpeg")})
+    assert response.status_code == 413
+    assert calls == []
+
+
+def test_rejects_streamed_body_without_content_length():
+    calls = []
+    client = TestClient(build_app(calls))
+
+    def chunks():
+        for _ in range(4):
+            yield b"x" * LIMIT
+
+    response = client.put("/raw/a", content=chunks())
+    assert response.status_code == 413
+
+
+def test_allows_small_uploads_and_other_paths():
+    calls = []
+    client = TestClient(build_app(calls))
+    response = client.post("/upload/a", files={"file": ("a.jpg", b"x" * 100, "image/jpeg")})
+    assert response.status_code == 200
+    assert response.json() == {"size": 100}
+    assert client.post("/other", content=b"x" * (LIMIT * 4)).status_code == 200
+
+
+def test_limit_applies_to_path_inside_mount():
+    calls = []
+    outer = FastAPI()
+    outer.mount("/img", build_app(calls))
+    client = TestClient(outer)
+    response = client.post("/img/upload/a", files={"file": ("a.jpg", b"x" * (LIMIT * 2), "image/jpeg")})
+    assert response.status_code == 413
+    assert calls == []
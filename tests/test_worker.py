@@ -0,0 +1,40 @@
+import asyncio
+import os
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException
+from img import main as img_main
+from img.worker import ImageWorkerPool
+
+
+@pytest.fixture
+def pool():
+    pool = ImageWorkerPool(max_workers=1, max_queue=4)
+    yield pool
+    pool.shutdown()
+
+
+def test_pool_recovers_after_worker_dies(pool):
+    async def scenario():
+        assert await pool.run(pow, 2, 5) == 32
+        # OOM killer などでワーカープロセスが落ちた場合
+        with pytest.raises(BrokenProcessPool):
+            await pool.run(os._exit, 1)
+        # 次のジョブは新しいプールで実行される
+        assert await pool.run(pow, 3, 2) == 9
+        assert await pool.run(pow, 2, 2) == 4
+
+    asyncio.run(scenario())
+    stats = pool.stats()
+    assert stats["restarts"] == 1
+    assert stats["jobs"]["pow"]["count"] == 3
+    assert stats["jobs"]["_exit"]["failed"] == 1
+
+
+def test_dead_worker_is_reported_as_503(pool, monkeypatch):
+    monkeypatch.setattr(img_main, "image_worker_pool", pool)
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(img_main.run_image_job(os._exit, 1))
+    assert exc_info.value.status_code == 503
+    assert exc_info.value.headers["Retry-After"] == str(pool.retry_after)
+    assert asyncio.run(img_main.run_image_job(pow, 2, 3)) == 8